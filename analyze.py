@@ -0,0 +1,186 @@
+"""
+Read-only summaries of count workbooks, streamed row by row.
+
+Sheets are parsed lazily from the worksheet XML and only running totals are
+kept, so memory stays flat however many rows a sheet has (15-minute exports
+with many sites run to thousands). Nothing is written back.
+
+    python analyze.py counts.xlsx --bound "Bisil Bound" --bound "Athi River Bound"
+    python analyze.py Kitengela_Perfect_Match.xlsx --verify force24
+"""
+import argparse
+import json
+import zipfile
+
+import xlsx_patch
+
+# Vehicle class columns B-M
+CLASS_COLUMNS = list(range(2, 14))
+
+def hourly_sheets(zf):
+    """All sheets except the DAY summary, in workbook order"""
+    return [name for name in xlsx_patch.sheet_parts(zf) if name != 'DAY']
+
+def row_counts(cells):
+    """Typed (non-formula) numbers in B-M of a row, 0 elsewhere"""
+    counts = [0] * len(CLASS_COLUMNS)
+    found = False
+    for i, col in enumerate(CLASS_COLUMNS):
+        cell = cells.get(col)
+        if cell is None or cell.formula is not None:
+            continue
+        if isinstance(cell.value, (int, float)) and not isinstance(cell.value, bool):
+            counts[i] = cell.value
+            found = True
+    return counts if found else None
+
+def bound_of(label, bounds):
+    """The first bound named in the label, or the label itself when no bounds are given"""
+    if not bounds:
+        return label
+    lowered = label.lower()
+    for bound in bounds:
+        if bound.lower() in lowered:
+            return bound
+    return None
+
+def add_counts(totals, counts):
+    for i, count in enumerate(counts):
+        totals[i] += count
+
+def summarize(input_file, bounds=None, sheet_names=None):
+    """
+    Per-sheet, per-bound and per-class totals of the typed counts in B-M.
+    Rows count when column A has text (and names one of bounds, if given);
+    formula cells such as total rows are skipped so nothing is counted twice.
+    """
+    classes = [0] * len(CLASS_COLUMNS)
+    sheets = {}
+    bound_totals = {}
+    with zipfile.ZipFile(input_file) as zf:
+        parts = xlsx_patch.sheet_parts(zf)
+        strings = xlsx_patch.shared_strings(zf)
+        for sheet_name in sheet_names or hourly_sheets(zf):
+            if sheet_name not in parts:
+                continue
+            sheet_classes = [0] * len(CLASS_COLUMNS)
+            rows = 0
+            for _, cells in xlsx_patch.iter_rows(zf, parts[sheet_name], strings, max_col=CLASS_COLUMNS[-1]):
+                cell_a = cells.get(1)
+                label = str(cell_a.value).strip() if cell_a and cell_a.value else ''
+                if not label:
+                    continue
+                bound = bound_of(label, bounds)
+                if bound is None:
+                    continue
+                counts = row_counts(cells)
+                if counts is None:
+                    continue
+                rows += 1
+                add_counts(sheet_classes, counts)
+                add_counts(bound_totals.setdefault(bound, [0] * len(CLASS_COLUMNS)), counts)
+            add_counts(classes, sheet_classes)
+            sheets[sheet_name] = {'rows': rows, 'classes': sheet_classes, 'total': sum(sheet_classes)}
+
+    return {
+        'sheets': sheets,
+        'bounds': {bound: {'classes': totals, 'total': sum(totals)} for bound, totals in bound_totals.items()},
+        'classes': classes,
+        'total': sum(classes),
+        'rows': sum(sheet['rows'] for sheet in sheets.values()),
+    }
+
+def find_direction_rows(zf, parts, strings, directions, reference_sheet='7-8AM', max_row=99):
+    """The force scripts' direction row scan, stopping at max_row"""
+    direction_rows = {}
+    if reference_sheet not in parts:
+        return direction_rows
+    for row, cells in xlsx_patch.iter_rows(zf, parts[reference_sheet], strings, max_col=2):
+        if row > max_row:
+            break
+        cell_a = cells.get(1)
+        if not cell_a or not cell_a.value:
+            continue
+        for direction in directions:
+            if direction.lower() in str(cell_a.value).lower():
+                cell_b = cells.get(2)
+                if cell_b is None or cell_b.formula is None:
+                    direction_rows.setdefault(direction, []).append(row)
+    return direction_rows
+
+def direction_class_totals(input_file, directions):
+    """
+    Per-class sums of each direction's rows over all hourly sheets, as the
+    verify functions of the force scripts compute them, without loading the
+    workbook. Only directions found in the 7-8AM sheet are returned.
+    """
+    with zipfile.ZipFile(input_file) as zf:
+        parts = xlsx_patch.sheet_parts(zf)
+        strings = xlsx_patch.shared_strings(zf)
+        direction_rows = find_direction_rows(zf, parts, strings, directions)
+        row_direction = {row: direction for direction, rows in direction_rows.items() for row in rows}
+        actual_totals = {direction: [0] * len(CLASS_COLUMNS) for direction in direction_rows}
+        last_row = max(row_direction, default=0)
+
+        for sheet_name in hourly_sheets(zf):
+            for row, cells in xlsx_patch.iter_rows(zf, parts[sheet_name], strings, max_col=CLASS_COLUMNS[-1]):
+                if row > last_row:
+                    break
+                if row not in row_direction:
+                    continue
+                for i, col in enumerate(CLASS_COLUMNS):
+                    cell = cells.get(col)
+                    if cell is not None and isinstance(cell.value, (int, float)):
+                        actual_totals[row_direction[row]][i] += cell.value
+    return actual_totals
+
+def print_summary(summary):
+    print(f"Rows counted: {summary['rows']}")
+    print(f"Total vehicles: {summary['total']}")
+    print("\nPer hour:")
+    for sheet_name, sheet in summary['sheets'].items():
+        print(f"  {sheet_name}: {sheet['total']} ({sheet['rows']} rows)")
+    print("\nPer bound:")
+    for bound, totals in summary['bounds'].items():
+        print(f"  {bound}: {totals['total']}")
+    print("\nPer class:")
+    for i, total in enumerate(summary['classes']):
+        print(f"  Class {i+1}: {total}")
+
+def verify(input_file, script):
+    """
+    Stream the checks of force_exact_totals (script='force') or the 24-hour
+    version. Returns {direction: {'expected', 'actual', 'match'}} per direction
+    found in the workbook.
+    """
+    if script == 'force24':
+        from force_exact_totals_24hour import TOTALS, print_24hour_totals as print_totals
+    else:
+        from force_exact_totals import TOTALS, print_forced_totals as print_totals
+    actual_totals = direction_class_totals(input_file, TOTALS.keys())
+    print_totals(TOTALS, actual_totals)
+    return {direction: {'expected': TOTALS[direction], 'actual': actual,
+                        'match': actual == TOTALS[direction]}
+            for direction, actual in actual_totals.items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize count workbooks without loading them")
+    parser.add_argument("input_file")
+    parser.add_argument("--bound", action="append", dest="bounds",
+                        help="group rows whose column A names this bound (repeatable); "
+                             "rows are grouped by their full label otherwise")
+    parser.add_argument("--verify", choices=["force", "force24"],
+                        help="check the totals of force_exact_totals or force_exact_totals_24hour instead")
+    parser.add_argument("--json", help="also write the summary (or with --verify, the expected and actual "
+                                       "per-class totals of each direction) to this JSON file")
+    args = parser.parse_args()
+
+    if args.verify:
+        result = verify(args.input_file, args.verify)
+    else:
+        result = summarize(args.input_file, args.bounds)
+        print_summary(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved to: {args.json}")
@@ -1,13 +1,70 @@
 import json
-import base64
-import openpyxl
+import contextlib
 import random
 import io
-import tempfile
 import os
-from urllib.parse import parse_qs
+import sys
+import time
+
+# Shared helpers live at the project root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import instrument
+
+# Cold start: a new instance imports this module before its first request,
+# so only what every request needs is imported here. openpyxl (most of the
+# import time) is imported by the openpyxl mode, modify_excel.py (with
+# xlsx_patch and recalc) by the patch mode and base64 by JSON requests, the first time they run. A GET request
+# warms an idle instance by doing those imports ahead of the first upload.
+# benchmarks/bench_coldstart.py keeps the import time in check.
+
+# Results are written into one buffer that is reset for every request
+_output_buffer = io.BytesIO()
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+TIME_SHEETS = ('7-8AM', '8-9AM', '9-10AM', '10-11AM', '11-12PM', '12-1PM',
+               '1-2PM', '2-3PM', '3-4PM', '4-5PM', '5-6PM', '6-7PM')
+
+def profile_dir():
+    """Where profiled requests write their reports; only the temp directory is writable when deployed"""
+    if os.environ.get('PROFILE_DIR'):
+        return os.environ['PROFILE_DIR']
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), 'traffic-count-profiles')
+
+def warm_up():
+    """Import what the first upload would otherwise wait for"""
+    start = time.perf_counter()
+    import base64
+    import openpyxl
+    import modify_excel
+    return {'warm': True, 'import_ms': round((time.perf_counter() - start) * 1000, 3)}
+
+def get_header(request, name):
+    """Case-insensitive request header lookup"""
+    headers = getattr(request, 'headers', None) or {}
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+def multipart_body(boundary, parts):
+    """Join (content_type, bytes) parts into a multipart/mixed body in one copy"""
+    chunks = []
+    for content_type, data in parts:
+        chunks += [b'--', boundary, b'\r\nContent-Type: ', content_type.encode(), b'\r\n\r\n', data, b'\r\n']
+    chunks += [b'--', boundary, b'--\r\n']
+    return b''.join(chunks)
 
 def handler(request):
+    if request.method == 'GET':
+        # Warm-up ping
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps(warm_up())
+        }
+    
     if request.method != 'POST':
         return {
             'statusCode': 405,
@@ -15,16 +72,62 @@ def handler(request):
         }
     
     try:
-        data = json.loads(request.body)
-        file_data = base64.b64decode(data['file'])
-        percentage = float(data['percentage'])
-        operation = data['operation']
+        metrics = instrument.Metrics()
+        content_type = get_header(request, 'Content-Type') or ''
+        binary = content_type.startswith('application/octet-stream')
+        
+        with metrics.phase('decode'):
+            if binary:
+                # Raw workbook bytes, parameters in headers
+                file_data = request.body
+                percentage = float(get_header(request, 'X-Percentage') or 13)
+                operation = get_header(request, 'X-Operation') or 'increase'
+                mode = get_header(request, 'X-Mode') or 'openpyxl'
+                seed = get_header(request, 'X-Seed')
+                profile = (get_header(request, 'X-Profile') or '').lower() in ('1', 'true')
+            else:
+                import base64
+                data = json.loads(request.body)
+                file_data = base64.b64decode(data['file'])
+                percentage = float(data['percentage'])
+                operation = data['operation']
+                mode = data.get('mode', 'openpyxl')
+                seed = data.get('seed')
+                profile = bool(data.get('profile'))
+            seed = int(seed) if seed not in (None, '') else None
         
-        modified_file, log_messages = modify_excel(file_data, percentage, operation)
+        # Profiling is opt-in per request; the report paths end up in the metrics
+        profiling = (instrument.profiled(file_data, f'process-excel-{mode}', profile_dir()) if profile
+                     else contextlib.nullcontext())
+        with profiling as metrics.profile:
+            if mode == 'patch':
+                modified_file, log_messages = modify_excel_patch(file_data, percentage, operation, seed, metrics)
+            else:
+                modified_file, log_messages = modify_excel(file_data, percentage, operation, seed, metrics)
         
+        if binary:
+            # The log, the metrics and the workbook travel as separate parts,
+            # no base64. The metrics can't time the encoding they're part of.
+            with metrics.phase('encode'):
+                boundary = os.urandom(16).hex().encode()
+                body = multipart_body(boundary, [
+                    ('text/plain; charset=utf-8', '\n'.join(log_messages).encode('utf-8')),
+                    ('application/json', json.dumps(metrics.as_dict()).encode('utf-8')),
+                    (XLSX_CONTENT_TYPE, modified_file),
+                ])
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': f'multipart/mixed; boundary={boundary.decode()}'},
+                'body': body
+            }
+        
+        with metrics.phase('encode'):
+            import base64
+            encoded_file = base64.b64encode(modified_file).decode('utf-8')
         response = {
-            'file': base64.b64encode(modified_file).decode('utf-8'),
-            'log': '\n'.join(log_messages)
+            'file': encoded_file,
+            'log': '\n'.join(log_messages),
+            'metrics': metrics.as_dict()
         }
         
         return {
@@ -40,72 +143,115 @@ def handler(request):
             'body': json.dumps({'error': str(e)})
         }
     
-def modify_excel(file_data, percentage=13, operation='increase'):
-        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as input_file:
-            input_file.write(file_data)
-            input_path = input_file.name
-        
-        wb = openpyxl.load_workbook(input_path)
+def input_stream(file_data):
+    """File object over the request body; bytes are shared, not copied, where they can be"""
+    if isinstance(file_data, memoryview):
+        # .obj is the whole underlying object, which a slice only covers part of
+        whole = isinstance(file_data.obj, bytes) and file_data.nbytes == len(file_data.obj)
+        file_data = file_data.obj if whole else file_data.tobytes()
+    return io.BytesIO(file_data)
+
+def save_to_buffer(save):
+    """Run save(buffer) into the shared output buffer and return the bytes"""
+    _output_buffer.seek(0)
+    _output_buffer.truncate()
+    try:
+        save(_output_buffer)
+        return _output_buffer.getvalue()
+    finally:
+        # Don't hold on to the previous result between requests
+        _output_buffer.seek(0)
+        _output_buffer.truncate()
+
+def sheet_rng(seed, sheet_name):
+    """Per-sheet jitter source when seeded (same scheme as modify_excel.py), else the global one"""
+    if seed is None:
+        return random
+    return random.Random(f"{seed}:{sheet_name}")
+
+def modify_excel(file_data, percentage=13, operation='increase', seed=None, metrics=None):
+        import openpyxl
         
-        time_sheets = ['7-8AM', '8-9AM', '9-10AM', '10-11AM', '11-12PM', '12-1PM',
-                       '1-2PM', '2-3PM', '3-4PM', '4-5PM', '5-6PM', '6-7PM']
+        metrics = metrics if metrics is not None else instrument.Metrics()
+        metrics.count('bytes_in', len(file_data))
+        with metrics.phase('load_workbook'):
+            wb = openpyxl.load_workbook(input_stream(file_data))
         
         multiplier = (1 + percentage / 100) if operation == 'increase' else (1 - percentage / 100)
         total_modified = 0
         log_messages = []
         
-        for sheet_name in time_sheets:
-            if sheet_name not in wb.sheetnames:
-                continue
-                
-            ws = wb[sheet_name]
-            sheet_modified = 0
-            
-            for idx, row in enumerate(ws.iter_rows(), 1):
-                cell_a = ws.cell(row=idx, column=1)
-                cell_text = str(cell_a.value).lower() if cell_a.value else ''
-                
-                if not cell_text or cell_text.strip() == '' or cell_text.startswith('='):
+        with metrics.phase('modify'):
+            for sheet_name in TIME_SHEETS:
+                if sheet_name not in wb.sheetnames:
                     continue
                     
-                has_numeric_data = False
-                for col_idx in range(2, 14):
-                    cell_value = ws.cell(row=idx, column=col_idx).value
-                    if isinstance(cell_value, (int, float)) and cell_value > 0:
-                        has_numeric_data = True
-                        break
+                ws = wb[sheet_name]
+                rng = sheet_rng(seed, sheet_name)
+                sheet_modified = 0
                 
-                if has_numeric_data and len(cell_text.strip()) > 2:
-                    for col_idx in range(1, 13):
-                        if col_idx < len(row):
-                            cell = row[col_idx]
-                            if isinstance(cell.value, (int, float)) and not str(cell.value).startswith('='):
-                                original = cell.value
-                                if original == 0:
-                                    continue
-                                
-                                modified = original * multiplier
-                                jitter = 1 + (random.random() * 0.04 - 0.02)
-                                new_value = round(modified * jitter)
-                                
-                                if 1 <= original <= 10:
-                                    if operation == 'increase' and new_value <= original:
-                                        new_value = original + 1
-                                    elif operation == 'decrease' and new_value >= original:
-                                        new_value = max(1, original - 1)
-                                
-                                cell.value = new_value
-                                sheet_modified += 1
-                                total_modified += 1
-            
-            log_messages.append(f"Modified {sheet_modified} cells in {sheet_name}")
-        
-        output_buffer = io.BytesIO()
-        wb.save(output_buffer)
-        output_buffer.seek(0)
+                for idx, row in enumerate(ws.iter_rows(), 1):
+                    metrics.count('rows_scanned')
+                    metrics.count('cells_scanned', max(0, min(len(row), 13) - 1))
+                    cell_a = ws.cell(row=idx, column=1)
+                    cell_text = str(cell_a.value).lower() if cell_a.value else ''
+                    
+                    if not cell_text or cell_text.strip() == '' or cell_text.startswith('='):
+                        continue
+                        
+                    has_numeric_data = False
+                    for col_idx in range(2, 14):
+                        cell_value = ws.cell(row=idx, column=col_idx).value
+                        if isinstance(cell_value, (int, float)) and cell_value > 0:
+                            has_numeric_data = True
+                            break
+                    
+                    if has_numeric_data and len(cell_text.strip()) > 2:
+                        for col_idx in range(1, 13):
+                            if col_idx < len(row):
+                                cell = row[col_idx]
+                                if isinstance(cell.value, (int, float)) and not str(cell.value).startswith('='):
+                                    original = cell.value
+                                    if original == 0:
+                                        continue
+                                    
+                                    modified = original * multiplier
+                                    jitter = 1 + (rng.random() * 0.04 - 0.02)
+                                    new_value = round(modified * jitter)
+                                    
+                                    if 1 <= original <= 10:
+                                        if operation == 'increase' and new_value <= original:
+                                            new_value = original + 1
+                                        elif operation == 'decrease' and new_value >= original:
+                                            new_value = max(1, original - 1)
+                                    
+                                    cell.value = new_value
+                                    sheet_modified += 1
+                                    total_modified += 1
+                
+                log_messages.append(f"Modified {sheet_modified} cells in {sheet_name}")
         
-        os.unlink(input_path)
+        with metrics.phase('save'):
+            output = save_to_buffer(wb.save)
+        metrics.count('cells_modified', total_modified)
+        metrics.count('bytes_out', len(output))
         
         log_messages.append(f"Total: {total_modified} cells modified")
         
-        return output_buffer.getvalue(), log_messages
\ No newline at end of file
+        return output, log_messages
+
+def modify_excel_patch(file_data, percentage=13, operation='increase', seed=None, metrics=None):
+        """
+        Patch mode of modify_excel.py, so the function rewrites the same
+        cells and brings the same formula results up to date as the script
+        """
+        import modify_excel as script
+        
+        metrics = metrics if metrics is not None else instrument.Metrics()
+        input_buffer = input_stream(file_data)
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            output = save_to_buffer(lambda buffer: script.modify_excel(
+                input_buffer, buffer, percentage, operation, mode='patch', seed=seed, metrics=metrics))
+        
+        return output, [line for line in log.getvalue().splitlines() if line]
@@ -0,0 +1,72 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { getJobQueue, JobEvent } from '@/lib/jobs';
+
+// Comment lines every so often keep proxies from closing an idle stream
+const HEARTBEAT_MS = 15_000;
+
+// Server-Sent Events for one job. What happened before the client connected
+// is replayed first, then "progress" events ({message}: the lines the Python
+// side prints, e.g. "Modified N cells in 7-8AM") and "status" events
+// ({status, position?, error?}) follow as they happen. The stream ends after
+// the "done" or "failed" status.
+export async function GET(request: NextRequest, { params }: { params: Promise<{ id: string }> }) {
+  const { id } = await params;
+  const queue = getJobQueue();
+  const summary = queue.summary(id);
+  if (!summary) {
+    return NextResponse.json({ error: 'Unknown or expired job' }, { status: 404 });
+  }
+
+  const encoder = new TextEncoder();
+  let cleanup = () => {};
+
+  const stream = new ReadableStream<Uint8Array>({
+    start(controller) {
+      let closed = false;
+      const send = (event: string, data: unknown) => {
+        if (closed) return;
+        controller.enqueue(encoder.encode(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`));
+      };
+      const finished = (status?: string) => status === 'done' || status === 'failed';
+
+      send('status', { status: summary.status, position: summary.position, error: summary.error });
+      for (const message of summary.progress) send('progress', { message });
+      if (finished(summary.status)) {
+        controller.close();
+        return;
+      }
+
+      const heartbeat = setInterval(() => {
+        if (!closed) controller.enqueue(encoder.encode(': ping\n\n'));
+      }, HEARTBEAT_MS);
+      const unsubscribe = queue.subscribe(id, (event: JobEvent) => {
+        if (event.type === 'progress') {
+          send('progress', { message: event.message });
+          return;
+        }
+        send('status', { status: event.status, error: event.error });
+        if (finished(event.status)) {
+          cleanup();
+          controller.close();
+        }
+      });
+      cleanup = () => {
+        closed = true;
+        clearInterval(heartbeat);
+        unsubscribe();
+      };
+      request.signal.addEventListener('abort', () => cleanup());
+    },
+    cancel() {
+      cleanup();
+    },
+  });
+
+  return new Response(stream, {
+    headers: {
+      'Content-Type': 'text/event-stream',
+      'Cache-Control': 'no-cache, no-transform',
+      Connection: 'keep-alive',
+    },
+  });
+}
@@ -0,0 +1,18 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { getJobQueue } from '@/lib/jobs';
+import { ProcessedWorkbook, workbookResponse } from '@/lib/process-workbook';
+
+export async function GET(_request: NextRequest, { params }: { params: Promise<{ id: string }> }) {
+  const { id } = await params;
+  const job = getJobQueue<ProcessedWorkbook>().get(id);
+  if (!job) {
+    return NextResponse.json({ error: 'Unknown or expired job' }, { status: 404 });
+  }
+  if (job.status === 'failed') {
+    return NextResponse.json({ error: job.error || 'Processing failed' }, { status: 500 });
+  }
+  if (job.status !== 'done' || !job.result) {
+    return NextResponse.json({ status: job.status }, { status: 409, headers: { 'Retry-After': '2' } });
+  }
+  return workbookResponse(job.result);
+}
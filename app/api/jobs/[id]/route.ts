@@ -0,0 +1,13 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { getJobQueue } from '@/lib/jobs';
+
+// Job status for polling clients: status, queue position and the progress
+// lines reported so far
+export async function GET(_request: NextRequest, { params }: { params: Promise<{ id: string }> }) {
+  const { id } = await params;
+  const summary = getJobQueue().summary(id);
+  if (!summary) {
+    return NextResponse.json({ error: 'Unknown or expired job' }, { status: 404 });
+  }
+  return NextResponse.json(summary);
+}
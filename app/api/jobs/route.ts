@@ -0,0 +1,81 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { AdmissionError, getUploadLimiter } from '@/lib/admission';
+import { getJobQueue, jobsEnabled, QueueFullError } from '@/lib/jobs';
+import { getMetrics, RequestTimer } from '@/lib/metrics';
+import { processWorkbook, ProcessedWorkbook, readWorkbookRequest } from '@/lib/process-workbook';
+import { readUpload, UploadError } from '@/lib/upload';
+import { SessionExpiredError } from '@/lib/workbook-sessions';
+
+// Submit a workbook as a background job. Takes the same form fields as
+// /api/modify-excel and answers 202 with the job id straight away; follow it
+// with /api/jobs/{id} (polling) or /api/jobs/{id}/events (Server-Sent
+// Events) and fetch the workbook from /api/jobs/{id}/result. The upload is
+// read with the same size limit, and through the same admission limiter
+// (lib/admission.ts) so only so many bodies are read at once; the job queue
+// then bounds how many uploads, and how many bytes of them, wait to run.
+// Serverless builds don't serve it (see next.config.ts).
+export async function POST(request: NextRequest) {
+  if (!jobsEnabled()) {
+    return NextResponse.json(
+      { error: 'Background jobs are not available on this deployment; use /api/modify-excel' },
+      { status: 501 }
+    );
+  }
+  const timer = new RequestTimer();
+  let release: (() => void) | undefined;
+  try {
+    release = await timer.time('admission', () => getUploadLimiter().acquire(request.signal));
+    const upload = await timer.time('upload', () => readUpload(request));
+    const workbook = await timer.time('read_upload', () => readWorkbookRequest(upload));
+
+    if (!workbook) {
+      return NextResponse.json({ error: 'No file provided' }, { status: 400 });
+    }
+
+    const queue = getJobQueue<ProcessedWorkbook>();
+    const submittedAt = performance.now();
+    // Recorded as "jobs" in /api/metrics once the job has run; latency there
+    // is from upload to result, queueing included
+    const job = queue.submit(async (report) => {
+      timer.add('queue', performance.now() - submittedAt);
+      try {
+        const result = await processWorkbook(workbook, report, timer);
+        getMetrics().record('jobs', { status: 200, timer, python: result.metrics, cache: result.cache });
+        return result;
+      } catch (error) {
+        getMetrics().record('jobs', { status: 500, timer });
+        throw error;
+      }
+    }, workbook.fileHash ? 0 : workbook.buffer.length);
+    return NextResponse.json(queue.summary(job.id), {
+      status: 202,
+      headers: { Location: `/api/jobs/${job.id}` },
+    });
+  } catch (error) {
+    if (error instanceof AdmissionError) {
+      return NextResponse.json(
+        { error: error.message },
+        { status: error.status, headers: { 'Retry-After': String(error.retryAfter) } }
+      );
+    }
+    if (error instanceof UploadError) {
+      return NextResponse.json({ error: error.message }, { status: error.status });
+    }
+    if (error instanceof SessionExpiredError) {
+      return NextResponse.json({ error: error.message }, { status: 410 });
+    }
+    if (error instanceof QueueFullError) {
+      return NextResponse.json(
+        { error: error.message },
+        { status: 503, headers: { 'Retry-After': '5' } }
+      );
+    }
+    if (request.signal.aborted) {
+      return new NextResponse(null, { status: 499 });
+    }
+    console.error(error);
+    return NextResponse.json({ error: 'Could not start processing' }, { status: 500 });
+  } finally {
+    release?.();
+  }
+}
@@ -0,0 +1,11 @@
+import { NextResponse } from 'next/server';
+import { getUploadLimiter } from '@/lib/admission';
+import { getMetrics } from '@/lib/metrics';
+
+// Latency histograms, phase timings and counters since the server started
+// (see lib/metrics.ts), and the uploads being processed or waiting right now
+export async function GET() {
+  return NextResponse.json({ ...getMetrics().snapshot(), admission: getUploadLimiter().stats() }, {
+    headers: { 'Cache-Control': 'no-store' },
+  });
+}
@@ -1,74 +1,64 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { exec } from 'child_process';
-import { promisify } from 'util';
-import { writeFile, readFile, unlink } from 'fs/promises';
-import path from 'path';
-
-const execAsync = promisify(exec);
+import { AdmissionError, getUploadLimiter } from '@/lib/admission';
+import { getMetrics, RequestTimer } from '@/lib/metrics';
+import { PoolBusyError } from '@/lib/python-pool';
+import { processWorkbook, readWorkbookRequest, workbookResponse } from '@/lib/process-workbook';
+import { readUpload, UploadError } from '@/lib/upload';
+import { SessionExpiredError } from '@/lib/workbook-sessions';
 
+// Takes the workbook as multipart/form-data (file plus fields) or as a raw
+// application/octet-stream body with the fields in X-* headers; see
+// lib/upload.ts. Requests beyond the concurrency limit wait for a slot before
+// their body is read, or are turned away with 429/503; see lib/admission.ts.
 export async function POST(request: NextRequest) {
+  const timer = new RequestTimer();
+  const metrics = getMetrics();
+  let release: (() => void) | undefined;
   try {
-    const formData = await request.formData();
-    const file = formData.get('file') as File;
-    const percentage = formData.get('percentage') as string || '13';
-    const operation = formData.get('operation') as string || 'increase';
-    
-    if (!file) {
+    release = await timer.time('admission', () => getUploadLimiter().acquire(request.signal));
+    const upload = await timer.time('upload', () => readUpload(request));
+    const workbook = await timer.time('read_upload', () => readWorkbookRequest(upload));
+
+    if (!workbook) {
+      metrics.record('modify-excel', { status: 400, timer });
       return NextResponse.json({ error: 'No file provided' }, { status: 400 });
     }
 
-    const bytes = await file.arrayBuffer();
-    const buffer = Buffer.from(bytes);
-    
-    let modifiedFile: Buffer;
-    let logOutput: string;
-    
-    // Use different processing based on environment
-    if (process.env.VERCEL_URL) {
-      // Production: Use Vercel Python function
-      const pythonResponse = await fetch(`${process.env.VERCEL_URL}/api/python/process-excel`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          file: buffer.toString('base64'),
-          percentage: percentage,
-          operation: operation
-        })
-      });
-
-      if (!pythonResponse.ok) {
-        const error = await pythonResponse.json();
-        throw new Error(error.error || 'Python processing failed');
-      }
-
-      const result = await pythonResponse.json();
-      modifiedFile = Buffer.from(result.file, 'base64');
-      logOutput = result.log;
-    } else {
-      // Development: Use local Python script
-      const inputPath = path.join(process.cwd(), `temp_input_${Date.now()}.xlsx`);
-      const outputPath = path.join(process.cwd(), `temp_output_${Date.now()}.xlsx`);
-      
-      await writeFile(inputPath, buffer);
-      
-      const { stdout } = await execAsync(`python modify_excel.py "${inputPath}" "${outputPath}" ${percentage} ${operation}`);
-      
-      modifiedFile = await readFile(outputPath);
-      logOutput = stdout;
-      
-      await unlink(inputPath);
-      await unlink(outputPath);
-    }
-    
-    return new NextResponse(new Uint8Array(modifiedFile), {
-      headers: {
-        'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        'Content-Disposition': 'attachment; filename="Modified_Traffic_Counts.xlsx"',
-        'X-Process-Log': Buffer.from(logOutput).toString('base64'),
-      },
-    });
+    const result = await processWorkbook(workbook, undefined, timer);
+    metrics.record('modify-excel', { status: 200, timer, python: result.metrics, cache: result.cache });
+    return workbookResponse(result, timer);
   } catch (error) {
+    if (error instanceof AdmissionError) {
+      metrics.record('modify-excel', { status: error.status, timer });
+      return NextResponse.json(
+        { error: error.message },
+        { status: error.status, headers: { 'Retry-After': String(error.retryAfter) } }
+      );
+    }
+    if (error instanceof UploadError) {
+      metrics.record('modify-excel', { status: error.status, timer });
+      return NextResponse.json({ error: error.message }, { status: error.status });
+    }
+    if (error instanceof SessionExpiredError) {
+      metrics.record('modify-excel', { status: 410, timer });
+      return NextResponse.json({ error: error.message }, { status: 410 });
+    }
+    if (error instanceof PoolBusyError) {
+      metrics.record('modify-excel', { status: 503, timer });
+      return NextResponse.json(
+        { error: error.message },
+        { status: 503, headers: { 'Retry-After': '5' } }
+      );
+    }
+    if (request.signal.aborted) {
+      // Nobody is left to answer; 499 as in nginx's "client closed request"
+      metrics.record('modify-excel', { status: 499, timer });
+      return new NextResponse(null, { status: 499 });
+    }
     console.error(error);
+    metrics.record('modify-excel', { status: 500, timer });
     return NextResponse.json({ error: 'Processing failed' }, { status: 500 });
+  } finally {
+    release?.();
   }
 }
@@ -0,0 +1,20 @@
+import { NextResponse } from 'next/server';
+import { getPythonPool } from '@/lib/python-pool';
+
+// Warm-up ping, sent by the page when it loads. In production it wakes the
+// Python function, whose GET handler does the imports the first upload would
+// otherwise wait for; in development it starts the worker pool.
+export async function GET() {
+  if (process.env.VERCEL_URL) {
+    try {
+      const response = await fetch(`${process.env.VERCEL_URL}/api/python/process-excel`, { cache: 'no-store' });
+      return NextResponse.json(await response.json(), { status: response.status });
+    } catch (error) {
+      console.error('Warm-up failed', error);
+      return NextResponse.json({ warm: false }, { status: 502 });
+    }
+  }
+
+  getPythonPool();
+  return NextResponse.json({ warm: true });
+}
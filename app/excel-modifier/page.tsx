@@ -12,6 +12,8 @@ import {
   Sun,
 } from "lucide-react";
 
+// Set at build time by next.config.ts
+const useJobs = process.env.NEXT_PUBLIC_JOB_API !== "0";
 
 export default function ExcelTrafficModifier() {
   const [file, setFile] = useState<File | null>(null);
@@ -29,6 +31,9 @@ export default function ExcelTrafficModifier() {
   );
   const [darkMode, setDarkMode] = useState(false);
   const [downloading, setDownloading] = useState(false);
+  // Hash of the selected file once the server has it; re-runs with other
+  // settings send this instead of uploading the file again
+  const [fileHash, setFileHash] = useState<string | null>(null);
 
 
   useEffect(() => {
@@ -39,6 +44,12 @@ export default function ExcelTrafficModifier() {
     }
   }, []);
 
+  // Wake the Python side while the user picks a file, so the first upload
+  // doesn't wait for a cold start
+  useEffect(() => {
+    fetch("/api/warmup").catch(() => {});
+  }, []);
+
   const toggleDarkMode = () => {
     const newMode = !darkMode;
     setDarkMode(newMode);
@@ -61,6 +72,7 @@ export default function ExcelTrafficModifier() {
     const uploadedFile = e.target.files?.[0];
     if (uploadedFile) {
       setFile(uploadedFile);
+      setFileHash(null);
       setDownloadUrl(null);
       setStatus("");
       setLog([]);
@@ -94,6 +106,7 @@ export default function ExcelTrafficModifier() {
     setDragActive(false);
     if (e.dataTransfer.files?.[0]) {
       setFile(e.dataTransfer.files[0]);
+      setFileHash(null);
       setDownloadUrl(null);
       setStatus("");
       setLog([]);
@@ -127,27 +140,89 @@ export default function ExcelTrafficModifier() {
     addLog("Starting processing...");
 
     try {
-      const formData = new FormData();
-      formData.append("file", file);
-      formData.append("percentage", percentage.toString());
-      formData.append("operation", operation);
-
-      const response = await fetch("/api/modify-excel", {
-        method: "POST",
-        body: formData,
-      });
-
-      if (!response.ok) {
-        throw new Error("Processing failed");
+      const submit = (upload: boolean) => {
+        const formData = new FormData();
+        if (upload || !fileHash) {
+          formData.append("file", file);
+        } else {
+          formData.append("fileHash", fileHash);
+        }
+        formData.append("percentage", percentage.toString());
+        formData.append("operation", operation);
+
+        // Where the job API is served, the run is a background job whose
+        // progress lines stream in over Server-Sent Events; otherwise (on
+        // Vercel, see next.config.ts) the workbook comes back in one request
+        return fetch(useJobs ? "/api/jobs" : "/api/modify-excel", {
+          method: "POST",
+          body: formData,
+        });
+      };
+
+      let submitted = await submit(false);
+      if (submitted.status === 410) {
+        // The server no longer holds the workbook
+        submitted = await submit(true);
+      }
+
+      if (!submitted.ok) {
+        throw new Error(
+          submitted.status === 503 || submitted.status === 429
+            ? "Server is busy, try again shortly"
+            : "Processing failed"
+        );
       }
 
+      let response = submitted;
+      let streamed = false;
+      if (useJobs) {
+        const { id } = await submitted.json();
+
+        await new Promise<void>((resolve, reject) => {
+          const events = new EventSource(`/api/jobs/${id}/events`);
+          events.addEventListener("progress", (event) => {
+            const { message } = JSON.parse((event as MessageEvent).data);
+            streamed = true;
+            addLog(message);
+          });
+          events.addEventListener("status", (event) => {
+            const { status, position, error } = JSON.parse((event as MessageEvent).data);
+            if (status === "queued" && position !== undefined) {
+              addLog(`Waiting in queue (position ${position + 1})...`);
+            } else if (status === "done") {
+              events.close();
+              resolve();
+            } else if (status === "failed") {
+              events.close();
+              reject(new Error(error || "Processing failed"));
+            }
+          });
+          events.onerror = () => {
+            events.close();
+            reject(new Error("Lost connection to the server"));
+          };
+        });
+
+        response = await fetch(`/api/jobs/${id}/result`);
+
+        if (!response.ok) {
+          throw new Error("Processing failed");
+        }
+      }
+
+      // The synchronous route and cached results produce no progress
+      // events; their log comes with the file
       const processLog = response.headers.get("X-Process-Log");
-      if (processLog) {
+      if (processLog && !streamed) {
         const decodedLog = atob(processLog);
         decodedLog.split("\n").forEach((line) => {
           if (line.trim()) addLog(line);
         });
       }
+      setFileHash(response.headers.get("X-File-Hash"));
+      if (response.headers.get("X-Cache") === "HIT") {
+        addLog("Served from the result cache");
+      }
 
       const blob = await response.blob();
       const url = URL.createObjectURL(blob);
@@ -0,0 +1,201 @@
+"""
+Run modify_excel / force_exact_totals / force_exact_totals_24hour over many
+workbooks at once, spread across a process pool.
+
+The manifest is a JSON file of defaults plus per-file overrides, matched
+against file names with shell-style patterns (later patterns win):
+
+    {
+        "defaults": {"task": "modify", "percentage": 13, "operation": "increase"},
+        "files": {
+            "*Day 3*": {"task": "force24"},
+            "Kitengela*": {"percentage": 8, "operation": "decrease"}
+        }
+    }
+
+Tasks are "modify" (percentage, operation, mode, engine, seed), "force" and
+"force24" (engine, seed). A file without a seed gets its own random one,
+kept in the summary and the journal so the run can be repeated. Each workbook's change journal is written next to its
+output (see journal.py) unless "journal" is false, and with "export": true
+its changed counts are written there as a table too (see change_log.py).
+A failing workbook is recorded in the summary and the rest of the batch
+carries on.
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fnmatch import fnmatch
+
+import change_log
+
+TASKS = {
+    'modify': '_modified',
+    'force': '_forced',
+    'force24': '_forced_24hour',
+}
+
+DEFAULTS = {
+    'task': 'modify',
+    'percentage': 13,
+    'operation': 'increase',
+    'mode': 'openpyxl',
+    'engine': None,
+    'seed': None,
+    'export': False,
+    'journal': True,
+}
+
+def find_workbooks(source):
+    """Workbooks in a directory, or matching a glob pattern"""
+    if os.path.isdir(source):
+        pattern = os.path.join(source, '*.xlsx')
+    else:
+        pattern = source
+    # Skip Excel's lock files for workbooks that are open
+    return sorted(path for path in glob.glob(pattern)
+                  if path.endswith('.xlsx') and not os.path.basename(path).startswith('~$'))
+
+def load_manifest(path):
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def file_params(manifest, path):
+    """Defaults overlaid with every manifest entry whose pattern matches the file"""
+    params = dict(DEFAULTS, **manifest.get('defaults', {}))
+    name = os.path.basename(path)
+    for pattern, overrides in manifest.get('files', {}).items():
+        if fnmatch(name, pattern) or fnmatch(path, pattern):
+            params.update(overrides)
+    if params['task'] not in TASKS:
+        raise ValueError(f"Unknown task {params['task']!r} for {name}")
+    return params
+
+def output_path(path, output_dir, task):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_dir, stem + TASKS[task] + '.xlsx')
+
+def run_task(params, input_file, output_file, recorder=None, seed=None):
+    """Run one workbook through its task and return the cells written per sheet"""
+    task = params['task']
+    if task == 'modify':
+        from modify_excel import modify_excel
+        return modify_excel(input_file, output_file, float(params['percentage']), params['operation'],
+                            params['mode'], params['engine'] or 'python', seed=seed, recorder=recorder)
+    if task == 'force':
+        from force_exact_totals import force_exact_totals
+        return force_exact_totals(input_file, output_file, params['engine'] or 'openpyxl', recorder=recorder,
+                                  seed=seed)
+    from force_exact_totals_24hour import force_exact_totals_24hour
+    return force_exact_totals_24hour(input_file, output_file, params['engine'] or 'openpyxl', recorder=recorder,
+                                     seed=seed)
+
+def process_file(params, input_file, output_file):
+    """Worker entry point: never raises, the outcome goes into the returned record"""
+    record = {'input': input_file, 'output': output_file, 'params': params}
+    log = io.StringIO()
+    start = time.perf_counter()
+    try:
+        seed = params.get('seed')
+        if seed is None:
+            # Each file its own draw: pool processes forked from one parent
+            # would otherwise start from the same global random state
+            seed = random.SystemRandom().randrange(1 << 32)
+        record['seed'] = seed
+        recorder = change_log.ChangeRecorder() if params.get('export') or params.get('journal') else None
+        with contextlib.redirect_stdout(log):
+            cells = run_task(params, input_file, output_file, recorder, seed)
+        if params.get('export'):
+            record['export'] = change_log.write_table(recorder, os.path.splitext(output_file)[0] + '.parquet')
+        if params.get('journal'):
+            run = change_log.run_record('batch:' + params['task'], input_file, output_file, params, seed)
+            record['journal'] = change_log.write_journal(recorder, change_log.journal_path(output_file), run)
+        record['ok'] = True
+        record['cells'] = cells or {}
+        record['total_cells'] = sum(record['cells'].values())
+    except Exception as e:
+        record['ok'] = False
+        record['error'] = f"{type(e).__name__}: {e}"
+        record['traceback'] = traceback.format_exc()
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    record['log'] = log.getvalue()
+    return record
+
+def run_batch(source, output_dir, manifest_file=None, workers=None, summary_file=None):
+    workbooks = find_workbooks(source)
+    if not workbooks:
+        print(f"No workbooks found for {source}")
+        return None
+    manifest = load_manifest(manifest_file)
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+
+    print(f"Processing {len(workbooks)} workbooks with {workers} workers")
+    start = time.perf_counter()
+    records = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for path in workbooks:
+            try:
+                params = file_params(manifest, path)
+            except ValueError as e:
+                records.append({'input': path, 'ok': False, 'error': str(e), 'seconds': 0})
+                print(f"FAILED {path}: {e}")
+                continue
+            future = pool.submit(process_file, params, path, output_path(path, output_dir, params['task']))
+            futures[future] = path
+
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. BrokenProcessPool)
+                record = {'input': path, 'ok': False, 'error': f"{type(e).__name__}: {e}", 'seconds': None}
+            records.append(record)
+            if record['ok']:
+                print(f"OK     {path}: {record['total_cells']} cells in {record['seconds']}s")
+            else:
+                print(f"FAILED {path}: {record['error']}")
+
+    elapsed = time.perf_counter() - start
+    records.sort(key=lambda record: workbooks.index(record['input']))
+    succeeded = sum(1 for record in records if record['ok'])
+    summary = {
+        'source': source,
+        'output_dir': output_dir,
+        'workers': workers,
+        'files': len(records),
+        'succeeded': succeeded,
+        'failed': len(records) - succeeded,
+        'total_cells': sum(record.get('total_cells', 0) for record in records),
+        'wall_seconds': round(elapsed, 3),
+        'cpu_seconds': round(sum(record['seconds'] or 0 for record in records), 3),
+        'results': records,
+    }
+
+    print(f"\nDone: {succeeded}/{len(records)} succeeded in {elapsed:.2f}s")
+    summary_file = summary_file or os.path.join(output_dir, 'batch_summary.json')
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"Summary: {summary_file}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process a folder of count workbooks in parallel")
+    parser.add_argument("source", help="directory of .xlsx files or a glob pattern")
+    parser.add_argument("--manifest", help="JSON file of per-file parameters")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of CPUs")
+    parser.add_argument("--summary", help="summary JSON path (default: OUTPUT_DIR/batch_summary.json)")
+    args = parser.parse_args()
+    summary = run_batch(args.source, args.output_dir, args.manifest, args.workers, args.summary)
+    raise SystemExit(0 if summary and not summary['failed'] else 1)
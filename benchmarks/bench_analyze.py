@@ -0,0 +1,74 @@
+"""
+Peak memory of read-only analysis as the rows per sheet grow: streamed
+(analyze.py) vs a full openpyxl load.
+
+For each size the per-bound summary and the force_exact_totals_24hour check
+are run; the peak traced allocation should stay flat for the streamed
+variants and grow with the workbook for openpyxl.
+
+    python benchmarks/bench_analyze.py --rows-per-bound 100 500 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def openpyxl_summary(path, bounds):
+    import openpyxl
+    wb = openpyxl.load_workbook(path)
+    total = 0
+    for ws in wb.worksheets:
+        if ws.title == 'DAY':
+            continue
+        for row in ws.iter_rows(min_col=1, max_col=13, values_only=True):
+            if row[0] and any(bound.lower() in str(row[0]).lower() for bound in bounds):
+                total += sum(value for value in row[1:] if isinstance(value, (int, float)))
+    return total
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows-per-bound', type=int, nargs='+', default=[100, 500, 2000])
+    parser.add_argument('--skip-openpyxl', action='store_true', help='only measure the streamed variants')
+    args = parser.parse_args()
+
+    import analyze
+    from benchmarks.synthetic import BOUNDS, generate_workbook
+    from force_exact_totals_24hour import TOTALS
+
+    variants = [
+        ('stream summary', analyze.summarize, lambda path: (path, BOUNDS)),
+        ('stream verify', analyze.direction_class_totals, lambda path: (path, TOTALS.keys())),
+    ]
+    if not args.skip_openpyxl:
+        variants.append(('openpyxl summary', openpyxl_summary, lambda path: (path, BOUNDS)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows_per_bound in args.rows_per_bound:
+            path = os.path.join(tmp, f'synthetic_{rows_per_bound}.xlsx')
+            generate_workbook(path, hours=24, rows_per_bound=rows_per_bound)
+            size = os.path.getsize(path)
+            print(f"{rows_per_bound} rows per bound ({size / 1024:.0f} KB):")
+            for name, fn, make_args in variants:
+                peak, elapsed = measure(fn, *make_args(path))
+                print(f"  {name:>17}: peak {peak / 2**20:7.1f} MB  {elapsed:6.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Cold start of the Python function: how long a fresh interpreter takes to
+import api/python/process-excel.py, measured with python -X importtime.
+
+Each run starts a new interpreter that loads the module and reports the
+wall time of the load, the modules it pulled in and the -X importtime
+breakdown; the median over --runs is compared with --max-ms. The check
+fails (exit status 1) when the median is over budget or when a module that
+should be imported lazily (--lazy, openpyxl and xlsx_patch by default) is
+loaded at import time. The time the GET warm-up then spends on the lazy
+imports is reported as well.
+
+    python benchmarks/bench_coldstart.py
+    python benchmarks/bench_coldstart.py --runs 10 --max-ms 40
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLER = os.path.join(ROOT, 'api', 'python', 'process-excel.py')
+
+# Runs in the fresh interpreter. Everything imported before the marker line
+# is interpreter startup, not the handler's cold start.
+CHILD = '''
+import importlib.util, json, sys, time
+before = set(sys.modules)
+sys.stderr.write('--- handler ---\\n')
+sys.stderr.flush()
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('process_excel', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+import_ms = (time.perf_counter() - start) * 1000
+loaded = sorted(set(sys.modules) - before)
+sys.stderr.write('--- warm-up ---\\n')
+sys.stderr.flush()
+start = time.perf_counter()
+if hasattr(module, 'warm_up'):
+    module.warm_up()
+warm_up_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({'import_ms': import_ms, 'warm_up_ms': warm_up_ms, 'modules': loaded}))
+'''
+
+
+def parse_importtime(stderr):
+    """Cumulative microseconds per top-level import made by the handler, from -X importtime output"""
+    lines = stderr.split('--- handler ---\n', 1)[-1].split('--- warm-up ---\n', 1)[0].splitlines()
+    imports = {}
+    for line in lines:
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented under the module that imported them
+        if name.startswith('  '):
+            continue
+        imports[name.strip()] = imports.get(name.strip(), 0) + int(cumulative)
+    return imports
+
+
+def measure():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD, HANDLER],
+                            check=True, capture_output=True, text=True, cwd=ROOT)
+    run = json.loads(result.stdout.strip().splitlines()[-1])
+    run['imports'] = parse_importtime(result.stderr)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=60,
+                        help='budget for the median import time (openpyxl alone takes a few hundred ms)')
+    parser.add_argument('--lazy', nargs='*', default=['openpyxl', 'xlsx_patch'],
+                        help='modules that must not be imported when the handler is loaded')
+    parser.add_argument('--top', type=int, default=10, help='slowest top-level imports to list')
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    import_ms = statistics.median(run['import_ms'] for run in runs)
+    warm_up_ms = statistics.median(run['warm_up_ms'] for run in runs)
+
+    print(f"handler import: median {import_ms:.1f} ms over {args.runs} runs "
+          f"(min {min(run['import_ms'] for run in runs):.1f}, max {max(run['import_ms'] for run in runs):.1f})")
+    print(f"warm-up imports: median {warm_up_ms:.1f} ms")
+    imports = runs[-1]['imports']
+    print("slowest imports of the last run (cumulative):")
+    for name, micros in sorted(imports.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if import_ms > args.max_ms:
+        failures.append(f"median import time {import_ms:.1f} ms is over the {args.max_ms:g} ms budget")
+    eager = sorted({module.split('.')[0] for run in runs for module in run['modules']} & set(args.lazy))
+    if eager:
+        failures.append(f"imported when the handler loads, should be lazy: {', '.join(eager)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Cell-by-cell Python vs the NumPy count grid on one 24-sheet workbook.
+
+  modify:  read_snapshot + plan_changes  vs  load_grid + scale_counts
+  force:   force_exact_totals(_24hour) with engine='openpyxl' vs engine='grid'
+  verify:  verify_*_totals over openpyxl cells  vs  count_grid.class_totals
+
+The first two bounds sit within the rows 1-99 the force scripts search, the
+rest only add bound rows for modify_excel.
+
+    python benchmarks/bench_grid.py --bounds 6 --rows-per-bound 45
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bounds', type=int, default=6)
+    parser.add_argument('--rows-per-bound', type=int, default=45)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    import numpy as np
+    import openpyxl
+
+    import count_grid
+    import force_exact_totals
+    import force_exact_totals_24hour
+    from benchmarks.synthetic import generate_workbook
+    from modify_excel import TIME_SHEETS, plan_changes, read_snapshot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.xlsx')
+        out = os.path.join(tmp, 'out.xlsx')
+        sheets = generate_workbook(path, hours=24, bounds=args.bounds, rows_per_bound=args.rows_per_bound)
+        hourly = [name for name in sheets if name != 'DAY']
+        print(f"{len(hourly)} hourly sheets x {args.bounds * args.rows_per_bound} bound rows x 12 classes")
+
+        multiplier = 1.13
+        rng = np.random.default_rng()
+        results = [
+            ('modify', lambda: plan_changes(read_snapshot(path), multiplier, 'increase'),
+             lambda: count_grid.scale_counts(count_grid.load_grid(path, TIME_SHEETS), multiplier, 'increase', rng)),
+        ]
+
+        snapshot = read_snapshot(path)
+        grid = count_grid.load_grid(path, TIME_SHEETS)
+        results.append(('modify (transform only)', lambda: plan_changes(snapshot, multiplier, 'increase'),
+                        lambda: count_grid.scale_counts(grid, multiplier, 'increase', rng)))
+
+        for module, fn in ((force_exact_totals, force_exact_totals.force_exact_totals),
+                           (force_exact_totals_24hour, force_exact_totals_24hour.force_exact_totals_24hour)):
+            results.append((fn.__name__, lambda fn=fn: fn(path, out, 'openpyxl'),
+                            lambda fn=fn: fn(path, out, 'grid')))
+
+        wb = openpyxl.load_workbook(path)
+        full_grid = count_grid.load_grid(path, hourly)
+        direction_rows = count_grid.find_direction_rows(full_grid, force_exact_totals.TOTALS, max_row=sys.maxsize)
+        results.append(('verify', lambda: force_exact_totals.verify_forced_totals(
+                             wb, force_exact_totals.TOTALS, hourly, direction_rows),
+                         lambda: force_exact_totals.verify_forced_totals_grid(
+                             full_grid, force_exact_totals.TOTALS, direction_rows, full_grid.values)))
+
+        for name, python_fn, grid_fn in results:
+            python_time = timed(python_fn, args.repeat)
+            grid_time = timed(grid_fn, args.repeat)
+            print(f"{name:>26}: python {python_time * 1000:9.1f} ms   grid {grid_time * 1000:9.1f} ms   "
+                  f"x{python_time / grid_time:.1f}")
+
+
+if __name__ == '__main__':
+    main()
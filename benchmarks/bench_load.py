@@ -0,0 +1,104 @@
+"""
+Load time and peak RSS of modify_excel's workbook loading, before and after
+the single-pass snapshot.
+
+before: openpyxl loads the file twice (data_only and formulas) and rows are
+        classified with per-cell ws_data.cell() lookups
+after:  one pass over the hourly sheet XML records cached value and formula
+        per cell, and rows are classified from that snapshot
+
+Each variant runs in a fresh interpreter so ru_maxrss is its own peak.
+
+    python benchmarks/bench_load.py --rows-per-bound 250
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_before(path):
+    import openpyxl
+    from modify_excel import TIME_SHEETS
+
+    wb_data = openpyxl.load_workbook(path, data_only=True)
+    wb = openpyxl.load_workbook(path)
+    bound_rows = 0
+    for sheet_name in TIME_SHEETS:
+        if sheet_name not in wb.sheetnames:
+            continue
+        ws = wb[sheet_name]
+        ws_data = wb_data[sheet_name]
+        for idx, row in enumerate(ws.iter_rows(), 1):
+            cell_a_data = ws_data.cell(row=idx, column=1)
+            cell_text = str(cell_a_data.value).lower() if cell_a_data.value else ''
+            has_numeric_data = False
+            for col_idx in range(1, 13):
+                if col_idx < len(row):
+                    cell_value = ws_data.cell(row=idx, column=col_idx + 1).value
+                    if isinstance(cell_value, (int, float)) and cell_value > 0:
+                        has_numeric_data = True
+                        break
+            if cell_text and has_numeric_data:
+                bound_rows += 1
+    return bound_rows
+
+
+def load_after(path):
+    from modify_excel import is_bound_row, read_snapshot
+
+    snapshot = read_snapshot(path)
+    return sum(1 for rows in snapshot.values() for _, cells in rows if is_bound_row(cells))
+
+
+def run_variant(variant, path):
+    start = time.perf_counter()
+    bound_rows = (load_before if variant == 'before' else load_after)(path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'variant': variant, 'seconds': round(elapsed, 4),
+                      'peak_rss_mb': round(peak_kb / 1024, 1), 'bound_rows': bound_rows}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows-per-bound', type=int, default=250)
+    parser.add_argument('--bounds', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--variant', choices=['before', 'after'], help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args.input)
+        return
+
+    from benchmarks.synthetic import generate_workbook
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.xlsx')
+        generate_workbook(path, hours=24, bounds=args.bounds, rows_per_bound=args.rows_per_bound)
+        print(f"24 hourly sheets, {args.bounds} bounds x {args.rows_per_bound} rows, "
+              f"{os.path.getsize(path) / 1024:.0f} KB")
+
+        for variant in ('before', 'after'):
+            runs = []
+            for _ in range(args.repeat):
+                out = subprocess.run([sys.executable, __file__, '--variant', variant, '--input', path],
+                                     check=True, capture_output=True, text=True).stdout
+                runs.append(json.loads(out))
+            best = min(runs, key=lambda r: r['seconds'])
+            print(f"{variant:>6}: {best['seconds']:.3f}s  peak RSS {best['peak_rss_mb']} MB  "
+                  f"({best['bound_rows']} bound rows)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Single-workbook latency of modify_excel's patch mode against the number of
+processes the hourly sheets are spread over (--workers).
+
+Each worker count runs on the same synthetic 12-hour workbook with the same
+seed; the outputs are compared with the serial run's byte for byte, and the
+best of --repeat runs is reported with its speed-up over serial. With more
+workers than cores the extra processes only add start-up and pickling.
+
+    python benchmarks/bench_parallel.py --rows-per-bound 250 --workers 1 2 4 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def run(path, out, workers, repeat):
+    from modify_excel import modify_excel
+
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            modify_excel(path, out, 13, 'increase', 'patch', use_layout=False, seed=1, workers=workers)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    with open(out, 'rb') as f:
+        return best, f.read()
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bounds', type=int, default=4)
+    parser.add_argument('--rows-per-bound', type=int, default=250)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, 8, cores} & set(range(1, cores + 1))) or [1],
+                        help='worker counts to time (default: powers of two up to the core count)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from benchmarks.synthetic import generate_workbook
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.xlsx')
+        out = os.path.join(tmp, 'out.xlsx')
+        generate_workbook(path, hours=12, bounds=args.bounds, rows_per_bound=args.rows_per_bound)
+        print(f"12 hourly sheets x {args.bounds * args.rows_per_bound} rows "
+              f"({os.path.getsize(path) / 1024:.0f} KB), {cores} cores")
+
+        serial, expected = run(path, out, 1, args.repeat)
+        print(f"  serial     : {serial * 1000:8.1f} ms")
+        mismatches = []
+        for workers in args.workers:
+            if workers == 1:
+                continue
+            elapsed, output = run(path, out, workers, args.repeat)
+            same = output == expected
+            if not same:
+                mismatches.append(workers)
+            print(f"  {workers:2d} workers : {elapsed * 1000:8.1f} ms  x{serial / elapsed:.2f}"
+                  f"{'' if same else '  OUTPUT DIFFERS'}")
+
+    if mismatches:
+        print(f"FAIL: output differs from the serial run with {', '.join(map(str, mismatches))} workers")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Memory per request of the process-excel handler: base64-in-JSON vs raw bytes.
+
+The peak traced allocation during one handler call is reported in multiples
+of the workbook size, first with the transform replaced by a pass-through
+(transport cost only) and then end to end with the patch transform.
+
+    python benchmarks/bench_transport.py --rows-per-bound 250
+"""
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_handler_module():
+    path = os.path.join(ROOT, 'api', 'python', 'process-excel.py')
+    spec = importlib.util.spec_from_file_location('process_excel', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def json_request(data):
+    body = json.dumps({'file': base64.b64encode(data).decode(), 'percentage': '13',
+                       'operation': 'increase', 'mode': 'patch'})
+    return SimpleNamespace(method='POST', headers={'Content-Type': 'application/json'}, body=body)
+
+
+def binary_request(data):
+    return SimpleNamespace(method='POST', body=data, headers={
+        'Content-Type': 'application/octet-stream', 'X-Percentage': '13',
+        'X-Operation': 'increase', 'X-Mode': 'patch'})
+
+
+def measure(module, request):
+    tracemalloc.start()
+    response = module.handler(request)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert response['statusCode'] == 200, response['body']
+    return peak, len(response['body'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows-per-bound', type=int, default=250)
+    args = parser.parse_args()
+
+    from benchmarks.synthetic import generate_workbook
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.xlsx')
+        generate_workbook(path, hours=24, rows_per_bound=args.rows_per_bound)
+        with open(path, 'rb') as f:
+            data = f.read()
+
+    module = load_handler_module()
+    transform = module.modify_excel_patch
+    size = len(data)
+    print(f"workbook {size / 1024:.0f} KB")
+
+    for label, passthrough in (('transport only', True), ('end to end', False)):
+        module.modify_excel_patch = (lambda file_data, *_: (bytes(file_data), ['log'])) if passthrough else transform
+        for name, build in (('json+base64', json_request), ('binary', binary_request)):
+            request = build(data)
+            peak, response_size = measure(module, request)
+            print(f"{label:>15} {name:>12}: request {len(request.body) / size:.2f}x  "
+                  f"response {response_size / size:.2f}x  peak {peak / size:.1f}x workbook")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,569 @@
+"""
+Load test of /api/modify-excel on a local instance of the app.
+
+Starts the Next.js app (next dev, or next start with --prod after a build)
+and, for --path function (the default), a local stand-in for the Vercel
+Python function that the app calls through VERCEL_URL: an HTTP server in
+front of --function-instances processes that each load
+api/python/process-excel.py and take one request at a time, like Vercel
+instances. --path pool leaves VERCEL_URL unset so the app runs uploads on
+its own Python worker pool instead. --url targets a server that is already
+running, and nothing is started.
+
+Synthetic workbooks (benchmarks/synthetic.py, --sizes) are then posted as
+application/octet-stream bodies, either by --concurrency clients back to
+back (closed loop) or at --rate requests per second with exponential gaps
+(open loop, where latency runs from the scheduled arrival, so a slow
+server can't hide its queueing). Each request gets its own seed so it
+misses the result cache unless --cache-hits is given.
+
+The report has throughput, p50/p95/p99 latency, error rate and status
+counts, a per-second timeline, the RSS of the app, its Python workers and
+the stand-in sampled over time, and the app's own /api/metrics at the end.
+It is written as JSON for --compare against a run from another commit.
+
+    python benchmarks/load_test.py --concurrency 1 2 4 8 --duration 30
+    python benchmarks/load_test.py --rate 2 --duration 60 --sizes typical stress
+    python benchmarks/load_test.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FUNCTION_PATH = '/api/python/process-excel'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list, None when empty"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+# The stand-in for the Vercel Python function
+
+_handler = None
+
+
+def _load_function():
+    global _handler
+    from benchmarks.run import load_handler_module
+
+    _handler = load_handler_module().handler
+
+
+def _call_function(method, headers, body):
+    from types import SimpleNamespace
+
+    response = _handler(SimpleNamespace(method=method, headers=headers, body=body))
+    body = response.get('body', b'')
+    return response.get('statusCode', 200), response.get('headers', {}), body.encode() if isinstance(body, str) else body
+
+
+def serve_function(port, instances):
+    """
+    The process-excel handler over HTTP on port. Each of the instances
+    processes holds one copy of the module and runs one request at a time,
+    as a Vercel instance does (the handler reuses one output buffer).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    pool = ProcessPoolExecutor(instances, initializer=_load_function)
+
+    class Handler(BaseHTTPRequestHandler):
+        def handle_method(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if self.path.split('?')[0] != FUNCTION_PATH:
+                self.send_error(404)
+                return
+            status, headers, data = pool.submit(_call_function, self.command, dict(self.headers.items()),
+                                                body).result()
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = handle_method
+
+        def log_message(self, *args):
+            pass
+
+    # Start the instances before saying we're ready
+    for future in [pool.submit(_call_function, 'GET', {}, b'') for _ in range(instances)]:
+        future.result()
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    print(f"Python function stand-in on port {port} with {instances} instances", flush=True)
+    server.serve_forever()
+
+
+# Processes and their memory
+
+def process_tree(pid):
+    """pid and all its descendants, from /proc (Linux only; [pid] elsewhere)"""
+    if not os.path.isdir('/proc'):
+        return [pid]
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name is in parentheses and may contain spaces
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, ()))
+    return tree
+
+
+def rss_by_kind(pid):
+    """Resident memory of pid's process tree in bytes, split into python and other (node) processes"""
+    totals = {'node': 0, 'python': 0}
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/statm') as f:
+                rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+            with open(f'/proc/{member}/comm') as f:
+                kind = 'python' if f.read().startswith('python') else 'node'
+        except (OSError, ValueError):
+            continue
+        totals[kind] += rss
+    return totals
+
+
+class RssSampler:
+    """Samples the app's and the stand-in's RSS every interval seconds in a background thread"""
+
+    def __init__(self, app_pid, function_pid, interval, started):
+        self.app_pid = app_pid
+        self.function_pid = function_pid
+        self.interval = interval
+        self.started = started
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        sample = {'t': round(time.perf_counter() - self.started, 3)}
+        if self.app_pid:
+            app = rss_by_kind(self.app_pid)
+            sample['app_mb'] = round(app['node'] / 2 ** 20, 1)
+            sample['python_workers_mb'] = round(app['python'] / 2 ** 20, 1)
+        if self.function_pid:
+            sample['function_mb'] = round(sum(rss_by_kind(self.function_pid).values()) / 2 ** 20, 1)
+        self.samples.append(sample)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        if self.app_pid or self.function_pid:
+            self.sample()
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+def start_process(command, env, log_path):
+    log = open(log_path, 'w')
+    # Own process group, so the whole tree can be stopped at the end
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+
+
+def stop_process(proc):
+    if proc is None or proc.poll() is not None:
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+def log_tail(log_path, size=2000):
+    try:
+        with open(log_path) as f:
+            return f.read()[-size:]
+    except OSError:
+        return ''
+
+
+def wait_until_up(url, proc, timeout, log_path):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"{url} exited while starting:\n{log_tail(log_path)}")
+        try:
+            with urllib.request.urlopen(url, timeout=5):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout:g}s:\n{log_tail(log_path)}")
+
+
+def next_command(port, prod):
+    next_bin = os.path.join(ROOT, 'node_modules', '.bin', 'next')
+    if not os.path.exists(next_bin):
+        raise RuntimeError("next is not installed; run npm install first (or pass --url)")
+    return [next_bin, 'start' if prod else 'dev', '--port', str(port)]
+
+
+# Load
+
+def post_workbook(url, data, seed, mode, timeout):
+    """One upload: (status, seconds, response bytes, X-Cache, error)"""
+    request = urllib.request.Request(url, data=data, method='POST', headers={
+        'Content-Type': 'application/octet-stream',
+        'X-Percentage': '13',
+        'X-Operation': 'increase',
+        'X-Mode': mode,
+        'X-Seed': str(seed),
+    })
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+            return response.status, time.perf_counter() - start, len(body), response.headers.get('X-Cache'), None
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, time.perf_counter() - start, 0, None, None
+    except (urllib.error.URLError, OSError) as e:
+        return None, time.perf_counter() - start, 0, None, f"{type(e).__name__}: {e}"
+
+
+class LoadRun:
+    """The requests of one load level, recorded as they complete"""
+
+    def __init__(self, url, workbooks, args, started):
+        self.url = url
+        self.workbooks = workbooks
+        self.args = args
+        self.started = started
+        self.results = []
+        self.lock = threading.Lock()
+        self.sent = 0
+
+    def next_request(self):
+        """(workbook name, bytes, seed) of the next request, or None once --requests have been sent"""
+        with self.lock:
+            if self.args.requests and self.sent >= self.args.requests:
+                return None
+            index = self.sent
+            self.sent += 1
+        name, data = self.workbooks[index % len(self.workbooks)]
+        seed = 1 if self.args.cache_hits else self.args.seed * 1_000_000 + index
+        return name, data, seed
+
+    def send(self, name, data, seed, scheduled=None):
+        start = time.perf_counter()
+        status, seconds, size, cache, error = post_workbook(self.url, data, seed, self.args.mode, self.args.timeout)
+        end = time.perf_counter()
+        # In an open loop the wait for a free client counts too
+        latency = end - scheduled if scheduled is not None else seconds
+        with self.lock:
+            self.results.append({
+                'workbook': name,
+                'start': round((scheduled or start) - self.started, 4),
+                'end': round(end - self.started, 4),
+                'latency_ms': round(latency * 1000, 2),
+                'status': status,
+                'bytes': size,
+                'cache': cache,
+                'error': error,
+            })
+
+    def closed_loop(self, concurrency, deadline):
+        def client():
+            while time.perf_counter() < deadline:
+                request = self.next_request()
+                if request is None:
+                    return
+                self.send(*request)
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def open_loop(self, rate, deadline, max_in_flight):
+        rng = random.Random(self.args.seed)
+        with ThreadPoolExecutor(max_in_flight) as pool:
+            arrival = time.perf_counter()
+            while True:
+                arrival += rng.expovariate(rate)
+                if arrival >= deadline:
+                    break
+                request = self.next_request()
+                if request is None:
+                    break
+                time.sleep(max(0.0, arrival - time.perf_counter()))
+                pool.submit(self.send, *request, scheduled=arrival)
+
+
+def summarize(results, elapsed):
+    ok = sorted(r['latency_ms'] for r in results if r['status'] == 200)
+    statuses = {}
+    for r in results:
+        key = str(r['status']) if r['status'] is not None else 'connection_error'
+        statuses[key] = statuses.get(key, 0) + 1
+    errors = len(results) - len(ok)
+    return {
+        'requests': len(results),
+        'ok': len(ok),
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4) if results else None,
+        'statuses': statuses,
+        'cache_hits': sum(1 for r in results if r['cache'] == 'HIT'),
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(ok) / elapsed, 3) if elapsed else None,
+        'latency_ms': {
+            'p50': percentile(ok, 50),
+            'p95': percentile(ok, 95),
+            'p99': percentile(ok, 99),
+            'mean': round(sum(ok) / len(ok), 2) if ok else None,
+            'max': ok[-1] if ok else None,
+        },
+    }
+
+
+def timeline(results, samples):
+    """Per-second buckets by completion time, with the last RSS sample of each second"""
+    buckets = {}
+    for r in results:
+        bucket = buckets.setdefault(int(r['end']), {'completed': 0, 'errors': 0, 'latencies': []})
+        bucket['completed'] += 1
+        if r['status'] == 200:
+            bucket['latencies'].append(r['latency_ms'])
+        else:
+            bucket['errors'] += 1
+    memory = {}
+    for sample in samples:
+        memory[int(sample['t'])] = {key: value for key, value in sample.items() if key != 't'}
+    seconds = sorted(set(buckets) | set(memory))
+    lines = []
+    for second in seconds:
+        bucket = buckets.get(second, {'completed': 0, 'errors': 0, 'latencies': []})
+        latencies = sorted(bucket['latencies'])
+        lines.append(dict({'t': second, 'completed': bucket['completed'], 'errors': bucket['errors'],
+                           'p50_ms': percentile(latencies, 50), 'p95_ms': percentile(latencies, 95)},
+                          **memory.get(second, {})))
+    return lines
+
+
+def fetch_server_metrics(base_url):
+    try:
+        with urllib.request.urlopen(base_url + '/api/metrics', timeout=10) as response:
+            return json.loads(response.read())
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
+
+
+def git_commit():
+    from benchmarks.run import git_commit as commit
+
+    return commit()
+
+
+def _change(value, previous):
+    if value is None or not previous:
+        return '     n/a'
+    return f"{(value / previous - 1) * 100:+7.1f}%"
+
+
+def compare(levels, baseline_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    before = {level['level']: level for level in baseline['levels']}
+    print(f"\nCompared with {baseline_file} ({baseline.get('commit')}):")
+    for level in levels:
+        old_level = before.get(level['level'])
+        if not old_level:
+            continue
+        new, old = level['summary'], old_level['summary']
+        print(f"  {level['level']:>16}: throughput {_change(new['throughput_rps'], old['throughput_rps'])}  "
+              f"p50 {_change(new['latency_ms']['p50'], old['latency_ms']['p50'])}  "
+              f"p95 {_change(new['latency_ms']['p95'], old['latency_ms']['p95'])}  "
+              f"p99 {_change(new['latency_ms']['p99'], old['latency_ms']['p99'])}  "
+              f"errors {(new['error_rate'] or 0) * 100:.1f}% (was {(old['error_rate'] or 0) * 100:.1f}%)  "
+              f"peak app RSS {_change(level['peak_app_mb'], old_level['peak_app_mb'])}")
+
+
+def main():
+    from benchmarks.synthetic import SIZES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', choices=['function', 'pool'], default='function',
+                        help='function: the app calls the Python function stand-in; pool: its own worker pool')
+    parser.add_argument('--url', help='base URL of a server that is already running; nothing is started')
+    parser.add_argument('--pid', type=int, help='with --url, the server process whose RSS to sample')
+    parser.add_argument('--endpoint', default='/api/modify-excel')
+    parser.add_argument('--prod', action='store_true', help='next start (needs next build) instead of next dev')
+    parser.add_argument('--function-instances', type=int, default=2,
+                        help='processes behind the Python function stand-in')
+    parser.add_argument('--pool-size', type=int, help='PYTHON_POOL_SIZE for the app (--path pool)')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['small', 'typical'],
+                        help='synthetic workbooks to send, in turn')
+    parser.add_argument('--mode', choices=['openpyxl', 'patch'], default='patch')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='closed loop: clients sending back to back, one run per value')
+    parser.add_argument('--rate', type=float, nargs='+',
+                        help='open loop instead: mean arrivals per second, one run per value')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='open loop: most requests at once')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per run')
+    parser.add_argument('--requests', type=int, help='stop a run after this many requests')
+    parser.add_argument('--warmup', type=int, default=2, help='requests sent before measuring (compiles routes)')
+    parser.add_argument('--timeout', type=float, default=300, help='per-request timeout in seconds')
+    parser.add_argument('--cache-hits', action='store_true', help='same seed for every request, so results are cached')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='seconds between RSS samples')
+    parser.add_argument('--startup-timeout', type=float, default=180)
+    parser.add_argument('--output', default='load_results.json')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--serve-function', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_function:
+        serve_function(args.serve_function, args.function_instances)
+        return
+
+    from benchmarks.synthetic import generate_workbook
+
+    tmp = tempfile.mkdtemp(prefix='load-test-')
+    app = function = None
+    try:
+        workbooks = []
+        for size in args.sizes:
+            path = os.path.join(tmp, f'{size}.xlsx')
+            generate_workbook(path, **SIZES[size])
+            with open(path, 'rb') as f:
+                workbooks.append((size, f.read()))
+            print(f"{size}: {len(workbooks[-1][1]) / 1024:.0f} KB")
+
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            env = dict(os.environ)
+            env.pop('VERCEL_URL', None)
+            # Every request is a cache miss anyway unless --cache-hits; keep the cache out of the way
+            env.setdefault('RESULT_CACHE_DIR', os.path.join(tmp, 'results'))
+            if args.path == 'function':
+                function_port = free_port()
+                function_log = os.path.join(tmp, 'function.log')
+                function = start_process([sys.executable, os.path.abspath(__file__), '--serve-function',
+                                          str(function_port), '--function-instances', str(args.function_instances)],
+                                         env, function_log)
+                wait_until_up(f'http://127.0.0.1:{function_port}{FUNCTION_PATH}', function,
+                              args.startup_timeout, function_log)
+                env['VERCEL_URL'] = f'http://127.0.0.1:{function_port}'
+            elif args.pool_size:
+                env['PYTHON_POOL_SIZE'] = str(args.pool_size)
+            app_port = free_port()
+            app_log = os.path.join(tmp, 'app.log')
+            app = start_process(next_command(app_port, args.prod), env, app_log)
+            base_url = f'http://127.0.0.1:{app_port}'
+            wait_until_up(base_url + '/api/metrics', app, args.startup_timeout, app_log)
+            print(f"App on {base_url} ({'next start' if args.prod else 'next dev'}, {args.path} path)")
+        url = base_url + args.endpoint
+
+        # The first requests compile the route in dev and start the workers
+        for i in range(args.warmup):
+            name, data = workbooks[i % len(workbooks)]
+            post_workbook(url, data, -1 - i, args.mode, args.timeout)
+
+        levels = []
+        plan = ([('rate', rate) for rate in args.rate] if args.rate
+                else [('concurrency', concurrency) for concurrency in args.concurrency])
+        for kind, value in plan:
+            label = f"{kind}={value:g}"
+            started = time.perf_counter()
+            run = LoadRun(url, workbooks, args, started)
+            deadline = started + args.duration
+            with RssSampler(app.pid if app else args.pid, function.pid if function else None,
+                            args.sample_interval, started) as sampler:
+                if kind == 'rate':
+                    run.open_loop(value, deadline, args.max_in_flight)
+                else:
+                    run.closed_loop(value, deadline)
+            elapsed = time.perf_counter() - started
+            summary = summarize(run.results, elapsed)
+            level = {
+                'level': label,
+                'summary': summary,
+                'timeline': timeline(run.results, sampler.samples),
+                'peak_app_mb': max((s.get('app_mb', 0) + s.get('python_workers_mb', 0) for s in sampler.samples),
+                                   default=None),
+                'peak_function_mb': max((s['function_mb'] for s in sampler.samples if 'function_mb' in s),
+                                        default=None),
+                'requests': run.results,
+            }
+            levels.append(level)
+            latency = summary['latency_ms']
+            print(f"  {label:>16}: {summary['throughput_rps'] or 0:7.2f} req/s  "
+                  f"p50 {latency['p50'] or 0:8.1f}  p95 {latency['p95'] or 0:8.1f}  p99 {latency['p99'] or 0:8.1f} ms  "
+                  f"errors {(summary['error_rate'] or 0) * 100:5.1f}%  "
+                  f"peak RSS app {level['peak_app_mb'] or 0:.0f} MB"
+                  + (f", function {level['peak_function_mb']:.0f} MB" if level['peak_function_mb'] else ''))
+
+        report = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': {name: value for name, value in vars(args).items()
+                       if name not in ('output', 'compare', 'serve_function')},
+            'workbooks': {name: len(data) for name, data in workbooks},
+            'levels': levels,
+            'server_metrics': fetch_server_metrics(base_url),
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved to: {args.output}")
+
+        if args.compare:
+            compare(levels, args.compare)
+    finally:
+        stop_process(app)
+        stop_process(function)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
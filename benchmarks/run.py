@@ -0,0 +1,198 @@
+"""
+Benchmark suite: every entry point on synthetic workbooks of each size.
+
+Cases
+  modify_cli     python modify_excel.py IN OUT 13 increase (interpreter startup included)
+  modify_api     the process-excel handler on an octet-stream request
+  force          force_exact_totals
+  force24        force_exact_totals_24hour
+  verify         verify_forced_totals on a forced workbook (load not timed)
+  verify24       verify_24hour_totals on a forced workbook (load not timed)
+
+Sizes are benchmarks.synthetic.SIZES. Each run happens in a fresh
+interpreter so its peak RSS is its own; the best of --repeat runs is kept.
+Wall time, peak RSS, cells touched and cells/sec go to a JSON file that
+--compare can diff against a run from another commit.
+
+    python benchmarks/run.py --sizes small typical --output before.json
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CASES = ['modify_cli', 'modify_api', 'force', 'force24', 'verify', 'verify24']
+
+_TOTAL_RE = re.compile(r'Total: (\d+) cells modified')
+
+
+def load_handler_module():
+    path = os.path.join(ROOT, 'api', 'python', 'process-excel.py')
+    spec = importlib.util.spec_from_file_location('process_excel', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def case_modify_cli(path, output):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'modify_excel.py'), path, output, '13', 'increase'],
+                            check=True, capture_output=True, text=True, cwd=ROOT)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return elapsed, int(_TOTAL_RE.search(result.stdout).group(1)), peak_kb
+
+
+def case_modify_api(path, output):
+    module = load_handler_module()
+    with open(path, 'rb') as f:
+        data = f.read()
+    request = SimpleNamespace(method='POST', body=data, headers={
+        'Content-Type': 'application/octet-stream', 'X-Percentage': '13',
+        'X-Operation': 'increase', 'X-Mode': 'openpyxl'})
+    start = time.perf_counter()
+    response = module.handler(request)
+    elapsed = time.perf_counter() - start
+    assert response['statusCode'] == 200, response['body']
+    return elapsed, int(_TOTAL_RE.search(response['body'].decode('utf-8', 'replace')).group(1)), None
+
+
+def case_force(path, output, hours24=False):
+    if hours24:
+        from force_exact_totals_24hour import force_exact_totals_24hour as force
+    else:
+        from force_exact_totals import force_exact_totals as force
+    start = time.perf_counter()
+    written = force(path, output)
+    return time.perf_counter() - start, sum(written.values()), None
+
+
+def case_verify(path, output, hours24=False):
+    from openpyxl import load_workbook
+    if hours24:
+        from force_exact_totals_24hour import (TOTALS, find_direction_rows, force_exact_totals_24hour as force,
+                                               verify_24hour_totals as verify, written_cells)
+    else:
+        from force_exact_totals import (TOTALS, find_direction_rows, force_exact_totals as force,
+                                        verify_forced_totals as verify, written_cells)
+    force(path, output)
+    wb = load_workbook(output)
+    hourly_sheets = [name for name in wb.sheetnames if name != 'DAY']
+    direction_rows = find_direction_rows(wb)
+    start = time.perf_counter()
+    verify(wb, TOTALS, hourly_sheets, direction_rows)
+    elapsed = time.perf_counter() - start
+    return elapsed, sum(written_cells(hourly_sheets, direction_rows).values()), None
+
+
+def run_case(case, path):
+    runners = {
+        'modify_cli': case_modify_cli,
+        'modify_api': case_modify_api,
+        'force': case_force,
+        'force24': lambda p, o: case_force(p, o, hours24=True),
+        'verify': case_verify,
+        'verify24': lambda p, o: case_verify(p, o, hours24=True),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'output.xlsx')
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, cells, peak_kb = runners[case](path, output)
+    # ru_maxrss is in kilobytes on Linux
+    peak_kb = peak_kb or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'seconds': round(elapsed, 4), 'peak_rss_mb': round(peak_kb / 1024, 1), 'cells': cells}))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    before = {(r['size'], r['case']): r for r in baseline['results']}
+    print(f"\nCompared with {baseline_file} ({baseline.get('commit')}):")
+    for result in results:
+        old = before.get((result['size'], result['case']))
+        if not old:
+            continue
+        time_change = (result['seconds'] / old['seconds'] - 1) * 100 if old['seconds'] else 0
+        rss_change = (result['peak_rss_mb'] / old['peak_rss_mb'] - 1) * 100 if old['peak_rss_mb'] else 0
+        print(f"  {result['size']:>8} {result['case']:>10}: time {time_change:+6.1f}%  peak RSS {rss_change:+6.1f}%")
+
+
+def main():
+    from benchmarks.synthetic import SIZES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--case', choices=CASES, help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(args.case, args.input)
+        return
+
+    from benchmarks.synthetic import generate_workbook
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            path = os.path.join(tmp, f'{size}.xlsx')
+            generate_workbook(path, **SIZES[size])
+            print(f"{size}: {SIZES[size]['hours']} hourly sheets, {SIZES[size]['rows_per_bound']} rows per bound, "
+                  f"{os.path.getsize(path) / 1024:.0f} KB")
+
+            for case in args.cases:
+                runs = []
+                for _ in range(args.repeat):
+                    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', case, '--input', path],
+                                         check=True, capture_output=True, text=True, cwd=ROOT).stdout
+                    runs.append(json.loads(out.strip().splitlines()[-1]))
+                best = min(runs, key=lambda r: r['seconds'])
+                best['cells_per_sec'] = round(best['cells'] / best['seconds']) if best['seconds'] else None
+                results.append(dict(size=size, case=case, **best))
+                print(f"  {case:>10}: {best['seconds']:8.3f}s  peak RSS {best['peak_rss_mb']:6.1f} MB  "
+                      f"{best['cells']} cells  {best['cells_per_sec']} cells/s")
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved to: {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
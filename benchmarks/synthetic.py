@@ -0,0 +1,92 @@
+"""
+Synthetic count workbooks shaped like the survey firm's templates.
+
+Each hourly sheet has a title row, a header row with the 12 vehicle classes,
+then one block of 15-minute rows per bound followed by a SUM row. Column N
+holds a SUM of B-M on every row. The DAY sheet sums each bound's total row
+across all hourly sheets.
+"""
+import argparse
+import random
+
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+HOURS_12 = ['7-8AM', '8-9AM', '9-10AM', '10-11AM', '11-12PM', '12-1PM',
+            '1-2PM', '2-3PM', '3-4PM', '4-5PM', '5-6PM', '6-7PM']
+
+HOURS_24 = ['6-7AM', '7-8AM', '8-9AM', '9-10AM', '10-11AM', '11-12AM', '12-1PM',
+            '1-2PM', '2-3PM', '3-4PM', '4-5PM', '5-6PM', '6-7PM', '7-8PM', '8-9PM',
+            '9-10PM', '10-11PM', '11-12PM', '12-1AM', '1-2AM', '2-3AM', '3-4AM',
+            '4-5AM', '5-6AM']
+
+CLASSES = ['Cars', 'Light Goods', 'Matatu', 'Minibus', 'Bus', 'Medium Truck',
+           'Heavy Truck', 'Trailer', 'Motorcycle', 'Bicycle', 'Tuk Tuk', 'Other']
+
+BOUNDS = ['Bisil Bound', 'Athi River Bound']
+
+SIZES = {
+    'small': {'hours': 12, 'rows_per_bound': 4},
+    'typical': {'hours': 24, 'rows_per_bound': 4},
+    'stress': {'hours': 24, 'rows_per_bound': 250},
+}
+
+
+def bound_names(count):
+    """BOUNDS first, then numbered extra bounds"""
+    return BOUNDS[:count] + [f'Bound {i + 1}' for i in range(len(BOUNDS), count)]
+
+
+def generate_workbook(path, hours=24, bounds=2, rows_per_bound=4, seed=0):
+    """Write a synthetic count workbook to path and return its sheet names"""
+    rng = random.Random(seed)
+    sheet_names = HOURS_24 if hours == 24 else HOURS_12
+    names = bound_names(bounds)
+
+    wb = Workbook(write_only=True)
+    total_rows = {}
+
+    for sheet_name in sheet_names:
+        ws = wb.create_sheet(sheet_name)
+        ws.append([f'Traffic counts {sheet_name}'])
+        ws.append(['Bound'] + CLASSES + ['Total'])
+        row = 3
+        for name in names:
+            start = row
+            for quarter in range(rows_per_bound):
+                counts = [rng.choice((0, rng.randint(1, 10), rng.randint(10, 200)))
+                          for _ in CLASSES]
+                ws.append([f'{name} {quarter * 15:02d}-{quarter * 15 + 15:02d}'] + counts
+                          + [f'=SUM(B{row}:M{row})'])
+                row += 1
+            ws.append([f'{name} Total']
+                      + [f'=SUM({get_column_letter(col)}{start}:{get_column_letter(col)}{row - 1})'
+                         for col in range(2, 14)]
+                      + [f'=SUM(B{row}:M{row})'])
+            total_rows[name] = row
+            row += 2
+            ws.append([])
+
+    day = wb.create_sheet('DAY')
+    day.append(['Daily totals'])
+    day.append(['Bound'] + CLASSES + ['Total'])
+    for row, name in enumerate(names, 3):
+        day.append([name]
+                   + ['=' + '+'.join(f"'{sheet}'!{get_column_letter(col)}{total_rows[name]}"
+                                     for sheet in sheet_names)
+                      for col in range(2, 14)]
+                   + [f'=SUM(B{row}:M{row})'])
+
+    wb.save(path)
+    return sheet_names + ['DAY']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic count workbook')
+    parser.add_argument('output')
+    parser.add_argument('--hours', type=int, choices=[12, 24], default=24)
+    parser.add_argument('--bounds', type=int, default=2)
+    parser.add_argument('--rows-per-bound', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_workbook(args.output, args.hours, args.bounds, args.rows_per_bound, args.seed)
@@ -0,0 +1,276 @@
+"""
+Which count cells a run changed, from what to what.
+
+A ChangeRecorder is handed to modify_excel / force_exact_totals /
+force_exact_totals_24hour and filled while they plan their changes, from
+values they have already read, so recording costs no extra parse. Changes
+are kept as parallel typed arrays, with sheet and bound names stored once
+and referenced by index, which keeps even a week of surveys small.
+
+write_table() exports them as a tidy table, one row per changed cell:
+
+    hour            sheet name, e.g. 7-8AM
+    bound           column A label of the row (the direction for the force scripts)
+    row             worksheet row number
+    class           column letter of the vehicle class, B-M
+    original_value  the number in the cell before, empty if there was none
+    new_value       the number written
+
+Parquet is written when pyarrow is installed, CSV otherwise.
+
+write_journal() keeps the same arrays as a compact binary journal next to
+the output, with the run's parameters, seed and the hashes of its input and
+output workbook. journal.py re-applies or reverts a journal through the
+patch path and prints per-bound/per-class deltas from it, without parsing
+either workbook.
+"""
+import csv
+import datetime
+import json
+import math
+import os
+import sys
+import zlib
+from array import array
+
+import instrument
+
+COLUMNS = ['hour', 'bound', 'row', 'class', 'original_value', 'new_value']
+
+JOURNAL_MAGIC = b'TCJOURNAL1\n'
+JOURNAL_ARRAYS = ['sheet', 'bound', 'row', 'col', 'old', 'new']
+
+
+def column_letter(col):
+    letters = ''
+    while col:
+        col, rest = divmod(col - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+
+def _number(value):
+    """value as a float for the value arrays; NaN stands for 'not a number'"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return math.nan
+    return float(value)
+
+
+def _plain(value):
+    """A stored float back as the int it usually was, None for NaN"""
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+
+class ChangeRecorder:
+    """
+    Changed cells as parallel arrays: sheet and bound indexes, row, column,
+    old and new value. The few values that aren't numbers (labels, and the
+    formulas a run replaced, as '=SUM(...)') are kept aside by index.
+    """
+
+    def __init__(self):
+        self.sheets = []
+        self.bounds = []
+        self._sheet_ids = {}
+        self._bound_ids = {}
+        self.sheet = array('H')
+        self.bound = array('I')
+        self.row = array('I')
+        self.col = array('H')
+        self.old = array('d')
+        self.new = array('d')
+        self.old_text = {}
+        self.new_text = {}
+
+    def __len__(self):
+        return len(self.row)
+
+    @staticmethod
+    def _intern(names, ids, name):
+        name = '' if name is None else str(name)
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    def add(self, sheet, row, col, old, new, bound=''):
+        if isinstance(old, str):
+            self.old_text[len(self)] = old
+        if isinstance(new, str):
+            self.new_text[len(self)] = new
+        self.sheet.append(self._intern(self.sheets, self._sheet_ids, sheet))
+        self.bound.append(self._intern(self.bounds, self._bound_ids, bound))
+        self.row.append(row)
+        self.col.append(col)
+        self.old.append(_number(old))
+        self.new.append(_number(new))
+
+    def add_sheet(self, sheet, changes, original, bound):
+        """
+        Record one sheet's {(row, col): new_value}; original(row, col) gives the
+        value before and bound(row) the row's bound
+        """
+        for (row, col), new in changes.items():
+            self.add(sheet, row, col, original(row, col), new, bound(row))
+
+    def records(self):
+        """(hour, bound, row, class, original_value, new_value) per changed cell"""
+        for i in range(len(self)):
+            yield (self.sheets[self.sheet[i]], self.bounds[self.bound[i]], self.row[i],
+                   column_letter(self.col[i]), _plain(self.old[i]), _plain(self.new[i]))
+
+    def value(self, i, old=False):
+        """The new (or old) value of change i as it was in the cell, None for an empty cell"""
+        if old:
+            return self.old_text[i] if i in self.old_text else _plain(self.old[i])
+        return self.new_text[i] if i in self.new_text else _plain(self.new[i])
+
+    def changes(self, old=False):
+        """
+        {sheet: {(row, col): new_value}}, as xlsx_patch.patch_workbook takes it;
+        with old, the values before instead, which undo the changes
+        """
+        changes = {}
+        for i in range(len(self)):
+            changes.setdefault(self.sheets[self.sheet[i]], {})[(self.row[i], self.col[i])] = self.value(i, old)
+        return changes
+
+    def deltas(self, skip_sheets=()):
+        """
+        {bound: {col: new - old}} summed over the sheets, an empty cell
+        counting as 0. Cells with text or a formula on either side are left
+        out, and so are the sheets in skip_sheets (e.g. a summary sheet
+        that adds up the others).
+        """
+        skipped = {self._sheet_ids[name] for name in skip_sheets if name in self._sheet_ids}
+        deltas = {}
+        for i, (sheet, bound, col, old, new) in enumerate(zip(self.sheet, self.bound, self.col, self.old, self.new)):
+            if sheet in skipped or i in self.old_text or i in self.new_text:
+                continue
+            delta = (0 if math.isnan(new) else new) - (0 if math.isnan(old) else old)
+            bound_deltas = deltas.setdefault(self.bounds[bound], {})
+            bound_deltas[col] = bound_deltas.get(col, 0) + delta
+        return {bound: {col: _plain(delta) for col, delta in sorted(cols.items())} for bound, cols in deltas.items()}
+
+
+def have_parquet():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_parquet(recorder, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Hour and bound become dictionary columns straight from the index arrays
+    table = pa.table({
+        'hour': pa.DictionaryArray.from_arrays(pa.array(recorder.sheet, pa.int32()),
+                                               pa.array(recorder.sheets, pa.string())),
+        'bound': pa.DictionaryArray.from_arrays(pa.array(recorder.bound, pa.int32()),
+                                                pa.array(recorder.bounds, pa.string())),
+        'row': pa.array(recorder.row, pa.int32()),
+        'class': pa.array([column_letter(col) for col in recorder.col], pa.string()),
+        'original_value': pa.array(recorder.old, pa.float64(), from_pandas=True),
+        'new_value': pa.array(recorder.new, pa.float64(), from_pandas=True),
+    })
+    pq.write_table(table, path)
+
+
+def write_csv(recorder, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(('' if value is None else value for value in record) for record in recorder.records())
+
+
+def write_table(recorder, path):
+    """
+    Write the changes as Parquet (path ending in .parquet, needs pyarrow) or
+    CSV (anything else, or .parquet without pyarrow, which is written next
+    to it as .csv). Returns the path written.
+    """
+    if path.endswith('.parquet'):
+        if have_parquet():
+            write_parquet(recorder, path)
+            return path
+        path = os.path.splitext(path)[0] + '.csv'
+    write_csv(recorder, path)
+    return path
+
+
+def journal_path(output_file):
+    """Where a run's journal goes: next to its output, as <output stem>.journal"""
+    return os.path.splitext(output_file)[0] + '.journal'
+
+
+def run_record(script, input_file, output_file, params, seed=None):
+    """What a journal keeps about the run: the script, its parameters and seed, and both workbooks"""
+    return {
+        'script': script,
+        'params': params,
+        'seed': seed,
+        'input': os.path.abspath(input_file),
+        'input_hash': instrument.input_hash(input_file),
+        'output': os.path.abspath(output_file),
+        'output_hash': instrument.input_hash(output_file),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def write_journal(recorder, path, run):
+    """
+    Write the recorder and the run record (see run_record) as a journal: a
+    JSON header line, then the value arrays as raw bytes, zlib-compressed.
+    Returns the path written.
+    """
+    header = {
+        'run': run,
+        'count': len(recorder),
+        'sheets': recorder.sheets,
+        'bounds': recorder.bounds,
+        'old_text': sorted(recorder.old_text.items()),
+        'new_text': sorted(recorder.new_text.items()),
+        'arrays': [[name, getattr(recorder, name).typecode, getattr(recorder, name).itemsize]
+                   for name in JOURNAL_ARRAYS],
+        'byteorder': sys.byteorder,
+    }
+    body = b''.join(getattr(recorder, name).tobytes() for name in JOURNAL_ARRAYS)
+    with open(path, 'wb') as f:
+        f.write(JOURNAL_MAGIC)
+        f.write(json.dumps(header).encode() + b'\n')
+        f.write(zlib.compress(body))
+    return path
+
+
+def read_journal(path):
+    """A journal written by write_journal as (run record, ChangeRecorder)"""
+    with open(path, 'rb') as f:
+        if f.readline() != JOURNAL_MAGIC:
+            raise ValueError(f"{path} is not a change journal")
+        header = json.loads(f.readline())
+        body = zlib.decompress(f.read())
+
+    recorder = ChangeRecorder()
+    for name in header['sheets']:
+        recorder._intern(recorder.sheets, recorder._sheet_ids, name)
+    for name in header['bounds']:
+        recorder._intern(recorder.bounds, recorder._bound_ids, name)
+    recorder.old_text = {i: text for i, text in header['old_text']}
+    recorder.new_text = {i: text for i, text in header['new_text']}
+    position = 0
+    for name, typecode, itemsize in header['arrays']:
+        values = array(typecode)
+        if values.itemsize != itemsize:
+            raise ValueError(f"{path} was written on a platform with other array sizes")
+        size = header['count'] * itemsize
+        values.frombytes(body[position:position + size])
+        if header['byteorder'] != sys.byteorder:
+            values.byteswap()
+        setattr(recorder, name, values)
+        position += size
+    return header['run'], recorder
@@ -0,0 +1,226 @@
+import zipfile
+
+import numpy as np
+
+import xlsx_patch
+
+# Vehicle class columns B-M
+CLASS_COLUMNS = list(range(2, 14))
+
+
+class CountGrid:
+    """
+    The B-M block of every hourly sheet as one (sheets x rows x classes) array.
+
+    values holds the numbers typed into the sheets (0 where there are none),
+    present marks the cells that hold such a number and formulas marks
+    formula cells. cached keeps the cached value of every cell, formula or
+    not, which is what row classification looks at. rows gives the worksheet
+    row number of each position along axis 1; labels maps sheet -> row ->
+    column A text.
+    """
+
+    def __init__(self, sheets, rows, labels, values, present, formulas, cached):
+        self.sheets = sheets
+        self.rows = rows
+        self.labels = labels
+        self.values = values
+        self.present = present
+        self.formulas = formulas
+        self.cached = cached
+        self.row_index = {row: i for i, row in enumerate(rows)}
+
+    def changes(self, new_values, mask):
+        """{sheet: {(row, column): value}} for the cells selected by mask, as patch_workbook takes it"""
+        changes = {name: {} for name in self.sheets}
+        for s, r, c in zip(*np.nonzero(mask)):
+            changes[self.sheets[s]][(self.rows[r], CLASS_COLUMNS[c])] = new_values[s, r, c].item()
+        return changes
+
+    def original(self, sheet_name, row, col):
+        """The count a cell held when the grid was loaded"""
+        return self.values[self.sheets.index(sheet_name), self.row_index[row], col - CLASS_COLUMNS[0]].item()
+
+    def record_changes(self, recorder, changes, direction_rows=None):
+        """
+        Record changes (as returned by changes()) on a change_log.ChangeRecorder,
+        with the grid's values as the originals (None for cells that held no
+        number). Rows are attributed to their direction when direction_rows
+        is given, else to their column A label.
+        """
+        direction_of = {row: direction for direction, rows in (direction_rows or {}).items() for row in rows}
+
+        def original(s, row, col):
+            r, c = self.row_index[row], col - CLASS_COLUMNS[0]
+            return self.values[s, r, c].item() if self.present[s, r, c] else None
+
+        for s, sheet_name in enumerate(self.sheets):
+            labels = self.labels[sheet_name]
+            recorder.add_sheet(sheet_name, changes.get(sheet_name, {}),
+                               lambda row, col: original(s, row, col),
+                               lambda row: direction_of.get(row, labels.get(row, '')))
+
+
+def load_grid(input_file, sheet_names, rows=None):
+    """
+    Read the B-M counts of the named sheets (those that exist) into a CountGrid.
+    rows optionally maps sheet names to the row numbers worth reading.
+    """
+    with zipfile.ZipFile(input_file) as zf:
+        parts = xlsx_patch.sheet_parts(zf)
+        strings = xlsx_patch.shared_strings(zf)
+        sheets = [name for name in sheet_names if name in parts]
+        sheet_rows = [list(xlsx_patch.iter_rows(zf, parts[name], strings, max_col=CLASS_COLUMNS[-1],
+                                                rows=rows.get(name, ()) if rows is not None else None))
+                      for name in sheets]
+
+    rows = sorted({row for rows_ in sheet_rows for row, _ in rows_})
+    index = {row: i for i, row in enumerate(rows)}
+    shape = (len(sheets), len(rows), len(CLASS_COLUMNS))
+    labels = {}
+
+    # Flat cell positions are collected first and scattered into the arrays
+    # in one go, which is much cheaper than assigning cell by cell
+    number_at, number_value, number_is_formula, formula_at = [], [], [], []
+    for s, (name, rows_) in enumerate(zip(sheets, sheet_rows)):
+        sheet_labels = labels[name] = {}
+        for row, cells in rows_:
+            base = (s * len(rows) + index[row]) * len(CLASS_COLUMNS) - CLASS_COLUMNS[0]
+            for col, cell in cells.items():
+                if col == 1:
+                    if cell.value:
+                        sheet_labels[row] = str(cell.value)
+                    continue
+                if cell.formula is not None:
+                    formula_at.append(base + col)
+                if isinstance(cell.value, (int, float)):
+                    number_at.append(base + col)
+                    number_value.append(cell.value)
+                    number_is_formula.append(cell.formula is not None)
+
+    number_at = np.array(number_at, dtype=np.intp)
+    number_value = np.array(number_value, dtype=float)
+    typed = ~np.array(number_is_formula, dtype=bool)
+
+    cached = np.zeros(shape)
+    cached.flat[number_at] = number_value
+    values = np.zeros(shape)
+    values.flat[number_at[typed]] = number_value[typed]
+    present = np.zeros(shape, dtype=bool)
+    present.flat[number_at[typed]] = True
+    formulas = np.zeros(shape, dtype=bool)
+    formulas.flat[np.array(formula_at, dtype=np.intp)] = True
+
+    # Counts are whole numbers; keep floats only if the sheet really has them
+    if np.array_equal(values, np.floor(values)):
+        values = values.astype(np.int64)
+    return CountGrid(sheets, rows, labels, values, present, formulas, cached)
+
+
+def bound_rows(grid):
+    """(sheets x rows) mask of rows with text in column A and a positive cached count in B-M"""
+    has_text = np.array([[bool(grid.labels[name].get(row, '').strip()) for row in grid.rows]
+                         for name in grid.sheets], dtype=bool).reshape(grid.values.shape[:2])
+    return has_text & (grid.cached > 0).any(axis=2)
+
+
+def scale_counts(grid, multiplier, operation, rng):
+    """
+    modify_excel's percentage change on the whole grid at once: every
+    non-zero, non-formula count in a bound row is multiplied, jittered by
+    +/-2% and rounded, and counts of 1-10 move by at least 1.
+    Returns (new_values, mask of modified cells).
+    """
+    original = grid.values
+    mask = bound_rows(grid)[:, :, None] & grid.present & (original != 0)
+
+    jitter = 1 + (rng.random(original.shape) * 0.04 - 0.02)
+    new_values = np.rint(original * multiplier * jitter)
+
+    small = (original >= 1) & (original <= 10)
+    if operation == 'increase':
+        new_values = np.where(small & (new_values <= original), original + 1, new_values)
+    elif operation == 'decrease':
+        new_values = np.where(small & (new_values >= original), np.maximum(1, original - 1), new_values)
+
+    return np.where(mask, new_values, original).astype(np.int64), mask
+
+
+def find_direction_rows(grid, directions, reference_sheet='7-8AM', max_row=99):
+    """Rows of the reference sheet whose column A names a direction and whose B cell is not a formula"""
+    s = grid.sheets.index(reference_sheet)
+    direction_rows = {}
+    for row in grid.rows:
+        label = grid.labels[reference_sheet].get(row)
+        if row > max_row or not label:
+            continue
+        for direction in directions:
+            if direction.lower() in label.lower() and not grid.formulas[s, grid.row_index[row], 0]:
+                direction_rows.setdefault(direction, []).append(row)
+    return direction_rows
+
+
+def distribute_totals(grid, totals, direction_rows, weights, rng, default_weight, variation,
+                      minimum=0, adjust_sheets=None, correct='first'):
+    """
+    The force_exact_totals allocation for every bound and class at once.
+
+    Each class total is split over the hourly sheets by weight with +/-variation,
+    the rounding difference is spread over adjust_sheets (all sheets if none of
+    them exist) and any leftover goes to the first sheet (correct='first') or
+    the busiest one (correct='max'). Each sheet's share is then split over the
+    bound's rows with +/-30% variation, the last row taking the remainder.
+    Returns (new_values, mask of written cells).
+    """
+    new_values = grid.values.copy()
+    mask = np.zeros(grid.values.shape, dtype=bool)
+    n_sheets = len(grid.sheets)
+    sheet_weights = np.array([weights.get(name, default_weight) for name in grid.sheets])
+    adjust = [grid.sheets.index(name) for name in (adjust_sheets or []) if name in grid.sheets]
+    adjust = adjust or list(range(n_sheets))
+
+    for direction, class_totals in totals.items():
+        if direction not in direction_rows:
+            continue
+
+        target = np.array(class_totals, dtype=np.int64)
+        classes = np.nonzero(target)[0]
+        target = target[classes]
+        row_idx = [grid.row_index[row] for row in direction_rows[direction]]
+
+        # classes x sheets
+        base = target[:, None] * sheet_weights[None, :]
+        varied = base * (1 + rng.uniform(-variation, variation, base.shape))
+        hourly = np.maximum(minimum, np.floor(varied)).astype(np.int64)
+
+        difference = target - hourly.sum(axis=1)
+        per_sheet, remainder = np.divmod(difference, len(adjust))
+        adjustment = per_sheet[:, None] + (np.arange(len(adjust))[None, :] < remainder[:, None])
+        hourly[:, adjust] = np.maximum(0, hourly[:, adjust] + adjustment)
+
+        leftover = target - hourly.sum(axis=1)
+        fix = np.zeros(len(classes), dtype=np.int64) if correct == 'first' else hourly.argmax(axis=1)
+        hourly[np.arange(len(classes)), fix] += leftover
+
+        # classes x sheets x rows: row i gets min(its share, what is left), the
+        # last row the remainder, which is a capped running sum
+        share = (hourly / len(row_idx))[..., None]
+        row_variation = rng.uniform(-0.3, 0.3, hourly.shape + (len(row_idx) - 1,))
+        split = np.maximum(0, np.floor(share * (1 + row_variation)))
+        filled = np.minimum(np.cumsum(split, axis=-1), hourly[..., None])
+        per_row = np.diff(filled, axis=-1, prepend=0)
+        last = hourly - (filled[..., -1] if len(row_idx) > 1 else 0)
+        per_row = np.concatenate([per_row, last[..., None]], axis=-1)
+        per_row = np.where(hourly[..., None] > 0, per_row, 0).astype(np.int64)
+
+        cells = np.ix_(np.arange(n_sheets), row_idx, classes)
+        new_values[cells] = per_row.transpose(1, 2, 0)
+        mask[cells] = True
+
+    return new_values, mask
+
+
+def class_totals(grid, rows, values=None):
+    """Per-class sums over all sheets of the given worksheet rows"""
+    values = grid.values if values is None else values
+    return values[:, [grid.row_index[row] for row in rows], :].sum(axis=(0, 1))
@@ -0,0 +1,167 @@
+"""
+Long-lived worker that runs modify_excel for the Next.js worker pool.
+
+Jobs arrive on stdin and results leave on stdout as frames:
+
+    4-byte big-endian header length | JSON header | payload bytes
+
+The header's "size" field gives the payload length. A request header carries
+the job parameters and the workbook as payload; a response header carries
+"ok", the process log (or "error"), the run's metrics (see instrument.py)
+and the modified workbook as payload.
+While a job runs, every line it prints is also sent straight away as a
+payload-less {"id": ..., "event": "progress", "message": line} frame.
+
+A request header may name a "session" (the SHA-256 of the workbook). The
+worker then keeps that workbook parsed between jobs, so re-running it with
+other parameters skips the parse; the pool sends such jobs back to the same
+worker. At most WORKBOOK_SESSIONS workbooks (default 4) are kept, each for
+WORKBOOK_SESSION_TTL seconds (default 1800) after its last use, and only as
+many as fit in WORKBOOK_SESSION_MAX_MB (default 512). A parsed workbook is
+counted as WORKBOOK_SESSION_FACTOR (default 200) times its upload size, about
+what openpyxl takes for a template; one larger than the whole budget is
+parsed for each job instead of kept.
+"""
+import contextlib
+import io
+import json
+import os
+import struct
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+import instrument
+from modify_excel import modify_excel
+
+_LENGTH = struct.Struct('>I')
+
+
+def read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError
+    return data
+
+
+def read_frame(stream):
+    (header_size,) = _LENGTH.unpack(read_exact(stream, 4))
+    header = json.loads(read_exact(stream, header_size))
+    payload = read_exact(stream, header.get('size', 0))
+    return header, payload
+
+
+def write_frame(stream, header, payload=b''):
+    header = dict(header, size=len(payload))
+    encoded = json.dumps(header).encode('utf-8')
+    stream.write(_LENGTH.pack(len(encoded)))
+    stream.write(encoded)
+    stream.write(payload)
+    stream.flush()
+
+
+class ProgressLog(io.StringIO):
+    """Collects the job's output and reports each complete line as a progress frame"""
+
+    def __init__(self, stream, job_id):
+        super().__init__()
+        self.stream = stream
+        self.job_id = job_id
+        self.pending = ''
+
+    def write(self, text):
+        self.pending += text
+        *lines, self.pending = self.pending.split('\n')
+        for line in lines:
+            if line.strip():
+                write_frame(self.stream, {'id': self.job_id, 'event': 'progress', 'message': line})
+        return super().write(text)
+
+
+class Sessions:
+    """
+    Parsed workbooks by session key, least recently used first, dropped after
+    ttl seconds idle. A parsed workbook takes far more memory than its upload,
+    so each is counted as its upload size times factor, and the least recently
+    used ones go once there are more than size of them or their total passes
+    max_bytes.
+    """
+
+    def __init__(self, size, ttl, max_bytes, factor):
+        self.size = size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.factor = factor
+        self.entries = OrderedDict()
+        self.total = 0
+
+    def get(self, key, nbytes):
+        """The session dict for key, or None when a workbook of nbytes is too large to keep"""
+        now = time.monotonic()
+        for stale in [k for k, (_, used, _) in self.entries.items() if now - used > self.ttl]:
+            self.forget(stale)
+        estimate = nbytes * self.factor
+        if estimate > self.max_bytes:
+            self.forget(key)
+            return None
+        session = self.entries[key][0] if key in self.entries else {}
+        self.forget(key)
+        self.entries[key] = (session, now, estimate)
+        self.total += estimate
+        while len(self.entries) > self.size or self.total > self.max_bytes:
+            self.forget(next(iter(self.entries)))
+        return session
+
+    def forget(self, key):
+        if key in self.entries:
+            self.total -= self.entries.pop(key)[2]
+
+
+_sessions = Sessions(int(os.environ.get('WORKBOOK_SESSIONS', 4)),
+                     float(os.environ.get('WORKBOOK_SESSION_TTL', 1800)),
+                     float(os.environ.get('WORKBOOK_SESSION_MAX_MB', 512)) * 1024 * 1024,
+                     float(os.environ.get('WORKBOOK_SESSION_FACTOR', 200)))
+
+
+def run_job(header, payload, stream=None):
+    log = ProgressLog(stream, header.get('id')) if stream is not None else io.StringIO()
+    output = io.BytesIO()
+    metrics = instrument.Metrics()
+    session = _sessions.get(header['session'], len(payload)) if header.get('session') else None
+    if session:
+        print("Reusing the parsed workbook from an earlier run", file=log)
+    # {"profile": true} runs the job under cProfile and tracemalloc; the
+    # reports go to PROFILE_DIR (default profiles/) and their paths into the metrics
+    profiling = (instrument.profiled(payload, 'modify_excel') if header.get('profile')
+                 else contextlib.nullcontext())
+    with contextlib.redirect_stdout(log), profiling as metrics.profile:
+        modify_excel(io.BytesIO(payload), output, float(header.get('percentage', 13)),
+                     header.get('operation', 'increase'), header.get('mode', 'openpyxl'),
+                     seed=int(header['seed']) if header.get('seed') else None, metrics=metrics, session=session)
+    return log.getvalue(), output.getvalue(), metrics.as_dict()
+
+
+def main():
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    # Anything else printed must not corrupt the frame stream
+    sys.stdout = sys.stderr
+
+    while True:
+        try:
+            header, payload = read_frame(stdin)
+        except EOFError:
+            return
+
+        try:
+            log, result, metrics = run_job(header, payload, stdout)
+        except Exception as e:
+            traceback.print_exc()
+            write_frame(stdout, {'id': header.get('id'), 'ok': False, 'error': str(e)})
+        else:
+            write_frame(stdout, {'id': header.get('id'), 'ok': True, 'log': log, 'metrics': metrics}, result)
+
+
+if __name__ == '__main__':
+    main()
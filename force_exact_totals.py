@@ -1,55 +1,86 @@
+import argparse
+import contextlib
 import openpyxl
 from openpyxl import load_workbook
 import random
+import zipfile
 
-def force_exact_totals(input_file, output_file):
-    """
-    Force exact totals to match the image by aggressive distribution
-    """
-    
-    # Exact totals from image
-    totals = {
-        'Bisil Bound': [719, 1799, 954, 543, 551, 34, 9, 58, 677, 269, 363, 9], # Total: 5985
-        'Athi River Bound': [726, 1479, 1097, 651, 492, 58, 23, 67, 665, 233, 306, 11] # Total: 5808
-    }
-    
-    wb = load_workbook(input_file)
-    hourly_sheets = [name for name in wb.sheetnames if name != 'DAY']
-    
-    print("FORCING EXACT TOTALS TO MATCH IMAGE BY MUIRURI")
-    print("="*40)
-    
-    # Traffic intensity weights for realistic distribution
-    weights = {
-        '6-7AM': 0.08, '7-8AM': 0.08, '8-9AM': 0.08, '9-10AM': 0.065, '10-11AM': 0.065,
-        '11-12PM': 0.065, '12-1PM': 0.065, '1-2PM': 0.065, '2-3PM': 0.065,
-        '3-4PM': 0.065, '4-5PM': 0.08, '5-6PM': 0.08, '6-7PM': 0.08,
-        '7-8PM': 0.06, '8-9PM': 0.04, '9-10PM': 0.03, '10-11PM': 0.015,
-        '11-12AM': 0.01, '12-1AM': 0.005, '1-2AM': 0.0025, '2-3AM': 0.0025,
-        '3-4AM': 0.0025, '4-5AM': 0.0025, '5-6AM': 0.004
-    }
-    
-    # Find direction rows from reference sheet
+import change_log
+import instrument
+import layout
+import recalc
+import xlsx_patch
+
+# Exact totals from image
+TOTALS = {
+    'Bisil Bound': [719, 1799, 954, 543, 551, 34, 9, 58, 677, 269, 363, 9], # Total: 5985
+    'Athi River Bound': [726, 1479, 1097, 651, 492, 58, 23, 67, 665, 233, 306, 11] # Total: 5808
+}
+
+# Traffic intensity weights for realistic distribution
+WEIGHTS = {
+    '6-7AM': 0.08, '7-8AM': 0.08, '8-9AM': 0.08, '9-10AM': 0.065, '10-11AM': 0.065,
+    '11-12PM': 0.065, '12-1PM': 0.065, '1-2PM': 0.065, '2-3PM': 0.065,
+    '3-4PM': 0.065, '4-5PM': 0.08, '5-6PM': 0.08, '6-7PM': 0.08,
+    '7-8PM': 0.06, '8-9PM': 0.04, '9-10PM': 0.03, '10-11PM': 0.015,
+    '11-12AM': 0.01, '12-1AM': 0.005, '1-2AM': 0.0025, '2-3AM': 0.0025,
+    '3-4AM': 0.0025, '4-5AM': 0.0025, '5-6AM': 0.004
+}
+
+def written_cells(hourly_sheets, direction_rows):
+    """Cells written per hourly sheet: every row of a bound, for each class with a total"""
+    per_sheet = sum(len(rows) * sum(1 for total in TOTALS[direction] if total)
+                    for direction, rows in direction_rows.items() if direction in TOTALS)
+    return {sheet_name: per_sheet for sheet_name in hourly_sheets}
+
+def find_direction_rows(wb):
+    """Scan the reference sheet for the direction rows"""
     reference_sheet = wb['7-8AM']
     direction_rows = {}
     
     for row in range(1, 100):
         cell_a = reference_sheet.cell(row=row, column=1).value
         if cell_a:
-            for direction in totals.keys():
+            for direction in TOTALS.keys():
                 if direction.lower() in str(cell_a).lower():
                     cell_b = reference_sheet.cell(row=row, column=2).value
                     if not (isinstance(cell_b, str) and cell_b.startswith('=')):
                         if direction not in direction_rows:
                             direction_rows[direction] = []
                         direction_rows[direction].append(row)
+    return direction_rows
+
+def force_exact_totals(input_file, output_file, engine='openpyxl', use_layout=True, recorder=None,
+                       recalculate=True, seed=None):
+    """
+    Force exact totals to match the image by aggressive distribution
+    """
+    if engine == 'grid':
+        return force_exact_totals_grid(input_file, output_file, use_layout, recorder, recalculate, seed)
+    
+    # Seeded, the allocation can be repeated (the journal keeps the seed)
+    rng = random.Random(seed)
+    
+    wb = load_workbook(input_file)
+    hourly_sheets = [name for name in wb.sheetnames if name != 'DAY']
+    
+    print("FORCING EXACT TOTALS TO MATCH IMAGE BY MUIRURI")
+    print("="*40)
+    
+    # Find direction rows from reference sheet, or take them from the
+    # cached layout of this template
+    sheet_layout = layout.get_layout(input_file) if use_layout else None
+    if sheet_layout:
+        direction_rows = layout.find_direction_rows(sheet_layout, TOTALS.keys())
+    else:
+        direction_rows = find_direction_rows(wb)
     
     print("Found direction rows:")
     for direction, rows in direction_rows.items():
         print(f"  {direction}: {rows}")
     
     # Process each direction and vehicle class
-    for direction, direction_totals in totals.items():
+    for direction, direction_totals in TOTALS.items():
         print(f"\nProcessing {direction}...")
         
         if direction not in direction_rows:
@@ -68,11 +99,11 @@ def force_exact_totals(input_file, output_file):
             total_allocated = 0
             
             for sheet_name in hourly_sheets:
-                weight = weights.get(sheet_name, 0.0625)
+                weight = WEIGHTS.get(sheet_name, 0.0625)
                 base_value = total_16hour * weight
                 
                 # Add variation
-                variation = random.uniform(-0.2, 0.2)
+                variation = rng.uniform(-0.2, 0.2)
                 hourly_value = max(1, int(base_value * (1 + variation)))  # Minimum 1 to ensure distribution
                 hourly_distribution[sheet_name] = hourly_value
                 total_allocated += hourly_value
@@ -111,32 +142,71 @@ def force_exact_totals(input_file, output_file):
                         if i == len(target_rows) - 1:  # Last row gets remainder
                             value = remaining
                         else:
-                            variation = random.uniform(-0.3, 0.3)
+                            variation = rng.uniform(-0.3, 0.3)
                             value = max(0, int(base_per_row * (1 + variation)))
                             value = min(value, remaining)
                         
-                        sheet.cell(row=row_num, column=col_idx + 2).value = value
+                        cell = sheet.cell(row=row_num, column=col_idx + 2)
+                        if recorder is not None:
+                            recorder.add(sheet_name, row_num, col_idx + 2, cell.value, value, direction)
+                        cell.value = value
                         remaining -= value
                 else:
                     # Set all rows to 0
                     for row_num in target_rows:
-                        sheet.cell(row=row_num, column=col_idx + 2).value = 0
+                        cell = sheet.cell(row=row_num, column=col_idx + 2)
+                        if recorder is not None:
+                            recorder.add(sheet_name, row_num, col_idx + 2, cell.value, 0, direction)
+                        cell.value = 0
     
     wb.save(output_file)
     print(f"\nSaved to: {output_file}")
+    written = written_cells(hourly_sheets, direction_rows)
     
     # Final verification
-    verify_forced_totals(wb, totals, hourly_sheets, direction_rows)
+    verify_forced_totals(wb, TOTALS, hourly_sheets, direction_rows)
+    return written
 
 def verify_forced_totals(wb, totals, hourly_sheets, direction_rows):
     """Verify the forced totals"""
-    print("\nFINAL VERIFICATION:")
+    actual_totals = {}
     
     for direction, expected_totals in totals.items():
         if direction not in direction_rows:
             continue
             
         target_rows = direction_rows[direction]
+        class_actuals = []
+        
+        for col_idx, expected_class_total in enumerate(expected_totals):
+            class_actual = 0
+            if expected_class_total != 0:
+                for sheet_name in hourly_sheets:
+                    sheet = wb[sheet_name]
+                    for row_num in target_rows:
+                        val = sheet.cell(row=row_num, column=col_idx + 2).value or 0
+                        class_actual += val
+            class_actuals.append(class_actual)
+        
+        actual_totals[direction] = class_actuals
+    
+    print_forced_totals(totals, actual_totals)
+
+def verify_forced_totals_grid(grid, totals, direction_rows, values):
+    """Verify the forced totals from the count grid"""
+    import count_grid
+    
+    actual_totals = {direction: count_grid.class_totals(grid, direction_rows[direction], values).tolist()
+                     for direction in totals if direction in direction_rows}
+    print_forced_totals(totals, actual_totals)
+
+def print_forced_totals(totals, actual_totals):
+    print("\nFINAL VERIFICATION:")
+    
+    for direction, expected_totals in totals.items():
+        if direction not in actual_totals:
+            continue
+            
         print(f"\n{direction}:")
         
         direction_actual = 0
@@ -146,14 +216,7 @@ def verify_forced_totals(wb, totals, hourly_sheets, direction_rows):
             if expected_class_total == 0:
                 continue
                 
-            class_actual = 0
-            
-            for sheet_name in hourly_sheets:
-                sheet = wb[sheet_name]
-                for row_num in target_rows:
-                    val = sheet.cell(row=row_num, column=col_idx + 2).value or 0
-                    class_actual += val
-            
+            class_actual = actual_totals[direction][col_idx]
             direction_actual += class_actual
             status = "MATCH" if class_actual == expected_class_total else f"DIFF ({class_actual - expected_class_total})"
             print(f"  Class {col_idx+1}: {expected_class_total} -> {class_actual} [{status}]")
@@ -164,8 +227,100 @@ def verify_forced_totals(wb, totals, hourly_sheets, direction_rows):
         else:
             print(f"  [Difference: {direction_actual - direction_expected}]")
 
+def force_exact_totals_grid(input_file, output_file, use_layout=True, recorder=None, recalculate=True,
+                            seed=None):
+    """
+    force_exact_totals on the NumPy count grid: all bounds, classes and sheets are
+    allocated as array operations and the workbook is written back in one patch,
+    along with the cached results of the formulas that depend on the counts
+    """
+    import numpy as np
+    import count_grid
+    
+    if use_layout:
+        # Only the direction rows are read into the grid
+        sheet_layout = layout.get_layout(input_file)
+        hourly_sheets = [name for name in sheet_layout['sheets'] if name != 'DAY']
+        direction_rows = layout.find_direction_rows(sheet_layout, TOTALS.keys())
+        target_rows = {row for rows in direction_rows.values() for row in rows}
+        grid = count_grid.load_grid(input_file, hourly_sheets, {name: target_rows for name in hourly_sheets})
+    else:
+        with zipfile.ZipFile(input_file) as zf:
+            hourly_sheets = [name for name in xlsx_patch.sheet_parts(zf) if name != 'DAY']
+        grid = count_grid.load_grid(input_file, hourly_sheets)
+        direction_rows = count_grid.find_direction_rows(grid, TOTALS.keys())
+    
+    print("FORCING EXACT TOTALS TO MATCH IMAGE BY MUIRURI")
+    print("="*40)
+    
+    print("Found direction rows:")
+    for direction, rows in direction_rows.items():
+        print(f"  {direction}: {rows}")
+    
+    for direction, direction_totals in TOTALS.items():
+        print(f"\nProcessing {direction}...")
+        if direction not in direction_rows:
+            continue
+        for col_idx, total in enumerate(direction_totals):
+            if total != 0:
+                print(f"  Class {col_idx+1}: Forcing {total} vehicles")
+    
+    new_values, mask = count_grid.distribute_totals(
+        grid, TOTALS, direction_rows, WEIGHTS, np.random.default_rng(seed),
+        default_weight=0.0625, variation=0.2, minimum=1)
+
+    changes = grid.changes(new_values, mask)
+    if recorder is not None:
+        grid.record_changes(recorder, changes, direction_rows)
+    patch_changes = changes
+    if recalculate:
+        graph = recalc.formula_graph(input_file, sheet_layout if use_layout else None)
+        recalculated, stale = recalc.formula_changes(graph, changes, grid.original)
+        patch_changes = recalc.merge(changes, recalculated)
+    unwritten = {}
+    xlsx_patch.patch_workbook(input_file, output_file, patch_changes, unwritten=unwritten)
+    if recalculate:
+        recalc.report(recalculated, stale, unwritten)
+    print(f"\nSaved to: {output_file}")
+    written = {name: int(cells) for name, cells in zip(grid.sheets, mask.sum(axis=(1, 2)))}
+    
+    # Final verification
+    verify_forced_totals_grid(grid, TOTALS, direction_rows, new_values)
+    return written
+
 if __name__ == "__main__":
-    input_file = "Kitengela Area, Day 3 Wednesday Counts.xlsx"
-    output_file = "Kitengela_Forced_Exact_Totals.xlsx"
+    parser = argparse.ArgumentParser(description="Force exact totals")
+    parser.add_argument("input_file", nargs="?", default="Kitengela Area, Day 3 Wednesday Counts.xlsx")
+    parser.add_argument("output_file", nargs="?", default="Kitengela_Forced_Exact_Totals.xlsx")
+    parser.add_argument("--engine", default="openpyxl", choices=["openpyxl", "grid"],
+                        help="grid allocates with NumPy and patches the sheet XML in one write")
+    parser.add_argument("--no-layout-cache", dest="use_layout", action="store_false",
+                        help="rediscover the direction rows instead of using the cached template layout")
+    parser.add_argument("--no-recalc", dest="recalculate", action="store_false",
+                        help="with --engine grid, leave the cached formula results to Excel")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed the allocation so the same input always gives the same output "
+                             "(one is picked and kept in the journal when not given)")
+    parser.add_argument("--export", metavar="FILE",
+                        help="also write the changed counts as a table: Parquet for .parquet with pyarrow, else CSV")
+    parser.add_argument("--no-journal", dest="journal", action="store_false",
+                        help="don't write the change journal next to the output (see journal.py)")
+    parser.add_argument("--profile", nargs="?", const=instrument.default_profile_dir(), metavar="DIR",
+                        help="write cProfile stats and a tracemalloc report for this run to DIR (default profiles/)")
+    args = parser.parse_args()
+    if args.journal and args.seed is None:
+        args.seed = random.SystemRandom().randrange(1 << 32)
     
-    force_exact_totals(input_file, output_file)
\ No newline at end of file
+    profiling = (instrument.profiled(args.input_file, 'force_exact_totals', args.profile) if args.profile
+                 else contextlib.nullcontext())
+    recorder = change_log.ChangeRecorder() if args.export or args.journal else None
+    with profiling:
+        force_exact_totals(args.input_file, args.output_file, args.engine, args.use_layout, recorder,
+                           args.recalculate, args.seed)
+    if args.export:
+        print(f"Exported {len(recorder)} changes to {change_log.write_table(recorder, args.export)}")
+    if args.journal:
+        run = change_log.run_record('force_exact_totals', args.input_file, args.output_file,
+                                    {'engine': args.engine, 'use_layout': args.use_layout,
+                                     'recalculate': args.recalculate}, args.seed)
+        print(f"Journal written to {change_log.write_journal(recorder, change_log.journal_path(args.output_file), run)}")
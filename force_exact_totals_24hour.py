@@ -1,55 +1,89 @@
+import argparse
+import contextlib
 import openpyxl
 from openpyxl import load_workbook
 import random
+import zipfile
 
-def force_exact_totals_24hour(input_file, output_file):
-    """
-    Force exact totals for 24-hour traffic data with realistic distribution
-    Also ensures DAY sheet matches image totals exactly
-    """
-    
-    # Exact totals from image (same as 16-hour version)
-    totals = {
-        'Bisil Bound': [754, 1432, 856, 467, 731, 48, 43, 75, 578, 230, 264, 11], # Total: 5489
-        'Athi River Bound': [678, 1201, 934, 522, 642, 56, 34, 71, 561, 214, 282, 14] # Total: 5209
-    }
-    
-    wb = load_workbook(input_file)
-    hourly_sheets = [name for name in wb.sheetnames if name != 'DAY']
-    
-    print("FORCING EXACT TOTALS FOR 24-HOUR DATA BY MUIRURI")
-    print("="*50)
-    
-    # 24-hour traffic intensity weights (your suggested distribution)
-    weights = {
-        '6-7AM': 0.055, '7-8AM': 0.065, '8-9AM': 0.075, '9-10AM': 0.065, '10-11AM': 0.055,
-        '11-12AM': 0.050, '12-1PM': 0.055, '1-2PM': 0.055, '2-3PM': 0.055, '3-4PM': 0.055,
-        '4-5PM': 0.065, '5-6PM': 0.075, '6-7PM': 0.070, '7-8PM': 0.055, '8-9PM': 0.045,
-        '9-10PM': 0.035, '10-11PM': 0.025, '11-12PM': 0.020, '12-1AM': 0.015, '1-2AM': 0.010,
-        '2-3AM': 0.008, '3-4AM': 0.007, '4-5AM': 0.008, '5-6AM': 0.03
-    }
-    
-    # Find direction rows from reference sheet
+import change_log
+import instrument
+import layout
+import recalc
+import xlsx_patch
+
+# Exact totals from image (same as 16-hour version)
+TOTALS = {
+    'Bisil Bound': [754, 1432, 856, 467, 731, 48, 43, 75, 578, 230, 264, 11], # Total: 5489
+    'Athi River Bound': [678, 1201, 934, 522, 642, 56, 34, 71, 561, 214, 282, 14] # Total: 5209
+}
+
+# 24-hour traffic intensity weights (your suggested distribution)
+WEIGHTS = {
+    '6-7AM': 0.055, '7-8AM': 0.065, '8-9AM': 0.075, '9-10AM': 0.065, '10-11AM': 0.055,
+    '11-12AM': 0.050, '12-1PM': 0.055, '1-2PM': 0.055, '2-3PM': 0.055, '3-4PM': 0.055,
+    '4-5PM': 0.065, '5-6PM': 0.075, '6-7PM': 0.070, '7-8PM': 0.055, '8-9PM': 0.045,
+    '9-10PM': 0.035, '10-11PM': 0.025, '11-12PM': 0.020, '12-1AM': 0.015, '1-2AM': 0.010,
+    '2-3AM': 0.008, '3-4AM': 0.007, '4-5AM': 0.008, '5-6AM': 0.03
+}
+
+# Rounding differences are absorbed by the peak hours first
+PEAK_HOURS = ['7-8AM', '8-9AM', '5-6PM', '6-7PM']
+
+def written_cells(hourly_sheets, direction_rows):
+    """Cells written per hourly sheet: every row of a bound, for each class with a total"""
+    per_sheet = sum(len(rows) * sum(1 for total in TOTALS[direction] if total)
+                    for direction, rows in direction_rows.items() if direction in TOTALS)
+    return {sheet_name: per_sheet for sheet_name in hourly_sheets}
+
+def find_direction_rows(wb):
+    """Scan the reference sheet for the direction rows"""
     reference_sheet = wb['7-8AM']
     direction_rows = {}
     
     for row in range(1, 100):
         cell_a = reference_sheet.cell(row=row, column=1).value
         if cell_a:
-            for direction in totals.keys():
+            for direction in TOTALS.keys():
                 if direction.lower() in str(cell_a).lower():
                     cell_b = reference_sheet.cell(row=row, column=2).value
                     if not (isinstance(cell_b, str) and cell_b.startswith('=')):
                         if direction not in direction_rows:
                             direction_rows[direction] = []
                         direction_rows[direction].append(row)
+    return direction_rows
+
+def force_exact_totals_24hour(input_file, output_file, engine='openpyxl', use_layout=True, recorder=None,
+                              recalculate=True, seed=None):
+    """
+    Force exact totals for 24-hour traffic data with realistic distribution
+    Also ensures DAY sheet matches image totals exactly
+    """
+    if engine == 'grid':
+        return force_exact_totals_24hour_grid(input_file, output_file, use_layout, recorder, recalculate, seed)
+    
+    # Seeded, the allocation can be repeated (the journal keeps the seed)
+    rng = random.Random(seed)
+    
+    wb = load_workbook(input_file)
+    hourly_sheets = [name for name in wb.sheetnames if name != 'DAY']
+    
+    print("FORCING EXACT TOTALS FOR 24-HOUR DATA BY MUIRURI")
+    print("="*50)
+    
+    # Find direction rows from reference sheet, or take them from the
+    # cached layout of this template
+    sheet_layout = layout.get_layout(input_file) if use_layout else None
+    if sheet_layout:
+        direction_rows = layout.find_direction_rows(sheet_layout, TOTALS.keys())
+    else:
+        direction_rows = find_direction_rows(wb)
     
     print("Found direction rows:")
     for direction, rows in direction_rows.items():
         print(f"  {direction}: {rows}")
     
     # Process each direction and vehicle class
-    for direction, direction_totals in totals.items():
+    for direction, direction_totals in TOTALS.items():
         print(f"\nProcessing {direction}...")
         
         if direction not in direction_rows:
@@ -68,11 +102,11 @@ def force_exact_totals_24hour(input_file, output_file):
             total_allocated = 0
             
             for sheet_name in hourly_sheets:
-                weight = weights.get(sheet_name, 0.042)  # Default weight for 24 hours
+                weight = WEIGHTS.get(sheet_name, 0.042)  # Default weight for 24 hours
                 base_value = total_target * weight
                 
                 # Add realistic variation
-                variation = random.uniform(-0.25, 0.25)
+                variation = rng.uniform(-0.25, 0.25)
                 hourly_value = max(0, int(base_value * (1 + variation)))
                 hourly_distribution[sheet_name] = hourly_value
                 total_allocated += hourly_value
@@ -82,8 +116,7 @@ def force_exact_totals_24hour(input_file, output_file):
             
             if difference != 0:
                 # Distribute difference across peak hours first
-                peak_hours = ['7-8AM', '8-9AM', '5-6PM', '6-7PM']
-                available_sheets = [s for s in peak_hours if s in hourly_sheets]
+                available_sheets = [s for s in PEAK_HOURS if s in hourly_sheets]
                 if not available_sheets:
                     available_sheets = hourly_sheets
                 
@@ -115,16 +148,24 @@ def force_exact_totals_24hour(input_file, output_file):
                         if i == len(target_rows) - 1:  # Last row gets remainder
                             value = remaining
                         else:
-                            variation = random.uniform(-0.3, 0.3)
+                            variation = rng.uniform(-0.3, 0.3)
                             value = max(0, int(base_per_row * (1 + variation)))
                             value = min(value, remaining)
                         
-                        sheet.cell(row=row_num, column=col_idx + 2).value = value
+                        cell = sheet.cell(row=row_num, column=col_idx + 2)
+                        if recorder is not None:
+                            recorder.add(sheet_name, row_num, col_idx + 2, cell.value, value, direction)
+                        cell.value = value
                         remaining -= value
                 else:
                     # Set all rows to 0
                     for row_num in target_rows:
-                        sheet.cell(row=row_num, column=col_idx + 2).value = 0
+                        cell = sheet.cell(row=row_num, column=col_idx + 2)
+                        if recorder is not None:
+                            recorder.add(sheet_name, row_num, col_idx + 2, cell.value, 0, direction)
+                        cell.value = 0
+    
+    written = written_cells(hourly_sheets, direction_rows)
     
     # Fix DAY sheet totals - replace any existing formulas with exact values
     if 'DAY' in wb.sheetnames:
@@ -132,49 +173,92 @@ def force_exact_totals_24hour(input_file, output_file):
         
         # Clear any existing formulas and set exact totals
         # Find existing direction rows or create new ones
-        direction_found = {}
-        for row in range(1, 200):
-            cell_value = day_sheet.cell(row=row, column=1).value
-            if cell_value:
-                for direction in totals.keys():
-                    if direction.lower() in str(cell_value).lower():
-                        direction_found[direction] = row
-                        break
+        if sheet_layout:
+            direction_found = layout.find_summary_rows(sheet_layout, TOTALS.keys())
+        else:
+            direction_found = {}
+            for row in range(1, 200):
+                cell_value = day_sheet.cell(row=row, column=1).value
+                if cell_value:
+                    for direction in TOTALS.keys():
+                        if direction.lower() in str(cell_value).lower():
+                            direction_found[direction] = row
+                            break
+        
+        def set_day(row, col, value, bound=''):
+            cell = day_sheet.cell(row=row, column=col)
+            if recorder is not None:
+                recorder.add('DAY', row, col, cell.value, value, bound)
+            cell.value = value
         
         # If no existing rows found, create new summary
         if not direction_found:
             start_row = 50
-            day_sheet.cell(row=start_row, column=1).value = "DAILY TOTALS SUMMARY"
+            set_day(start_row, 1, "DAILY TOTALS SUMMARY")
             direction_found['Bisil Bound'] = start_row + 2
             direction_found['Athi River Bound'] = start_row + 3
-            day_sheet.cell(row=start_row+2, column=1).value = "Bisil Bound"
-            day_sheet.cell(row=start_row+3, column=1).value = "Athi River Bound"
+            set_day(start_row + 2, 1, "Bisil Bound", "Bisil Bound")
+            set_day(start_row + 3, 1, "Athi River Bound", "Athi River Bound")
+            written['DAY'] = 3
         
         # Set exact totals (override any formulas)
-        for direction, class_totals in totals.items():
+        for direction, class_totals in TOTALS.items():
             if direction in direction_found:
                 row = direction_found[direction]
                 for col_idx, total in enumerate(class_totals):
-                    day_sheet.cell(row=row, column=col_idx + 2).value = total
-                day_sheet.cell(row=row, column=14).value = sum(class_totals)
+                    set_day(row, col_idx + 2, total, direction)
+                set_day(row, 14, sum(class_totals), direction)
+                written['DAY'] = written.get('DAY', 0) + len(class_totals) + 1
                 print(f"Set DAY sheet {direction}: {sum(class_totals)} total")
     
     wb.save(output_file)
     print(f"\nSaved to: {output_file}")
     
     # Final verification
-    verify_24hour_totals(wb, totals, hourly_sheets, direction_rows)
+    verify_24hour_totals(wb, TOTALS, hourly_sheets, direction_rows)
+    return written
 
 def verify_24hour_totals(wb, totals, hourly_sheets, direction_rows):
     """Verify the 24-hour totals"""
-    print("\nFINAL 24-HOUR VERIFICATION:")
-    print("="*30)
+    actual_totals = {}
     
     for direction, expected_totals in totals.items():
         if direction not in direction_rows:
             continue
             
         target_rows = direction_rows[direction]
+        class_actuals = []
+        
+        for col_idx, expected_class_total in enumerate(expected_totals):
+            class_actual = 0
+            if expected_class_total != 0:
+                for sheet_name in hourly_sheets:
+                    sheet = wb[sheet_name]
+                    for row_num in target_rows:
+                        val = sheet.cell(row=row_num, column=col_idx + 2).value or 0
+                        class_actual += val
+            class_actuals.append(class_actual)
+        
+        actual_totals[direction] = class_actuals
+    
+    print_24hour_totals(totals, actual_totals)
+
+def verify_24hour_totals_grid(grid, totals, direction_rows, values):
+    """Verify the 24-hour totals from the count grid"""
+    import count_grid
+    
+    actual_totals = {direction: count_grid.class_totals(grid, direction_rows[direction], values).tolist()
+                     for direction in totals if direction in direction_rows}
+    print_24hour_totals(totals, actual_totals)
+
+def print_24hour_totals(totals, actual_totals):
+    print("\nFINAL 24-HOUR VERIFICATION:")
+    print("="*30)
+    
+    for direction, expected_totals in totals.items():
+        if direction not in actual_totals:
+            continue
+            
         print(f"\n{direction}:")
         
         direction_actual = 0
@@ -184,14 +268,7 @@ def verify_24hour_totals(wb, totals, hourly_sheets, direction_rows):
             if expected_class_total == 0:
                 continue
                 
-            class_actual = 0
-            
-            for sheet_name in hourly_sheets:
-                sheet = wb[sheet_name]
-                for row_num in target_rows:
-                    val = sheet.cell(row=row_num, column=col_idx + 2).value or 0
-                    class_actual += val
-            
+            class_actual = actual_totals[direction][col_idx]
             direction_actual += class_actual
             status = "MATCH" if class_actual == expected_class_total else f"DIFF ({class_actual - expected_class_total})"
             print(f"  Class {col_idx+1}: {expected_class_total} -> {class_actual} [{status}]")
@@ -202,8 +279,173 @@ def verify_24hour_totals(wb, totals, hourly_sheets, direction_rows):
         else:
             print(f"  [Difference: {direction_actual - direction_expected}]")
 
+def force_exact_totals_24hour_grid(input_file, output_file, use_layout=True, recorder=None, recalculate=True,
+                                   seed=None):
+    """
+    force_exact_totals_24hour on the NumPy count grid: all bounds, classes and sheets are
+    allocated as array operations and the workbook is written back in one patch.
+    The cached results of the formulas that depend on the counts are updated
+    too, and a DAY formula is kept when its new result already is the exact total.
+    """
+    import numpy as np
+    import count_grid
+    
+    if use_layout:
+        # Only the direction rows are read into the grid
+        sheet_layout = layout.get_layout(input_file)
+        hourly_sheets = [name for name in sheet_layout['sheets'] if name != 'DAY']
+        direction_rows = layout.find_direction_rows(sheet_layout, TOTALS.keys())
+        target_rows = {row for rows in direction_rows.values() for row in rows}
+        grid = count_grid.load_grid(input_file, hourly_sheets, {name: target_rows for name in hourly_sheets})
+    else:
+        with zipfile.ZipFile(input_file) as zf:
+            hourly_sheets = [name for name in xlsx_patch.sheet_parts(zf) if name != 'DAY']
+        grid = count_grid.load_grid(input_file, hourly_sheets)
+        direction_rows = count_grid.find_direction_rows(grid, TOTALS.keys())
+    
+    print("FORCING EXACT TOTALS FOR 24-HOUR DATA BY MUIRURI")
+    print("="*50)
+    
+    print("Found direction rows:")
+    for direction, rows in direction_rows.items():
+        print(f"  {direction}: {rows}")
+    
+    for direction, direction_totals in TOTALS.items():
+        print(f"\nProcessing {direction}...")
+        if direction not in direction_rows:
+            continue
+        for col_idx, total in enumerate(direction_totals):
+            if total != 0:
+                print(f"  Class {col_idx+1}: Distributing {total} vehicles across 24 hours")
+    
+    new_values, mask = count_grid.distribute_totals(
+        grid, TOTALS, direction_rows, WEIGHTS, np.random.default_rng(seed),
+        default_weight=0.042, variation=0.25,
+        adjust_sheets=PEAK_HOURS, correct='max')
+
+    changes = grid.changes(new_values, mask)
+    if recorder is not None:
+        grid.record_changes(recorder, changes, direction_rows)
+    
+    if recalculate:
+        graph = recalc.formula_graph(input_file, sheet_layout if use_layout else None)
+        hourly_recalculated, _ = recalc.formula_changes(graph, changes, grid.original)
+
+    # DAY sheet totals, as in the openpyxl path
+    day_rows = {}
+    day_cells = {}
+    with zipfile.ZipFile(input_file) as zf:
+        parts = xlsx_patch.sheet_parts(zf)
+        if 'DAY' in parts and use_layout:
+            day_rows = layout.find_summary_rows(sheet_layout, TOTALS.keys())
+        elif 'DAY' in parts:
+            strings = xlsx_patch.shared_strings(zf)
+            for row, cells in xlsx_patch.iter_rows(zf, parts['DAY'], strings, max_col=1):
+                cell_value = cells[1].value if 1 in cells else None
+                if row < 200 and cell_value:
+                    for direction in TOTALS.keys():
+                        if direction.lower() in str(cell_value).lower():
+                            day_rows[direction] = row
+                            break
+        if day_rows:
+            # What the summary cells hold now, to tell if their formulas can stay
+            strings = xlsx_patch.shared_strings(zf)
+            for row, cells in xlsx_patch.iter_rows(zf, parts['DAY'], strings, max_col=14, rows=set(day_rows.values())):
+                for col, cell in cells.items():
+                    day_cells[(row, col)] = cell
+
+    def keeps_formula(position, total):
+        """A DAY formula whose recalculated result is the exact total is left in place"""
+        cell = day_cells.get(position)
+        if not recalculate or cell is None or cell.formula is None or not isinstance(cell.value, (int, float)):
+            return False
+        recalculated = hourly_recalculated.get('DAY', {}).get(position)
+        return cell.value + (recalculated.delta if recalculated else 0) == total
+    
+    if 'DAY' in parts:
+        day_changes = changes['DAY'] = {}
+        if not day_rows:
+            start_row = 50
+            day_changes[(start_row, 1)] = "DAILY TOTALS SUMMARY"
+            day_rows['Bisil Bound'] = start_row + 2
+            day_rows['Athi River Bound'] = start_row + 3
+            day_changes[(start_row + 2, 1)] = "Bisil Bound"
+            day_changes[(start_row + 3, 1)] = "Athi River Bound"
+        
+        for direction, class_totals in TOTALS.items():
+            if direction in day_rows:
+                row = day_rows[direction]
+                for col_idx, total in enumerate(class_totals):
+                    if not keeps_formula((row, col_idx + 2), total):
+                        day_changes[(row, col_idx + 2)] = total
+                if not keeps_formula((row, 14), sum(class_totals)):
+                    day_changes[(row, 14)] = sum(class_totals)
+                print(f"Set DAY sheet {direction}: {sum(class_totals)} total")
+    
+    if recorder is not None and changes.get('DAY'):
+        # The summary cells as they were, formulas as '=...' so they can be put back
+        bound_of = {row: direction for direction, row in day_rows.items()}
+        def day_original(row, col):
+            cell = day_cells.get((row, col))
+            if cell is None:
+                return None
+            return '=' + cell.formula if cell.formula is not None else cell.value
+        recorder.add_sheet('DAY', changes['DAY'], day_original, lambda row: bound_of.get(row, ''))
+    
+    patch_changes = changes
+    if recalculate:
+        # Again with the DAY cells that were overwritten, which no longer follow their formulas
+        def original(sheet, row, col):
+            if sheet == 'DAY':
+                cell = day_cells.get((row, col))
+                return cell.value if cell else None
+            return grid.original(sheet, row, col)
+        recalculated, stale = recalc.formula_changes(graph, changes, original)
+        patch_changes = recalc.merge(changes, recalculated)
+    unwritten = {}
+    xlsx_patch.patch_workbook(input_file, output_file, patch_changes, unwritten=unwritten)
+    if recalculate:
+        recalc.report(recalculated, stale, unwritten)
+    print(f"\nSaved to: {output_file}")
+    written = {name: len(cells) for name, cells in changes.items()}
+    
+    # Final verification
+    verify_24hour_totals_grid(grid, TOTALS, direction_rows, new_values)
+    return written
+
 if __name__ == "__main__":
-    input_file = "Kitengela Area, Day 3 Wednesday Counts.xlsx"
-    output_file = "Kitengela_Perfect_Match.xlsx"
+    parser = argparse.ArgumentParser(description="Force exact 24-hour totals")
+    parser.add_argument("input_file", nargs="?", default="Kitengela Area, Day 3 Wednesday Counts.xlsx")
+    parser.add_argument("output_file", nargs="?", default="Kitengela_Perfect_Match.xlsx")
+    parser.add_argument("--engine", default="openpyxl", choices=["openpyxl", "grid"],
+                        help="grid allocates with NumPy and patches the sheet XML in one write")
+    parser.add_argument("--no-layout-cache", dest="use_layout", action="store_false",
+                        help="rediscover the direction rows instead of using the cached template layout")
+    parser.add_argument("--no-recalc", dest="recalculate", action="store_false",
+                        help="with --engine grid, leave the cached formula results to Excel")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed the allocation so the same input always gives the same output "
+                             "(one is picked and kept in the journal when not given)")
+    parser.add_argument("--export", metavar="FILE",
+                        help="also write the changed counts as a table: Parquet for .parquet with pyarrow, else CSV")
+    parser.add_argument("--no-journal", dest="journal", action="store_false",
+                        help="don't write the change journal next to the output (see journal.py)")
+    parser.add_argument("--profile", nargs="?", const=instrument.default_profile_dir(), metavar="DIR",
+                        help="write cProfile stats and a tracemalloc report for this run to DIR (default profiles/)")
+    args = parser.parse_args()
+    if args.journal and args.seed is None:
+        args.seed = random.SystemRandom().randrange(1 << 32)
     
-    force_exact_totals_24hour(input_file, output_file)
\ No newline at end of file
+    profiling = (instrument.profiled(args.input_file, 'force_exact_totals_24hour', args.profile) if args.profile
+                 else contextlib.nullcontext())
+    recorder = change_log.ChangeRecorder() if args.export or args.journal else None
+    with profiling:
+        force_exact_totals_24hour(args.input_file, args.output_file, args.engine, args.use_layout, recorder,
+                                  args.recalculate, args.seed)
+    if args.export:
+        print(f"Exported {len(recorder)} changes to {change_log.write_table(recorder, args.export)}")
+    if args.journal:
+        run = change_log.run_record('force_exact_totals_24hour', args.input_file, args.output_file,
+                                    {'engine': args.engine, 'use_layout': args.use_layout,
+                                     'recalculate': args.recalculate}, args.seed)
+        print(f"Journal written to {change_log.write_journal(recorder, change_log.journal_path(args.output_file), run)}")
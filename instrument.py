@@ -0,0 +1,220 @@
+"""
+Per-run instrumentation: wall time per phase, counters and peak memory.
+
+    metrics = instrument.Metrics()
+    with metrics.phase('load_workbook'):
+        wb = openpyxl.load_workbook(path)
+    metrics.count('cells_modified', 42)
+    metrics.as_dict()
+    # {'phases_ms': {'load_workbook': 812.4}, 'counters': {'cells_modified': 42},
+    #  'total_ms': 812.6, 'peak_rss_bytes': 98304000}
+
+modify_excel.py, the Python function and the worker pool all return this
+dict alongside the log, and the Next.js side aggregates it into /api/metrics.
+
+profiled() is the opt-in deep dive for a single slow workbook: cProfile and
+tracemalloc around one run. Callers use contextlib.nullcontext() when it's
+off, so the normal path doesn't pay for either; their imports wait until a
+run is profiled as well.
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_bytes():
+    """Peak resident memory of this process so far, or None where it can't be read"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def input_hash(file):
+    """Short SHA-256 of a path, a bytes-like object or a seekable file object"""
+    import hashlib
+
+    digest = hashlib.sha256()
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    elif isinstance(file, (bytes, bytearray, memoryview)):
+        digest.update(file)
+    else:
+        position = file.tell()
+        file.seek(0)
+        digest.update(file.read())
+        file.seek(position)
+    return digest.hexdigest()[:16]
+
+
+def default_profile_dir():
+    return os.environ.get('PROFILE_DIR') or 'profiles'
+
+
+def file_size(file):
+    """Size in bytes of a path, a bytes-like object or a seekable file object"""
+    if isinstance(file, (str, os.PathLike)):
+        return os.path.getsize(file)
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return len(file)
+    if isinstance(file, io.BytesIO):
+        return file.getbuffer().nbytes
+    position = file.tell()
+    size = file.seek(0, io.SEEK_END)
+    file.seek(position)
+    return size
+
+
+class Metrics:
+    """Phase timings and counters of one run; phases and counters add up if repeated"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        # Report paths when the run was profiled (see profiled())
+        self.profile = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        metrics = {
+            'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+            'counters': dict(self.counters),
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+        if self.profile is not None:
+            metrics['profile'] = self.profile
+        return metrics
+
+    def write(self, path):
+        """Write as_dict() as JSON to path, or to stdout for '-'"""
+        text = json.dumps(self.as_dict(), indent=2)
+        if path == '-':
+            print(text)
+        else:
+            with open(path, 'w') as f:
+                f.write(text + '\n')
+
+
+class _PeakWatcher:
+    """
+    Keeps a tracemalloc snapshot from close to the peak of traced memory.
+    A snapshot taken once the run is over only shows what is still alive,
+    which misses the workbook itself; this one is retaken from a background
+    thread whenever traced memory has grown by a quarter since the last.
+    """
+
+    def __init__(self, interval=0.05, growth=1.25):
+        import threading
+
+        self.interval = interval
+        self.growth = growth
+        self.snapshot = None
+        self.size = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def check(self):
+        import tracemalloc
+
+        current, _ = tracemalloc.get_traced_memory()
+        if self.snapshot is None or current > self.size * self.growth:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.size = current
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.check()
+
+
+def _allocation_report(snapshot, size, peak, top):
+    """The top allocation sites of a tracemalloc snapshot as text"""
+    import tracemalloc
+
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ])
+    stats = snapshot.statistics('lineno')
+    lines = [f"Peak traced memory: {peak / 1024 / 1024:.1f} MB",
+             f"Top {min(top, len(stats))} of {len(stats)} allocation sites, "
+             f"snapshot at {size / 1024 / 1024:.1f} MB traced:",
+             '']
+    for stat in stats[:top]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KB {stat.count:9d} blocks  {frame.filename}:{frame.lineno}")
+    return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def profiled(input_file, name, directory=None, top=30):
+    """
+    Run the enclosed block under cProfile and tracemalloc and write
+    <directory>/<name>-<input hash>.prof (open with pstats or snakeviz) and
+    <name>-<input hash>.alloc.txt (the top allocation sites near the peak).
+    The hash names the input, so reruns of one workbook overwrite each other.
+    Yields a dict that holds the two paths once the block has finished.
+
+    tracemalloc slows allocation-heavy code several times over, which
+    inflates those functions in the cProfile timings too.
+    """
+    import cProfile
+    import tracemalloc
+
+    directory = directory or default_profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, f"{name}-{input_hash(input_file)}")
+    paths = {}
+
+    tracemalloc.start()
+    watcher = _PeakWatcher()
+    profiler = cProfile.Profile()
+    try:
+        with watcher:
+            # cProfile only sees this thread, not the watcher
+            profiler.enable()
+            try:
+                yield paths
+            finally:
+                profiler.disable()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    paths['pstats'] = stem + '.prof'
+    paths['allocations'] = stem + '.alloc.txt'
+    profiler.dump_stats(paths['pstats'])
+    with open(paths['allocations'], 'w') as f:
+        f.write(_allocation_report(watcher.snapshot, watcher.size, peak, top))
+    print(f"Profile written to {paths['pstats']} and {paths['allocations']}", file=sys.stderr)
@@ -0,0 +1,143 @@
+"""
+Review, redo or undo a run from its change journal, without running the
+transform again.
+
+modify_excel, force_exact_totals and force_exact_totals_24hour write
+<output stem>.journal next to their output (see change_log.py): every cell
+they changed with its old and new value, the run's parameters and seed, and
+hashes of the input and output workbooks.
+
+    python journal.py diff Modified_Traffic_Counts.journal
+    python journal.py apply Modified_Traffic_Counts.journal counts.xlsx redone.xlsx
+    python journal.py revert Modified_Traffic_Counts.journal Modified_Traffic_Counts.xlsx restored.xlsx
+
+diff reads only the journal. apply writes the new values into the run's
+input and revert writes the old ones back into its output, both through the
+patch path (only the changed sheets are rewritten, and the cached formula
+results that depend on them follow, see recalc.py). They refuse a workbook
+whose hash isn't the one the journal expects unless --force is given.
+"""
+import argparse
+import json
+
+import change_log
+import instrument
+import layout
+import recalc
+import xlsx_patch
+
+# The summary sheet adds up the hourly ones, so it's left out of the deltas
+SUMMARY_SHEETS = ('DAY',)
+
+def check_workbook(run, workbook, revert):
+    """Raise ValueError unless workbook is the one the journal applies to"""
+    key, role = ('output_hash', 'output') if revert else ('input_hash', 'input')
+    if instrument.input_hash(workbook) != run[key]:
+        raise ValueError(f"{workbook} is not the {role} of this run ({run[role]}); pass --force to use it anyway")
+
+def apply_journal(journal_file, input_file, output_file, revert=False, force=False, use_layout=True,
+                  recalculate=True):
+    """
+    Write output_file as input_file with the journal's new values, or with
+    its old values when revert is set. Returns the cells written per sheet.
+    """
+    run, recorder = change_log.read_journal(journal_file)
+    if not force:
+        check_workbook(run, input_file, revert)
+
+    changes = recorder.changes(old=revert)
+    patch_changes = changes
+    if recalculate:
+        # What the changed cells hold in input_file is the other side of the journal
+        before = {}
+        for sheet_name, cells in recorder.changes(old=not revert).items():
+            for (row, col), value in cells.items():
+                before[(sheet_name, row, col)] = value
+        sheet_layout = layout.get_layout(input_file) if use_layout else None
+        graph = recalc.formula_graph(input_file, sheet_layout)
+        recalculated, stale = recalc.formula_changes(graph, changes, lambda *cell: before[cell])
+        patch_changes = recalc.merge(changes, recalculated)
+    unwritten = {}
+    xlsx_patch.patch_workbook(input_file, output_file, patch_changes, unwritten=unwritten)
+    if recalculate:
+        recalc.report(recalculated, stale, unwritten)
+
+    written = {sheet_name: len(cells) for sheet_name, cells in changes.items()}
+    print(f"{'Reverted' if revert else 'Applied'} {sum(written.values())} cells from {journal_file}")
+    print(f"Saved to: {output_file}")
+    return written
+
+def print_run(run):
+    print(f"{run['script']} run of {run['created']}")
+    print(f"  input : {run['input']} ({run['input_hash']})")
+    print(f"  output: {run['output']} ({run['output_hash']})")
+    params = ', '.join(f"{name}={value}" for name, value in run['params'].items())
+    print(f"  params: {params}")
+    if run.get('seed') is not None:
+        print(f"  seed  : {run['seed']}")
+
+def print_deltas(deltas):
+    """Per-bound rows of per-class deltas, with totals"""
+    cols = sorted({col for bound_deltas in deltas.values() for col in bound_deltas})
+    if not cols:
+        print("No count changes")
+        return
+    width = max([len('Bound'), len('TOTAL')] + [len(bound) for bound in deltas])
+    header = f"{'Bound':<{width}}" + ''.join(f"{change_log.column_letter(col):>8}" for col in cols) + f"{'Total':>10}"
+    print(header)
+    print('-' * len(header))
+    class_totals = dict.fromkeys(cols, 0)
+    for bound, bound_deltas in sorted(deltas.items()):
+        line = f"{bound or '(no label)':<{width}}"
+        for col in cols:
+            delta = bound_deltas.get(col, 0)
+            class_totals[col] += delta
+            line += f"{delta:>+8g}"
+        print(line + f"{sum(bound_deltas.values()):>+10g}")
+    print('-' * len(header))
+    print(f"{'TOTAL':<{width}}" + ''.join(f"{class_totals[col]:>+8g}" for col in cols)
+          + f"{sum(class_totals.values()):>+10g}")
+
+def diff(journal_file, as_json=None):
+    """Print the run and its per-bound/per-class deltas from the journal alone"""
+    run, recorder = change_log.read_journal(journal_file)
+    print_run(run)
+    print(f"\n{len(recorder)} cells changed in {len(recorder.sheets)} sheets\n")
+    deltas = recorder.deltas(skip_sheets=SUMMARY_SHEETS)
+    print_deltas(deltas)
+    if as_json:
+        with open(as_json, 'w') as f:
+            json.dump({'run': run, 'cells': len(recorder),
+                       'deltas': {bound: {change_log.column_letter(col): delta for col, delta in cols.items()}
+                                  for bound, cols in deltas.items()}}, f, indent=2)
+        print(f"\nSaved to: {as_json}")
+    return deltas
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show, re-apply or revert a run's change journal")
+    commands = parser.add_subparsers(dest="command", required=True)
+    diff_parser = commands.add_parser("diff", help="print the run and its per-bound/per-class deltas")
+    diff_parser.add_argument("journal")
+    diff_parser.add_argument("--json", help="also write the deltas to this JSON file")
+    for command, help_text in (("apply", "write the journal's new values into the run's input"),
+                               ("revert", "write the journal's old values back into the run's output")):
+        command_parser = commands.add_parser(command, help=help_text)
+        command_parser.add_argument("journal")
+        command_parser.add_argument("input_file")
+        command_parser.add_argument("output_file")
+        command_parser.add_argument("--force", action="store_true",
+                                    help="use input_file even if it isn't the workbook the journal was made with")
+        command_parser.add_argument("--no-layout-cache", dest="use_layout", action="store_false",
+                                    help="rediscover the formula cells instead of using the cached template layout")
+        command_parser.add_argument("--no-recalc", dest="recalculate", action="store_false",
+                                    help="leave the cached formula results to Excel")
+    args = parser.parse_args()
+
+    if args.command == "diff":
+        diff(args.journal, args.json)
+    else:
+        try:
+            apply_journal(args.journal, args.input_file, args.output_file, args.command == "revert", args.force,
+                          args.use_layout, args.recalculate)
+        except ValueError as e:
+            parser.exit(1, f"{e}\n")
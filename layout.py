@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import zipfile
+
+import xlsx_patch
+
+# Survey workbooks come from a handful of templates, so where the bounds,
+# formulas and DAY summary rows sit only needs to be worked out once per
+# template. The layout is cached on disk under a fingerprint of the sheet
+# structure with the typed counts stripped out: files filled in from the same
+# template share an entry, and any change to labels, formulas or rows gives a
+# new fingerprint, which is how stale entries get invalidated.
+
+LAYOUT_VERSION = 3
+
+# Vehicle class columns B-M
+CLASS_COLUMNS = list(range(2, 14))
+
+# Cell values are stripped before hashing; column A cells are hashed
+# separately with their values, since those are the labels.
+_VALUE_RE = re.compile(rb'<v>[^<]*</v>')
+_LABEL_CELL_RE = re.compile(rb'<c r="A\d+"[^>]*?(?:/>|>.*?</c>)', re.S)
+
+
+def default_cache_dir():
+    # The system temp dir is also writable on Vercel
+    return os.environ.get('LAYOUT_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'traffic-count-layouts')
+
+
+def fingerprint(zf):
+    """Hash of the sheet list, shared strings and every worksheet's sheetData without its counts"""
+    digest = hashlib.sha256(str(LAYOUT_VERSION).encode())
+    parts = xlsx_patch.sheet_parts(zf)
+    for name, part in parts.items():
+        digest.update(name.encode('utf-8') + b'\0')
+        data = zf.read(part)
+        # Only sheetData: selection and dimension change without the layout changing
+        start, end = data.find(b'<sheetData'), data.rfind(b'</sheetData>')
+        if start != -1:
+            data = data[start:end]
+        for label in _LABEL_CELL_RE.findall(data):
+            digest.update(label)
+        # A cell left empty by its stripped value is closed like an empty cell,
+        # so "<c r="B5" s="2"><v>4</v></c>" hashes like "<c r="B5" s="2"/>" (other
+        # "></c>" endings are rewritten the same way in every file, which is all
+        # the hash needs). t="n" is the default type, which some writers spell
+        # out and others don't.
+        data = _VALUE_RE.sub(b'', data).replace(b'></c>', b'/>').replace(b' t="n"', b'')
+        digest.update(hashlib.sha256(data).digest())
+    if xlsx_patch.SHARED_STRINGS_PART in zf.namelist():
+        digest.update(hashlib.sha256(zf.read(xlsx_patch.SHARED_STRINGS_PART)).digest())
+    return digest.hexdigest()
+
+
+def build_layout(zf, key):
+    """Discover the layout by reading every sheet"""
+    parts = xlsx_patch.sheet_parts(zf)
+    strings = xlsx_patch.shared_strings(zf)
+    labels = {}
+    formulas = {}
+    formula_text = {}
+    for name, part in parts.items():
+        sheet_labels = labels[name] = {}
+        sheet_formulas = formulas[name] = []
+        sheet_text = formula_text[name] = []
+        for row, cells in xlsx_patch.iter_rows(zf, part, strings):
+            for col, cell in cells.items():
+                if col == 1:
+                    if cell.value:
+                        sheet_labels[row] = str(cell.value)
+                    continue
+                if cell.formula is not None:
+                    # Every formula, for the recalculation graph (see recalc.py)
+                    sheet_text.append([row, col, cell.formula])
+                    if col <= CLASS_COLUMNS[-1]:
+                        sheet_formulas.append([row, col])
+    return {
+        'version': LAYOUT_VERSION,
+        'fingerprint': key,
+        'sheets': list(parts),
+        'class_columns': CLASS_COLUMNS,
+        'labels': labels,
+        'formulas': formulas,
+        'formula_text': formula_text,
+    }
+
+
+def _from_json(layout):
+    # JSON object keys are strings; rows are used as ints everywhere else
+    layout['labels'] = {name: {int(row): text for row, text in rows.items()}
+                        for name, rows in layout['labels'].items()}
+    return layout
+
+
+def load_cached(path, key):
+    try:
+        with open(path) as f:
+            layout = _from_json(json.load(f))
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None
+    if layout.get('version') != LAYOUT_VERSION or layout.get('fingerprint') != key:
+        return None
+    return layout
+
+
+def save_cached(path, layout):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name first so a concurrent reader never sees half a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(layout, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not cache layout: {e}")
+
+
+def get_layout(input_file, cache_dir=None):
+    """
+    The layout of a workbook: its sheets, column A labels by row, the B-M
+    formula cells of every sheet and the text of all formulas. Read from the cache when the template has
+    been seen before, otherwise discovered and cached.
+    """
+    with zipfile.ZipFile(input_file) as zf:
+        key = fingerprint(zf)
+        path = os.path.join(cache_dir or default_cache_dir(), key + '.json')
+        layout = load_cached(path, key)
+        if layout is None:
+            layout = build_layout(zf, key)
+            save_cached(path, layout)
+    return layout
+
+
+def bound_rows(layout, sheet_name):
+    """Rows with text in column A, the only ones that can hold bound counts"""
+    return {row for row, text in layout['labels'].get(sheet_name, {}).items() if text.strip()}
+
+
+def find_direction_rows(layout, directions, reference_sheet='7-8AM', max_row=99):
+    """Rows of the reference sheet whose column A names a direction and whose B cell is not a formula"""
+    formula_rows = {row for row, col in layout['formulas'].get(reference_sheet, []) if col == 2}
+    direction_rows = {}
+    for row, label in sorted(layout['labels'].get(reference_sheet, {}).items()):
+        if row > max_row:
+            continue
+        for direction in directions:
+            if direction.lower() in label.lower() and row not in formula_rows:
+                direction_rows.setdefault(direction, []).append(row)
+    return direction_rows
+
+
+def find_summary_rows(layout, directions, sheet_name='DAY', max_row=199):
+    """Row of each direction's summary line in the DAY sheet (the last one wins, as in the scan)"""
+    summary_rows = {}
+    for row, label in sorted(layout['labels'].get(sheet_name, {}).items()):
+        if row > max_row:
+            continue
+        for direction in directions:
+            if direction.lower() in label.lower():
+                summary_rows[direction] = row
+                break
+    return summary_rows
@@ -0,0 +1,115 @@
+// Admission control for /api/modify-excel and POST /api/jobs. At most
+// `concurrency` requests read (and, for /api/modify-excel, process) their
+// workbook at a time. Up to `maxQueue` more wait for a
+// slot, each for at most `queueTimeoutMs`, before reading their body. Past
+// that they are turned away at once: 429 when the queue is full, 503 when the
+// wait ran out. Either way the answer carries a Retry-After estimated from
+// how long requests have been holding their slots. Waiting requests hold no
+// upload, so with the size limit in upload.ts the uploads in memory stay
+// under about `concurrency` x UPLOAD_MAX_MB however many arrive at once.
+
+export interface AdmissionOptions {
+  concurrency: number;
+  maxQueue: number;
+  queueTimeoutMs: number;
+}
+
+export class AdmissionError extends Error {
+  constructor(message: string, readonly status: 429 | 503, readonly retryAfter: number) {
+    super(message);
+    this.name = 'AdmissionError';
+  }
+}
+
+interface Waiter {
+  grant: () => void;
+}
+
+// Weight of the latest request in the running average of slot hold times
+const SMOOTHING = 0.2;
+
+export class AdmissionLimiter {
+  private active = 0;
+  private waiting: Waiter[] = [];
+  private averageMs = 1000;
+
+  constructor(private options: AdmissionOptions) {}
+
+  // Resolves with the function that gives the slot back; a request whose
+  // client goes away (signal) leaves the queue
+  acquire(signal?: AbortSignal): Promise<() => void> {
+    if (signal?.aborted) {
+      return Promise.reject(new Error('Client went away while queued'));
+    }
+    if (this.active < this.options.concurrency && this.waiting.length === 0) {
+      return Promise.resolve(this.take());
+    }
+    if (this.waiting.length >= this.options.maxQueue) {
+      return Promise.reject(
+        new AdmissionError('Too many uploads are in progress, try again shortly', 429, this.retryAfter())
+      );
+    }
+
+    return new Promise((resolve, reject) => {
+      const leave = (error: Error) => {
+        clearTimeout(timer);
+        signal?.removeEventListener('abort', aborted);
+        this.waiting = this.waiting.filter((waiter) => waiter !== entry);
+        reject(error);
+      };
+      const aborted = () => leave(new Error('Client went away while queued'));
+      const timer = setTimeout(
+        () => leave(new AdmissionError('The server is busy, try again shortly', 503, this.retryAfter())),
+        this.options.queueTimeoutMs
+      );
+      const entry: Waiter = {
+        grant: () => {
+          clearTimeout(timer);
+          signal?.removeEventListener('abort', aborted);
+          resolve(this.take());
+        },
+      };
+      signal?.addEventListener('abort', aborted, { once: true });
+      this.waiting.push(entry);
+    });
+  }
+
+  stats() {
+    return { active: this.active, waiting: this.waiting.length, averageMs: Math.round(this.averageMs) };
+  }
+
+  // Seconds until a request that joins the queue now can expect a slot
+  private retryAfter(): number {
+    const ahead = this.waiting.length + 1;
+    const seconds = (ahead * this.averageMs) / this.options.concurrency / 1000;
+    return Math.min(60, Math.max(1, Math.ceil(seconds)));
+  }
+
+  private take(): () => void {
+    this.active++;
+    const start = performance.now();
+    let released = false;
+    return () => {
+      if (released) return;
+      released = true;
+      this.active--;
+      this.averageMs += SMOOTHING * (performance.now() - start - this.averageMs);
+      this.waiting.shift()?.grant();
+    };
+  }
+}
+
+const globalForAdmission = globalThis as unknown as { uploadLimiter?: AdmissionLimiter };
+
+// One limiter per server process; kept on globalThis so dev hot reloads reuse it
+export function getUploadLimiter(): AdmissionLimiter {
+  if (!globalForAdmission.uploadLimiter) {
+    globalForAdmission.uploadLimiter = new AdmissionLimiter({
+      // Matches the worker pool, so excess uploads wait here before their body is read
+      concurrency: Number(process.env.UPLOAD_CONCURRENCY) || Number(process.env.PYTHON_POOL_SIZE) || 2,
+      maxQueue: Number(process.env.UPLOAD_QUEUE_LIMIT) || 16,
+      queueTimeoutMs: Number(process.env.UPLOAD_QUEUE_TIMEOUT_MS) || 30_000,
+    });
+  }
+  return globalForAdmission.uploadLimiter;
+}
@@ -0,0 +1,230 @@
+import { randomUUID } from 'crypto';
+
+// Background jobs for long workbook runs. Submitting returns at once with a
+// job id; at most `concurrency` jobs run at a time and the rest wait in a
+// bounded FIFO queue, so concurrent uploads are scheduled instead of all
+// competing for CPU. The queue is also bounded by the bytes of the uploads
+// waiting in it (`maxPendingBytes`). Jobs and their results live in this server process
+// and are dropped `ttlMs` after they finish, or earlier, oldest first, once more
+// than `maxFinished` of them or `maxFinishedBytes` of results are kept. The API
+// is therefore only served by builds that run as one long-lived server
+// (jobsEnabled below).
+
+export type JobStatus = 'queued' | 'running' | 'done' | 'failed';
+
+export interface JobEvent {
+  type: 'status' | 'progress';
+  status?: JobStatus;
+  message?: string;
+  error?: string;
+}
+
+export type JobListener = (event: JobEvent) => void;
+export type JobTask<T> = (report: (message: string) => void) => Promise<T>;
+
+export interface Job<T> {
+  id: string;
+  status: JobStatus;
+  createdAt: number;
+  startedAt?: number;
+  finishedAt?: number;
+  progress: string[];
+  error?: string;
+  result?: T;
+}
+
+export interface JobSummary {
+  id: string;
+  status: JobStatus;
+  position?: number;
+  progress: string[];
+  error?: string;
+  createdAt: number;
+  startedAt?: number;
+  finishedAt?: number;
+}
+
+export interface JobQueueOptions<T> {
+  concurrency: number;
+  maxPending: number;
+  maxPendingBytes: number;
+  maxFinished: number;
+  maxFinishedBytes: number;
+  // Size of a finished job's result, for maxFinishedBytes
+  resultBytes?: (result: T) => number;
+  ttlMs: number;
+}
+
+export class QueueFullError extends Error {
+  constructor() {
+    super('Too many workbooks are waiting, try again shortly');
+    this.name = 'QueueFullError';
+  }
+}
+
+interface Entry<T> {
+  job: Job<T>;
+  task: JobTask<T> | null;
+  // The upload's size while queued, the result's once finished
+  bytes: number;
+  listeners: Set<JobListener>;
+}
+
+export class JobQueue<T> {
+  private entries = new Map<string, Entry<T>>();
+  private pending: string[] = [];
+  private pendingBytes = 0;
+  private running = 0;
+  // Finished jobs, oldest first, and the size of their results
+  private finished: string[] = [];
+  private finishedBytes = 0;
+
+  constructor(private options: JobQueueOptions<T>) {}
+
+  // bytes is the size of the upload the task holds on to until it runs; one
+  // job is let in whatever its size when nothing is waiting
+  submit(task: JobTask<T>, bytes = 0): Job<T> {
+    if (
+      this.pending.length >= this.options.maxPending ||
+      (this.pending.length > 0 && this.pendingBytes + bytes > this.options.maxPendingBytes)
+    ) {
+      throw new QueueFullError();
+    }
+    const job: Job<T> = { id: randomUUID(), status: 'queued', createdAt: Date.now(), progress: [] };
+    this.entries.set(job.id, { job, task, bytes, listeners: new Set() });
+    this.pending.push(job.id);
+    this.pendingBytes += bytes;
+    this.pump();
+    return job;
+  }
+
+  get(id: string): Job<T> | undefined {
+    return this.entries.get(id)?.job;
+  }
+
+  summary(id: string): JobSummary | undefined {
+    const job = this.get(id);
+    if (!job) return undefined;
+    const position = this.pending.indexOf(id);
+    return {
+      id: job.id,
+      status: job.status,
+      position: position >= 0 ? position : undefined,
+      progress: [...job.progress],
+      error: job.error,
+      createdAt: job.createdAt,
+      startedAt: job.startedAt,
+      finishedAt: job.finishedAt,
+    };
+  }
+
+  // Returns the unsubscribe function
+  subscribe(id: string, listener: JobListener): () => void {
+    const entry = this.entries.get(id);
+    if (!entry) return () => {};
+    entry.listeners.add(listener);
+    return () => entry.listeners.delete(listener);
+  }
+
+  private emit(entry: Entry<T>, event: JobEvent) {
+    for (const listener of Array.from(entry.listeners)) {
+      try {
+        listener(event);
+      } catch (error) {
+        console.error('Job listener failed', error);
+      }
+    }
+  }
+
+  private pump() {
+    while (this.running < this.options.concurrency && this.pending.length > 0) {
+      const entry = this.entries.get(this.pending.shift()!);
+      if (entry) {
+        this.pendingBytes -= entry.bytes;
+        void this.start(entry);
+      }
+    }
+  }
+
+  private async start(entry: Entry<T>) {
+    const { job } = entry;
+    const task = entry.task!;
+    entry.task = null;
+    this.running++;
+    job.status = 'running';
+    job.startedAt = Date.now();
+    this.emit(entry, { type: 'status', status: 'running' });
+
+    try {
+      job.result = await task((message) => {
+        job.progress.push(message);
+        this.emit(entry, { type: 'progress', message });
+      });
+      job.status = 'done';
+    } catch (error) {
+      job.status = 'failed';
+      job.error = error instanceof Error ? error.message : String(error);
+    } finally {
+      this.running--;
+      job.finishedAt = Date.now();
+      this.emit(entry, { type: 'status', status: job.status, error: job.error });
+      entry.listeners.clear();
+      this.retain(entry);
+      this.pump();
+    }
+  }
+
+  // Keeps the finished job's result until ttlMs passes or newer results push
+  // it out; the newest one is always kept, whatever its size
+  private retain(entry: Entry<T>) {
+    const { job } = entry;
+    entry.bytes = job.result !== undefined && this.options.resultBytes ? this.options.resultBytes(job.result) : 0;
+    this.finished.push(job.id);
+    this.finishedBytes += entry.bytes;
+    while (
+      this.finished.length > 1 &&
+      (this.finished.length > this.options.maxFinished || this.finishedBytes > this.options.maxFinishedBytes)
+    ) {
+      this.forget(this.finished[0]);
+    }
+    setTimeout(() => this.forget(job.id), this.options.ttlMs);
+  }
+
+  private forget(id: string) {
+    const index = this.finished.indexOf(id);
+    if (index < 0) return;
+    this.finished.splice(index, 1);
+    this.finishedBytes -= this.entries.get(id)!.bytes;
+    this.entries.delete(id);
+  }
+}
+
+// Whether this build serves the job API; see next.config.ts
+export function jobsEnabled(): boolean {
+  return process.env.NEXT_PUBLIC_JOB_API !== '0';
+}
+
+const globalForJobs = globalThis as unknown as { jobQueue?: JobQueue<unknown> };
+
+// The workbook routes' results hold the output workbook as `file`
+function resultBytes(result: unknown): number {
+  const file = (result as { file?: unknown }).file;
+  return Buffer.isBuffer(file) ? file.length : 0;
+}
+
+// One queue per server process; kept on globalThis so dev hot reloads reuse it
+export function getJobQueue<T>(): JobQueue<T> {
+  if (!globalForJobs.jobQueue) {
+    globalForJobs.jobQueue = new JobQueue<unknown>({
+      // Matches the worker pool, so queued jobs wait here rather than in the pool
+      concurrency: Number(process.env.JOB_CONCURRENCY) || Number(process.env.PYTHON_POOL_SIZE) || 2,
+      maxPending: Number(process.env.JOB_QUEUE_LIMIT) || 32,
+      maxPendingBytes: (Number(process.env.JOB_QUEUE_MAX_MB) || 256) * 1024 * 1024,
+      maxFinished: Number(process.env.JOB_RESULT_LIMIT) || 64,
+      maxFinishedBytes: (Number(process.env.JOB_RESULT_MAX_MB) || 256) * 1024 * 1024,
+      resultBytes,
+      ttlMs: Number(process.env.JOB_RESULT_TTL_MS) || 10 * 60_000,
+    });
+  }
+  return globalForJobs.jobQueue as JobQueue<T>;
+}
@@ -0,0 +1,178 @@
+// Request metrics aggregated in this server process and served by
+// /api/metrics: a latency histogram per route, histograms for each phase on
+// the Node side (upload, cache, Python call, ...) and inside Python
+// (load_workbook, modify, save, ...), and running totals of the Python
+// counters (cells scanned/modified, bytes in/out). They start from zero
+// whenever the server restarts.
+
+// Histogram bucket upper bounds in milliseconds; the last bucket is unbounded
+const BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10_000, 30_000, 60_000, 120_000];
+
+// What instrument.py reports for one run
+export interface PythonMetrics {
+  phases_ms: Record<string, number>;
+  counters: Record<string, number>;
+  total_ms: number;
+  peak_rss_bytes: number | null;
+  // Report files of a profiled run
+  profile?: { pstats: string; allocations: string };
+}
+
+export class Histogram {
+  private counts = new Array<number>(BUCKETS_MS.length + 1).fill(0);
+  private count = 0;
+  private sum = 0;
+  private max = 0;
+
+  observe(ms: number) {
+    const bucket = BUCKETS_MS.findIndex((bound) => ms <= bound);
+    this.counts[bucket === -1 ? BUCKETS_MS.length : bucket]++;
+    this.count++;
+    this.sum += ms;
+    this.max = Math.max(this.max, ms);
+  }
+
+  // Upper bound of the bucket holding the q-th quantile
+  quantile(q: number) {
+    if (this.count === 0) return null;
+    const rank = Math.ceil(q * this.count);
+    let seen = 0;
+    for (let i = 0; i < BUCKETS_MS.length; i++) {
+      seen += this.counts[i];
+      if (seen >= rank) return BUCKETS_MS[i];
+    }
+    return this.max;
+  }
+
+  toJSON() {
+    return {
+      count: this.count,
+      sum_ms: round(this.sum),
+      max_ms: round(this.max),
+      p50_ms: this.quantile(0.5),
+      p95_ms: this.quantile(0.95),
+      p99_ms: this.quantile(0.99),
+      buckets: [...BUCKETS_MS, 'inf'].map((le, i) => ({ le, count: this.counts[i] })),
+    };
+  }
+}
+
+// Wall time per phase of one request
+export class RequestTimer {
+  readonly started = performance.now();
+  readonly phases: Record<string, number> = {};
+
+  async time<T>(phase: string, run: () => Promise<T>): Promise<T> {
+    const start = performance.now();
+    try {
+      return await run();
+    } finally {
+      this.add(phase, performance.now() - start);
+    }
+  }
+
+  add(phase: string, ms: number) {
+    this.phases[phase] = (this.phases[phase] ?? 0) + ms;
+  }
+
+  elapsed() {
+    return performance.now() - this.started;
+  }
+
+  toJSON() {
+    return Object.fromEntries(Object.entries(this.phases).map(([phase, ms]) => [phase, round(ms)]));
+  }
+}
+
+export interface RequestRecord {
+  status: number;
+  timer: RequestTimer;
+  python?: PythonMetrics;
+  cache?: 'HIT' | 'MISS';
+}
+
+class RouteMetrics {
+  latency = new Histogram();
+  phases = new Map<string, Histogram>();
+  pythonPhases = new Map<string, Histogram>();
+  statuses: Record<string, number> = {};
+  cache = { HIT: 0, MISS: 0 };
+  counters: Record<string, number> = {};
+  peakRssBytes = 0;
+
+  record({ status, timer, python, cache }: RequestRecord) {
+    this.latency.observe(timer.elapsed());
+    this.statuses[status] = (this.statuses[status] ?? 0) + 1;
+    if (cache) this.cache[cache]++;
+    observeAll(this.phases, timer.phases);
+    if (python) {
+      observeAll(this.pythonPhases, python.phases_ms);
+      for (const [name, value] of Object.entries(python.counters)) {
+        this.counters[name] = (this.counters[name] ?? 0) + value;
+      }
+      this.peakRssBytes = Math.max(this.peakRssBytes, python.peak_rss_bytes ?? 0);
+    }
+  }
+
+  toJSON() {
+    return {
+      requests: this.statuses,
+      cache: this.cache,
+      latency: this.latency,
+      phases: Object.fromEntries(this.phases),
+      python: {
+        phases: Object.fromEntries(this.pythonPhases),
+        counters: this.counters,
+        peak_rss_bytes: this.peakRssBytes || null,
+      },
+    };
+  }
+}
+
+function observeAll(histograms: Map<string, Histogram>, phases: Record<string, number>) {
+  for (const [phase, ms] of Object.entries(phases)) {
+    let histogram = histograms.get(phase);
+    if (!histogram) {
+      histogram = new Histogram();
+      histograms.set(phase, histogram);
+    }
+    histogram.observe(ms);
+  }
+}
+
+function round(ms: number) {
+  return Math.round(ms * 1000) / 1000;
+}
+
+export class MetricsRegistry {
+  private readonly startedAt = new Date();
+  private routes = new Map<string, RouteMetrics>();
+
+  record(route: string, record: RequestRecord) {
+    let metrics = this.routes.get(route);
+    if (!metrics) {
+      metrics = new RouteMetrics();
+      this.routes.set(route, metrics);
+    }
+    metrics.record(record);
+  }
+
+  snapshot() {
+    return {
+      since: this.startedAt.toISOString(),
+      buckets_ms: BUCKETS_MS,
+      // JSON.stringify turns the histograms into plain objects via toJSON
+      routes: JSON.parse(JSON.stringify(Object.fromEntries(this.routes))),
+    };
+  }
+}
+
+const globalForMetrics = globalThis as unknown as { metrics?: MetricsRegistry };
+
+// One registry per server process; kept on globalThis so dev hot reloads reuse it
+export function getMetrics(): MetricsRegistry {
+  if (!globalForMetrics.metrics) {
+    globalForMetrics.metrics = new MetricsRegistry();
+  }
+  return globalForMetrics.metrics;
+}
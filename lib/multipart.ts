@@ -0,0 +1,45 @@
+// Minimal multipart reader, for multipart/mixed responses from the Python
+// function and multipart/form-data uploads (see upload.ts). Parts are
+// returned as views into the body buffer, not copies.
+
+export interface Part {
+  headers: Record<string, string>;
+  body: Buffer;
+}
+
+export function parseMultipart(body: Buffer, contentType: string): Part[] {
+  const match = /boundary="?([^";]+)"?/i.exec(contentType);
+  if (!match) {
+    throw new Error('Multipart body without a boundary');
+  }
+
+  const delimiter = Buffer.from(`--${match[1]}`);
+  const parts: Part[] = [];
+  let start = body.indexOf(delimiter);
+
+  while (start !== -1) {
+    const after = start + delimiter.length;
+    // "--boundary--" closes the body
+    if (body[after] === 0x2d && body[after + 1] === 0x2d) break;
+
+    const headerEnd = body.indexOf('\r\n\r\n', after);
+    const next = body.indexOf(delimiter, headerEnd);
+    if (headerEnd === -1 || next === -1) {
+      throw new Error('Truncated multipart body');
+    }
+
+    const headers: Record<string, string> = {};
+    for (const line of body.subarray(after + 2, headerEnd).toString('utf-8').split('\r\n')) {
+      const colon = line.indexOf(':');
+      if (colon > 0) {
+        headers[line.slice(0, colon).trim().toLowerCase()] = line.slice(colon + 1).trim();
+      }
+    }
+
+    // Each part ends with the CRLF that precedes the next delimiter
+    parts.push({ headers, body: body.subarray(headerEnd + 4, next - 2) });
+    start = next;
+  }
+
+  return parts;
+}
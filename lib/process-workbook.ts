@@ -0,0 +1,164 @@
+import { NextResponse } from 'next/server';
+import { parseMultipart } from '@/lib/multipart';
+import type { Upload } from '@/lib/upload';
+import { PythonMetrics, RequestTimer } from '@/lib/metrics';
+import { getPythonPool, JobResult, ProgressListener } from '@/lib/python-pool';
+import { deriveSeed, getResultCache, hashWorkbook, resultKey } from '@/lib/result-cache';
+import { getWorkbookSessions, SessionExpiredError } from '@/lib/workbook-sessions';
+
+// One workbook run, shared by the synchronous /api/modify-excel route and
+// the job API: result cache lookup, then the Python function (production)
+// or the local worker pool (development).
+
+export interface WorkbookRequest {
+  buffer: Buffer;
+  // Known when the workbook came from the session cache
+  fileHash?: string;
+  percentage: string;
+  operation: string;
+  mode: string;
+  seed: string | null;
+  // Run under cProfile and tracemalloc (see instrument.py)
+  profile: boolean;
+}
+
+export interface ProcessedWorkbook {
+  file: Buffer;
+  log: string;
+  cache: 'HIT' | 'MISS';
+  // Decimal digits: a seed can be larger than a number holds exactly
+  seed: string;
+  // Sent back as X-File-Hash, for re-runs without uploading the file again
+  fileHash: string;
+  // Timings and counters from the Python side; not there for cache hits
+  metrics?: PythonMetrics;
+}
+
+// Either the uploaded file, or the fileHash of a workbook uploaded earlier
+// (throws SessionExpiredError once that has left the session cache)
+export async function readWorkbookRequest(upload: Upload): Promise<WorkbookRequest | null> {
+  const { file } = upload;
+  const fileHash = upload.field('fileHash');
+  let buffer: Buffer;
+  if (file) {
+    buffer = file;
+  } else if (fileHash) {
+    const stored = getWorkbookSessions().get(fileHash);
+    if (!stored) throw new SessionExpiredError();
+    buffer = stored;
+  } else {
+    return null;
+  }
+  return {
+    buffer,
+    fileHash: file ? undefined : fileHash!,
+    percentage: upload.field('percentage') || '13',
+    operation: upload.field('operation') || 'increase',
+    mode: upload.field('mode') === 'patch' ? 'patch' : 'openpyxl',
+    seed: upload.field('seed'),
+    profile: ['1', 'true'].includes(upload.field('profile') as string),
+  };
+}
+
+async function runPython(
+  request: WorkbookRequest,
+  fileHash: string,
+  seed: string,
+  onProgress?: ProgressListener
+): Promise<JobResult> {
+  const { buffer, percentage, operation, mode, profile } = request;
+
+  if (process.env.VERCEL_URL) {
+    // Production: Use Vercel Python function. The workbook goes over as raw
+    // bytes and comes back as a multipart body, so nothing is base64-encoded.
+    // The function reports no progress; its log arrives with the result.
+    const pythonResponse = await fetch(`${process.env.VERCEL_URL}/api/python/process-excel`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/octet-stream',
+        'X-Percentage': percentage,
+        'X-Operation': operation,
+        'X-Mode': mode,
+        'X-Seed': seed,
+        ...(profile ? { 'X-Profile': '1' } : {}),
+      },
+      body: new Uint8Array(buffer.buffer, buffer.byteOffset, buffer.byteLength)
+    });
+
+    if (!pythonResponse.ok) {
+      const error = await pythonResponse.json();
+      throw new Error(error.error || 'Python processing failed');
+    }
+
+    const body = Buffer.from(await pythonResponse.arrayBuffer());
+    const parts = parseMultipart(body, pythonResponse.headers.get('Content-Type') || '');
+    const partOfType = (type: string) => parts.find((part) => part.headers['content-type']?.startsWith(type));
+    const logPart = partOfType('text/plain');
+    const metricsPart = partOfType('application/json');
+    const filePart = partOfType('application/vnd.');
+    if (!filePart) {
+      throw new Error('Python response did not include a workbook');
+    }
+    return {
+      file: filePart.body,
+      log: logPart ? logPart.body.toString('utf-8') : '',
+      metrics: metricsPart ? JSON.parse(metricsPart.body.toString('utf-8')) : undefined,
+    };
+  }
+
+  // Development: Use the local Python worker pool, which keeps the parsed
+  // workbook under its hash for the next run
+  return getPythonPool().run({ percentage, operation, mode, seed, profile, session: fileHash }, buffer, onProgress);
+}
+
+export async function processWorkbook(
+  request: WorkbookRequest,
+  onProgress?: ProgressListener,
+  timer = new RequestTimer()
+): Promise<ProcessedWorkbook> {
+  // Without an explicit seed one is derived from the workbook and the
+  // parameters, so re-submitting the same upload gives the same result
+  const fileHash = request.fileHash ?? hashWorkbook(request.buffer);
+  getWorkbookSessions().put(fileHash, request.buffer);
+  const params = { percentage: String(Number(request.percentage)), operation: request.operation, mode: request.mode };
+  // The seed stays a string of digits all the way to Python, which takes any
+  // size of integer; Number() would round anything above 2^53
+  const seed = request.seed && /^\d+$/.test(request.seed)
+    ? request.seed.replace(/^0+(?=\d)/, '')
+    : String(deriveSeed(fileHash, params));
+  const key = resultKey(fileHash, { ...params, seed });
+  const cache = getResultCache();
+
+  // A profiled run has to actually run, so it skips the cache lookup
+  const cached = request.profile ? null : await timer.time('cache_lookup', () => cache.get(key));
+  if (cached) {
+    return { ...cached, cache: 'HIT', seed, fileHash };
+  }
+
+  const result = await timer.time('python', () => runPython(request, fileHash, seed, onProgress));
+
+  // A failed cache write only costs a future hit
+  await timer.time('cache_store', () => cache.put(key, result)).catch((error) => {
+    console.error('Could not cache result', error);
+  });
+
+  return { ...result, cache: 'MISS', seed, fileHash };
+}
+
+// With a timer, X-Process-Metrics carries the Node phase timings so far and
+// the Python metrics as JSON
+export function workbookResponse(result: ProcessedWorkbook, timer?: RequestTimer) {
+  const { file } = result;
+  const metrics = timer ? { 'X-Process-Metrics': JSON.stringify({ phases_ms: timer, python: result.metrics }) } : {};
+  return new NextResponse(new Uint8Array(file.buffer, file.byteOffset, file.byteLength), {
+    headers: {
+      'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+      'Content-Disposition': 'attachment; filename="Modified_Traffic_Counts.xlsx"',
+      'X-Process-Log': Buffer.from(result.log).toString('base64'),
+      'X-Cache': result.cache,
+      'X-Seed': result.seed,
+      'X-File-Hash': result.fileHash,
+      ...metrics,
+    },
+  });
+}
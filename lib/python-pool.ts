@@ -0,0 +1,282 @@
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import path from 'path';
+import type { PythonMetrics } from '@/lib/metrics';
+
+// Long-lived `python excel_worker.py` processes that take jobs over
+// stdin/stdout, so an upload doesn't pay interpreter startup and the
+// openpyxl import. See excel_worker.py for the frame format.
+
+export interface PoolOptions {
+  size: number;
+  timeoutMs: number;
+  maxQueue: number;
+  pythonBin: string;
+  script: string;
+}
+
+export interface JobParams {
+  percentage: string;
+  operation: string;
+  mode: string;
+  // Decimal digits, turned into an int by the worker
+  seed?: string;
+  profile?: boolean;
+  // Hash of the workbook; the worker keeps it parsed for later jobs
+  session?: string;
+}
+
+export interface JobResult {
+  file: Buffer;
+  log: string;
+  metrics?: PythonMetrics;
+}
+
+export type ProgressListener = (message: string) => void;
+
+interface Job {
+  id: number;
+  params: JobParams;
+  payload: Buffer;
+  onProgress?: ProgressListener;
+  resolve: (result: JobResult) => void;
+  reject: (error: Error) => void;
+}
+
+export class PoolBusyError extends Error {
+  constructor() {
+    super('Too many workbooks are queued, try again shortly');
+    this.name = 'PoolBusyError';
+  }
+}
+
+interface ResponseHeader {
+  ok: boolean;
+  size: number;
+  log?: string;
+  metrics?: PythonMetrics;
+  error?: string;
+  // Progress frames carry a printed line and no payload
+  event?: 'progress';
+  message?: string;
+}
+
+// Workers that die this soon after starting are restarted with a delay, so a
+// broken Python install doesn't turn into a respawn loop
+const MIN_LIFETIME_MS = 1000;
+
+// Workbook hashes remembered with the worker that last ran them
+const MAX_AFFINITY = 1000;
+
+class Worker {
+  private proc: ChildProcessWithoutNullStreams;
+  private chunks: Buffer[] = [];
+  private buffered = 0;
+  private header: ResponseHeader | null = null;
+  private timer: NodeJS.Timeout | null = null;
+  private exited = false;
+  readonly startedAt = Date.now();
+  job: Job | null = null;
+
+  constructor(
+    private options: PoolOptions,
+    private onIdle: (worker: Worker) => void,
+    private onExit: (worker: Worker) => void
+  ) {
+    this.proc = spawn(options.pythonBin, [options.script], {
+      cwd: path.dirname(options.script),
+    });
+    this.proc.stdout.on('data', (chunk: Buffer) => this.receive(chunk));
+    this.proc.stderr.on('data', (chunk: Buffer) => process.stderr.write(chunk));
+    this.proc.stdin.on('error', (error) => this.fail(error));
+    this.proc.on('exit', (code, signal) =>
+      this.exit(new Error(`Python worker exited (${signal ?? code})`))
+    );
+    this.proc.on('error', (error) => this.exit(error));
+  }
+
+  start(job: Job) {
+    this.job = job;
+    const header = Buffer.from(
+      JSON.stringify({ id: job.id, ...job.params, size: job.payload.length })
+    );
+    const length = Buffer.alloc(4);
+    length.writeUInt32BE(header.length);
+    this.proc.stdin.write(length);
+    this.proc.stdin.write(header);
+    this.proc.stdin.write(job.payload);
+
+    this.timer = setTimeout(() => {
+      this.fail(new Error(`Processing timed out after ${this.options.timeoutMs}ms`));
+      // The exit handler replaces this worker
+      this.proc.kill('SIGKILL');
+    }, this.options.timeoutMs);
+  }
+
+  kill() {
+    this.proc.kill();
+  }
+
+  private receive(chunk: Buffer) {
+    this.chunks.push(chunk);
+    this.buffered += chunk.length;
+    while (this.readFrame()) {
+      // One chunk can hold several progress frames and the result
+    }
+  }
+
+  private readFrame() {
+    if (!this.header) {
+      if (this.buffered < 4) return false;
+      const data = this.flatten();
+      const headerLength = data.readUInt32BE(0);
+      if (data.length < 4 + headerLength) return false;
+      this.header = JSON.parse(data.subarray(4, 4 + headerLength).toString('utf-8'));
+      this.chunks = [data.subarray(4 + headerLength)];
+      this.buffered = data.length - 4 - headerLength;
+    }
+
+    const header = this.header!;
+    if (this.buffered < header.size) return false;
+    // The payload is copied into one buffer only once it has fully arrived
+    const data = this.flatten();
+    const file = data.subarray(0, header.size);
+    const rest = data.subarray(header.size);
+    this.chunks = rest.length > 0 ? [rest] : [];
+    this.buffered = rest.length;
+    this.header = null;
+
+    if (header.event === 'progress') {
+      this.job?.onProgress?.(header.message ?? '');
+      return true;
+    }
+    this.complete(header, file);
+    return true;
+  }
+
+  private complete(header: ResponseHeader, file: Buffer) {
+    const job = this.finish();
+    if (!job) return;
+    if (header.ok) {
+      job.resolve({ file, log: header.log ?? '', metrics: header.metrics });
+    } else {
+      job.reject(new Error(header.error || 'Python processing failed'));
+    }
+    this.onIdle(this);
+  }
+
+  private flatten() {
+    const data = this.chunks.length === 1 ? this.chunks[0] : Buffer.concat(this.chunks, this.buffered);
+    this.chunks = [data];
+    return data;
+  }
+
+  private finish() {
+    if (this.timer) clearTimeout(this.timer);
+    this.timer = null;
+    const job = this.job;
+    this.job = null;
+    return job;
+  }
+
+  private fail(error: Error) {
+    const job = this.finish();
+    job?.reject(error);
+  }
+
+  private exit(error: Error) {
+    if (this.exited) return;
+    this.exited = true;
+    this.fail(error);
+    this.onExit(this);
+  }
+}
+
+export class PythonPool {
+  private workers: Worker[] = [];
+  private idle: Worker[] = [];
+  private queue: Job[] = [];
+  private nextId = 1;
+  private closed = false;
+  // Worker that last ran each session, which still has the workbook parsed
+  private affinity = new Map<string, Worker>();
+
+  constructor(private options: PoolOptions) {
+    for (let i = 0; i < options.size; i++) this.spawnWorker();
+  }
+
+  run(params: JobParams, payload: Buffer, onProgress?: ProgressListener): Promise<JobResult> {
+    if (this.idle.length === 0 && this.queue.length >= this.options.maxQueue) {
+      return Promise.reject(new PoolBusyError());
+    }
+    return new Promise((resolve, reject) => {
+      this.queue.push({ id: this.nextId++, params, payload, onProgress, resolve, reject });
+      this.dispatch();
+    });
+  }
+
+  close() {
+    this.closed = true;
+    for (const worker of this.workers) worker.kill();
+  }
+
+  private spawnWorker() {
+    const worker = new Worker(
+      this.options,
+      (w) => {
+        this.idle.push(w);
+        this.dispatch();
+      },
+      (w) => {
+        // Replace crashed or timed-out workers
+        this.workers = this.workers.filter((other) => other !== w);
+        this.idle = this.idle.filter((other) => other !== w);
+        for (const [session, owner] of Array.from(this.affinity)) {
+          if (owner === w) this.affinity.delete(session);
+        }
+        if (this.closed) return;
+        const delay = Date.now() - w.startedAt < MIN_LIFETIME_MS ? MIN_LIFETIME_MS : 0;
+        setTimeout(() => {
+          this.spawnWorker();
+          this.dispatch();
+        }, delay);
+      }
+    );
+    this.workers.push(worker);
+    this.idle.push(worker);
+  }
+
+  private dispatch() {
+    while (this.idle.length > 0 && this.queue.length > 0) {
+      const job = this.queue.shift()!;
+      const session = job.params.session;
+      // Prefer the worker that already has the workbook parsed, if it's free
+      const owner = session ? this.affinity.get(session) : undefined;
+      const index = owner ? this.idle.indexOf(owner) : -1;
+      const worker = this.idle.splice(Math.max(index, 0), 1)[0];
+      if (session) {
+        this.affinity.delete(session);
+        this.affinity.set(session, worker);
+        if (this.affinity.size > MAX_AFFINITY) {
+          this.affinity.delete(this.affinity.keys().next().value!);
+        }
+      }
+      worker.start(job);
+    }
+  }
+}
+
+const globalForPool = globalThis as unknown as { pythonPool?: PythonPool };
+
+// One pool per server process; kept on globalThis so dev hot reloads reuse it
+export function getPythonPool(): PythonPool {
+  if (!globalForPool.pythonPool) {
+    globalForPool.pythonPool = new PythonPool({
+      size: Number(process.env.PYTHON_POOL_SIZE) || 2,
+      timeoutMs: Number(process.env.PYTHON_JOB_TIMEOUT_MS) || 120_000,
+      maxQueue: Number(process.env.PYTHON_QUEUE_LIMIT) || 16,
+      pythonBin: process.env.PYTHON_BIN || 'python',
+      script: path.join(process.cwd(), 'excel_worker.py'),
+    });
+  }
+  return globalForPool.pythonPool;
+}
@@ -0,0 +1,176 @@
+import { createHash } from 'crypto';
+import { promises as fs } from 'fs';
+import os from 'os';
+import path from 'path';
+
+// Processed workbooks on disk, keyed by the SHA-256 of the upload plus the
+// parameters and seed that produced them. With a seed the output is fully
+// determined by those, so a re-submitted workbook is answered from here
+// without starting Python. Least recently used entries are evicted once the
+// cache grows past its size limit.
+
+// Bump when a change to the Python side changes the output for the same inputs
+const CACHE_VERSION = 2;
+
+export interface CachedResult {
+  file: Buffer;
+  log: string;
+}
+
+interface Entry {
+  size: number;
+}
+
+export type KeyParams = Record<string, string | number>;
+
+export function hashWorkbook(data: Buffer): string {
+  return createHash('sha256').update(data).digest('hex');
+}
+
+function digest(fileHash: string, params: KeyParams): string {
+  const fields = Object.keys(params)
+    .sort()
+    .map((name) => [name, String(params[name])]);
+  return createHash('sha256')
+    .update(JSON.stringify([CACHE_VERSION, fileHash, fields]))
+    .digest('hex');
+}
+
+export function resultKey(fileHash: string, params: KeyParams): string {
+  return digest(fileHash, params);
+}
+
+// Seed used when the client doesn't pick one: derived from the workbook and
+// parameters, so submitting the same thing twice gives the same result
+export function deriveSeed(fileHash: string, params: KeyParams): number {
+  return parseInt(digest(fileHash, { ...params, purpose: 'seed' }).slice(0, 8), 16);
+}
+
+async function writeAtomic(file: string, data: Buffer | string) {
+  const tmp = `${file}.${process.pid}.${Date.now()}.tmp`;
+  await fs.writeFile(tmp, data);
+  await fs.rename(tmp, file);
+}
+
+export class ResultCache {
+  // Map iteration order is insertion order, so the first entry is always the
+  // least recently used one
+  private entries = new Map<string, Entry>();
+  private totalSize = 0;
+  private loading: Promise<void> | null = null;
+
+  constructor(private dir: string, private maxBytes: number) {}
+
+  async get(key: string): Promise<CachedResult | null> {
+    await this.load();
+    const entry = this.entries.get(key);
+    if (!entry) return null;
+    try {
+      const [file, log] = await Promise.all([
+        fs.readFile(this.path(key, 'xlsx')),
+        fs.readFile(this.path(key, 'log'), 'utf-8'),
+      ]);
+      this.touch(key, entry);
+      return { file, log };
+    } catch {
+      // Removed behind our back
+      this.forget(key);
+      return null;
+    }
+  }
+
+  async put(key: string, result: CachedResult) {
+    await this.load();
+    const size = result.file.length + Buffer.byteLength(result.log);
+    if (size > this.maxBytes) return;
+
+    await fs.mkdir(this.dir, { recursive: true });
+    // The workbook goes last: an entry exists once its .xlsx does
+    await writeAtomic(this.path(key, 'log'), result.log);
+    await writeAtomic(this.path(key, 'xlsx'), result.file);
+
+    this.forget(key);
+    this.entries.set(key, { size });
+    this.totalSize += size;
+    await this.evict();
+  }
+
+  private path(key: string, extension: string) {
+    return path.join(this.dir, `${key}.${extension}`);
+  }
+
+  private touch(key: string, entry: Entry) {
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    // The mtime carries the LRU order over a restart
+    const now = new Date();
+    fs.utimes(this.path(key, 'xlsx'), now, now).catch(() => {});
+  }
+
+  private forget(key: string) {
+    const entry = this.entries.get(key);
+    if (!entry) return;
+    this.entries.delete(key);
+    this.totalSize -= entry.size;
+  }
+
+  private async evict() {
+    for (const key of Array.from(this.entries.keys())) {
+      if (this.totalSize <= this.maxBytes) break;
+      this.forget(key);
+      await Promise.all([
+        fs.rm(this.path(key, 'xlsx'), { force: true }),
+        fs.rm(this.path(key, 'log'), { force: true }),
+      ]);
+    }
+  }
+
+  private load() {
+    if (!this.loading) {
+      this.loading = this.scan();
+    }
+    return this.loading;
+  }
+
+  // Pick up entries written by earlier server processes, oldest first
+  private async scan() {
+    let names: string[];
+    try {
+      names = await fs.readdir(this.dir);
+    } catch {
+      return;
+    }
+    const found: { key: string; size: number; mtime: number }[] = [];
+    for (const name of names) {
+      if (!name.endsWith('.xlsx')) continue;
+      const key = name.slice(0, -'.xlsx'.length);
+      try {
+        const [file, log] = await Promise.all([
+          fs.stat(this.path(key, 'xlsx')),
+          fs.stat(this.path(key, 'log')),
+        ]);
+        found.push({ key, size: file.size + log.size, mtime: file.mtimeMs });
+      } catch {
+        // Half-written entry
+      }
+    }
+    found.sort((a, b) => a.mtime - b.mtime);
+    for (const { key, size } of found) {
+      this.entries.set(key, { size });
+      this.totalSize += size;
+    }
+    await this.evict();
+  }
+}
+
+const globalForCache = globalThis as unknown as { resultCache?: ResultCache };
+
+export function getResultCache(): ResultCache {
+  if (!globalForCache.resultCache) {
+    globalForCache.resultCache = new ResultCache(
+      process.env.RESULT_CACHE_DIR || path.join(os.tmpdir(), 'traffic-count-results'),
+      (Number(process.env.RESULT_CACHE_MAX_MB) || 256) * 1024 * 1024
+    );
+  }
+  return globalForCache.resultCache;
+}
@@ -0,0 +1,108 @@
+import { parseMultipart, Part } from '@/lib/multipart';
+
+// Upload bodies read straight off the request stream into one buffer, with
+// the size limit enforced while they arrive: a body that declares or reaches
+// more than `maxBytes` is cut off there, not after it has been buffered.
+// `request.formData()` followed by `file.arrayBuffer()` and `Buffer.from()`
+// held up to three copies of every upload; here the file is a view into the
+// one body buffer.
+//
+// Two body types are accepted:
+//   multipart/form-data       the browser form: `file` plus text fields
+//   application/octet-stream  the workbook as the raw body, with the fields as
+//                             X-<Field-Name> headers (X-Percentage, X-File-Hash,
+//                             ...), as the Python function takes them
+
+export class UploadError extends Error {
+  constructor(message: string, readonly status: 400 | 413 | 415) {
+    super(message);
+    this.name = 'UploadError';
+  }
+}
+
+export interface Upload {
+  // Empty uploads count as no file
+  file: Buffer | null;
+  field(name: string): string | null;
+}
+
+export function maxUploadBytes(): number {
+  return (Number(process.env.UPLOAD_MAX_MB) || 25) * 1024 * 1024;
+}
+
+function tooLarge(maxBytes: number) {
+  return new UploadError(`Uploads are limited to ${Math.round(maxBytes / 1024 / 1024)} MB`, 413);
+}
+
+export async function readBody(request: Request, maxBytes: number): Promise<Buffer> {
+  const declared = Number(request.headers.get('content-length'));
+  if (declared > maxBytes) throw tooLarge(maxBytes);
+  if (!request.body) return Buffer.alloc(0);
+
+  // With a Content-Length the chunks are copied into a buffer of that size as
+  // they come; without one (or if the body runs past it) they are joined at the end
+  let target = declared > 0 ? Buffer.allocUnsafe(declared) : null;
+  const chunks: Buffer[] = [];
+  let size = 0;
+  const reader = request.body.getReader();
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    if (size + value.byteLength > maxBytes) {
+      await reader.cancel().catch(() => {});
+      throw tooLarge(maxBytes);
+    }
+    if (target && size + value.byteLength <= target.length) {
+      target.set(value, size);
+    } else {
+      if (target) {
+        chunks.push(target.subarray(0, size));
+        target = null;
+      }
+      chunks.push(Buffer.from(value.buffer, value.byteOffset, value.byteLength));
+    }
+    size += value.byteLength;
+  }
+  if (target) return target.subarray(0, size);
+  return chunks.length === 1 ? chunks[0] : Buffer.concat(chunks, size);
+}
+
+function formUpload(body: Buffer, contentType: string): Upload {
+  let parts: Part[];
+  try {
+    parts = parseMultipart(body, contentType);
+  } catch (error) {
+    throw new UploadError(error instanceof Error ? error.message : 'Malformed form data', 400);
+  }
+  const files = new Map<string, Buffer>();
+  const fields = new Map<string, string>();
+  for (const part of parts) {
+    const disposition = part.headers['content-disposition'] || '';
+    const name = /\bname="([^"]*)"/i.exec(disposition)?.[1];
+    if (name === undefined) continue;
+    if (/\bfilename="/i.test(disposition)) {
+      files.set(name, part.body);
+    } else {
+      fields.set(name, part.body.toString('utf-8'));
+    }
+  }
+  const file = files.get('file');
+  return { file: file && file.length > 0 ? file : null, field: (name) => fields.get(name) ?? null };
+}
+
+function headerName(field: string): string {
+  // fileHash -> X-File-Hash
+  return 'X-' + field.replace(/([a-z])([A-Z])/g, '$1-$2').replace(/^[a-z]|-[a-z]/g, (s) => s.toUpperCase());
+}
+
+export async function readUpload(request: Request, maxBytes = maxUploadBytes()): Promise<Upload> {
+  const contentType = request.headers.get('content-type') || '';
+  if (contentType.startsWith('multipart/form-data')) {
+    return formUpload(await readBody(request, maxBytes), contentType);
+  }
+  if (contentType.startsWith('application/octet-stream')) {
+    const body = await readBody(request, maxBytes);
+    return { file: body.length > 0 ? body : null, field: (name) => request.headers.get(headerName(name)) };
+  }
+  throw new UploadError('Send the workbook as multipart/form-data or application/octet-stream', 415);
+}
@@ -0,0 +1,76 @@
+// Uploaded workbooks kept in memory for a while, keyed by the SHA-256 of the
+// upload. Responses carry the hash in X-File-Hash, and a re-run of the same
+// workbook with other parameters can send it as the `fileHash` form field
+// instead of the file. The local worker pool also keeps the parsed workbook
+// under that hash (see excel_worker.py), so such a re-run skips both the
+// upload and the parse. Entries expire `ttlMs` after their last use, and the
+// least recently used ones are dropped once the total size passes `maxBytes`.
+
+interface Entry {
+  buffer: Buffer;
+  expires: number;
+}
+
+export class SessionExpiredError extends Error {
+  constructor() {
+    super('The workbook is no longer on the server, upload it again');
+    this.name = 'SessionExpiredError';
+  }
+}
+
+export class WorkbookSessions {
+  // Map iteration order is insertion order, so the first entry is always the
+  // least recently used one
+  private entries = new Map<string, Entry>();
+  private totalSize = 0;
+
+  constructor(private maxBytes: number, private ttlMs: number) {}
+
+  get(hash: string): Buffer | null {
+    this.expire();
+    const entry = this.entries.get(hash);
+    if (!entry) return null;
+    this.entries.delete(hash);
+    this.entries.set(hash, { buffer: entry.buffer, expires: Date.now() + this.ttlMs });
+    return entry.buffer;
+  }
+
+  put(hash: string, buffer: Buffer) {
+    if (buffer.length > this.maxBytes) return;
+    this.forget(hash);
+    this.entries.set(hash, { buffer, expires: Date.now() + this.ttlMs });
+    this.totalSize += buffer.length;
+    this.expire();
+    for (const key of Array.from(this.entries.keys())) {
+      if (this.totalSize <= this.maxBytes) break;
+      this.forget(key);
+    }
+  }
+
+  private expire() {
+    const now = Date.now();
+    for (const [key, entry] of Array.from(this.entries)) {
+      if (entry.expires <= now) this.forget(key);
+    }
+  }
+
+  private forget(hash: string) {
+    const entry = this.entries.get(hash);
+    if (!entry) return;
+    this.entries.delete(hash);
+    this.totalSize -= entry.buffer.length;
+  }
+}
+
+const globalForSessions = globalThis as unknown as { workbookSessions?: WorkbookSessions };
+
+// One cache per server process; kept on globalThis so dev hot reloads reuse it
+export function getWorkbookSessions(): WorkbookSessions {
+  if (!globalForSessions.workbookSessions) {
+    globalForSessions.workbookSessions = new WorkbookSessions(
+      (Number(process.env.SESSION_CACHE_MAX_MB) || 128) * 1024 * 1024,
+      Number(process.env.SESSION_TTL_MS) || 30 * 60_000
+    );
+  }
+  return globalForSessions.workbookSessions;
+}
@@ -1,78 +1,346 @@
-import openpyxl
+import argparse
+import contextlib
+import io
 import random
-import sys
-
-def modify_excel(input_file, output_file, percentage=13, operation='increase'):
-    # Load with data_only to get calculated values
-    wb_data = openpyxl.load_workbook(input_file, data_only=True)
-    # Load without data_only to preserve formulas
-    wb = openpyxl.load_workbook(input_file)
-    
-    time_sheets = ['7-8AM', '8-9AM', '9-10AM', '10-11AM', '11-12PM', '12-1PM',
-                   '1-2PM', '2-3PM', '3-4PM', '4-5PM', '5-6PM', '6-7PM']
-    
+import zipfile
+
+import change_log
+import instrument
+import layout
+import recalc
+import xlsx_patch
+
+TIME_SHEETS = ['7-8AM', '8-9AM', '9-10AM', '10-11AM', '11-12PM', '12-1PM',
+               '1-2PM', '2-3PM', '3-4PM', '4-5PM', '5-6PM', '6-7PM']
+
+def sheet_rng(seed, sheet_name):
+    """
+    Jitter source for one sheet. With a seed each sheet gets its own generator,
+    so a run is fully determined by its inputs and a sheet's values don't
+    depend on which other sheets were processed; without one, the global one.
+    """
+    if seed is None:
+        return random
+    return random.Random(f"{seed}:{sheet_name}")
+
+def adjust_value(original, multiplier, operation, rng=random):
+    modified = original * multiplier
+    jitter = 1 + (rng.random() * 0.04 - 0.02)
+    new_value = round(modified * jitter)
+
+    # Ensure small values change by at least 1
+    if 1 <= original <= 10:
+        if operation == 'increase' and new_value <= original:
+            new_value = original + 1
+        elif operation == 'decrease' and new_value >= original:
+            new_value = max(1, original - 1)
+    return new_value
+
+def read_snapshot(input_file, sheet_names=TIME_SHEETS, rows=None):
+    """
+    Read columns A-M of the hourly sheets in a single pass over the sheet XML.
+    Each cell keeps both its cached value and its formula, so one parse covers
+    what the data_only and formula loads of openpyxl were each needed for.
+    rows optionally maps sheet names to the only row numbers to read.
+    """
+    snapshot = {}
+    with zipfile.ZipFile(input_file) as zf:
+        parts = xlsx_patch.sheet_parts(zf)
+        strings = xlsx_patch.shared_strings(zf)
+        for sheet_name in sheet_names:
+            if sheet_name in parts:
+                sheet_rows = rows.get(sheet_name, ()) if rows is not None else None
+                snapshot[sheet_name] = list(xlsx_patch.iter_rows(zf, parts[sheet_name], strings, max_col=13,
+                                                                 rows=sheet_rows))
+    return snapshot
+
+def is_bound_row(cells):
+    """A bound row has text in column A and a positive (cached) count in B-M"""
+    cell_a = cells.get(1)
+    cell_text = str(cell_a.value).lower() if cell_a and cell_a.value else ''
+    if not cell_text.strip():
+        return False
+    return any(isinstance(cell.value, (int, float)) and cell.value > 0
+               for col, cell in cells.items() if 2 <= col <= 13)
+
+def bound_rows(sheet_layout):
+    """The rows of each hourly sheet that can be bound rows, from the template layout"""
+    return {sheet_name: layout.bound_rows(sheet_layout, sheet_name) for sheet_name in TIME_SHEETS}
+
+def plan_changes(snapshot, multiplier, operation, seed=None):
+    """Work out the new value of every count cell, as {sheet: {(row, col): value}}"""
+    changes = {}
+    for sheet_name in TIME_SHEETS:
+        if sheet_name not in snapshot:
+            continue
+
+        rng = sheet_rng(seed, sheet_name)
+        sheet_changes = changes[sheet_name] = {}
+        for idx, cells in snapshot[sheet_name]:
+            if not is_bound_row(cells):
+                continue
+            # Modify columns B-M, leaving formulas alone
+            for col in range(2, 14):
+                cell = cells.get(col)
+                if cell is None or cell.formula is not None:
+                    continue
+                if isinstance(cell.value, (int, float)):
+                    original = cell.value
+                    if original == 0:
+                        continue  # Skip zeros
+
+                    sheet_changes[(idx, col)] = adjust_value(original, multiplier, operation, rng)
+
+        print(f"Modified {len(sheet_changes)} cells in {sheet_name}")
+    return changes
+
+def record_snapshot_changes(recorder, snapshot, changes):
+    """Record planned changes with their original values and bounds from the snapshot"""
+    for sheet_name, sheet_changes in changes.items():
+        rows = dict(snapshot[sheet_name])
+        recorder.add_sheet(sheet_name, sheet_changes,
+                           lambda row, col: rows[row][col].value,
+                           lambda row: rows[row][1].value if 1 in rows[row] else '')
+
+def snapshot_original(snapshot):
+    """original(sheet, row, col) for recalc.formula_changes: the snapshot value of a changed cell"""
+    rows = {sheet_name: dict(sheet_rows) for sheet_name, sheet_rows in snapshot.items()}
+    return lambda sheet_name, row, col: rows[sheet_name][row][col].value
+
+def cached(session, key, load):
+    """load() once per session and reuse the result; without a session, every time"""
+    if session is None:
+        return load()
+    if key not in session:
+        session[key] = load()
+    return session[key]
+
+def plan_changes_grid(input_file, multiplier, operation, rows=None, seed=None, metrics=None, recorder=None,
+                      session=None):
+    """plan_changes on the NumPy count grid (needs numpy); returns the changes and the grid"""
+    import numpy as np
+    import count_grid
+
+    metrics = metrics if metrics is not None else instrument.Metrics()
+    with metrics.phase('read'):
+        grid = cached(session, 'grid', lambda: count_grid.load_grid(input_file, TIME_SHEETS, rows))
+    metrics.count('rows_scanned', len(grid.sheets) * len(grid.rows))
+    metrics.count('cells_scanned', int(np.count_nonzero(grid.present | grid.formulas)))
+    with metrics.phase('plan'):
+        new_values, mask = count_grid.scale_counts(grid, multiplier, operation, np.random.default_rng(seed))
+    for sheet_name, modified in zip(grid.sheets, mask.sum(axis=(1, 2))):
+        print(f"Modified {modified} cells in {sheet_name}")
+    changes = grid.changes(new_values, mask)
+    if recorder is not None:
+        grid.record_changes(recorder, changes)
+    return changes, grid
+
+_sheet_strings = None
+
+def _init_sheet_worker(strings):
+    global _sheet_strings
+    _sheet_strings = strings
+
+def process_sheet(sheet_name, data, rows, multiplier, operation, seed):
+    """
+    Read, plan and patch one hourly sheet in a pool process (see
+    plan_sheets_parallel). Returns (rows read, changes, patched XML or None
+    if nothing changed, what plan_changes printed).
+    """
+    sheet_rows = list(xlsx_patch.iter_stream_rows(io.BytesIO(data), _sheet_strings, max_col=13, rows=rows))
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        changes = plan_changes({sheet_name: sheet_rows}, multiplier, operation, seed)[sheet_name]
+    patched = xlsx_patch.patch_sheet_xml(data, changes) if changes else None
+    return sheet_rows, changes, patched, log.getvalue()
+
+def plan_sheets_parallel(input_file, multiplier, operation, rows=None, seed=None, workers=2):
+    """
+    read_snapshot, plan_changes and patch_sheet_xml for each hourly sheet
+    across a pool of worker processes. The sheets are independent and each
+    draws from its own seeded generator, so with a seed the result is the
+    same as the serial run's; without one, one is drawn here. Returns
+    (snapshot, changes, patched sheet XML by sheet name) for patch_workbook.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if seed is None:
+        # Forked workers would all start from the parent's global random
+        # state and give their sheets the same jitter
+        seed = random.SystemRandom().randrange(1 << 32)
+
+    with zipfile.ZipFile(input_file) as zf:
+        parts = xlsx_patch.sheet_parts(zf)
+        strings = xlsx_patch.shared_strings(zf)
+        sheets = [(sheet_name, zf.read(parts[sheet_name])) for sheet_name in TIME_SHEETS if sheet_name in parts]
+
+    snapshot, changes, patched = {}, {}, {}
+    with ProcessPoolExecutor(workers, initializer=_init_sheet_worker, initargs=(strings,)) as pool:
+        futures = [pool.submit(process_sheet, sheet_name, data, rows.get(sheet_name, ()) if rows is not None else None,
+                               multiplier, operation, seed)
+                   for sheet_name, data in sheets]
+        # Collected in sheet order, so the log reads as it does serially
+        for (sheet_name, _), future in zip(sheets, futures):
+            snapshot[sheet_name], changes[sheet_name], data, log = future.result()
+            if data is not None:
+                patched[sheet_name] = data
+            print(log, end='')
+    return snapshot, changes, patched
+
+def modify_excel(input_file, output_file, percentage=13, operation='increase', mode='openpyxl',
+                 engine='python', use_layout=True, seed=None, metrics=None, recorder=None, session=None,
+                 workers=1, recalculate=True):
+    """
+    Returns the number of cells modified per sheet. Pass an instrument.Metrics
+    to have the phase timings, cells scanned/modified and bytes in/out
+    recorded on it, and a change_log.ChangeRecorder to have every changed cell
+    recorded with its original value.
+
+    session is a dict the caller keeps for one input workbook (see
+    excel_worker.py). The first run stores the parsed counts in it, and in
+    openpyxl mode the loaded workbook; later runs with other parameters reuse
+    them instead of parsing the file again.
+
+    workers > 1 reads, plans and patches the hourly sheets in that many
+    processes (patch mode with the python engine only); pass a seed for
+    output identical to the serial run's.
+
+    In patch mode the cached results of the formulas that depend on the
+    changed counts are brought up to date as well (see recalc.py), unless
+    recalculate is False. openpyxl writes formulas without cached results.
+    """
+    if workers > 1 and (mode != 'patch' or engine != 'python'):
+        raise ValueError("workers > 1 needs mode='patch' and engine='python'")
+    metrics = metrics if metrics is not None else instrument.Metrics()
+    metrics.count('bytes_in', instrument.file_size(input_file))
+
     # Calculate multiplier based on operation
     multiplier = (1 + percentage / 100) if operation == 'increase' else (1 - percentage / 100)
-    
-    total_modified = 0
-    
-    for sheet_name in time_sheets:
-        if sheet_name not in wb.sheetnames:
-            continue
-            
-        ws = wb[sheet_name]
-        ws_data = wb_data[sheet_name]
-        sheet_modified = 0
-        
-        for idx, row in enumerate(ws.iter_rows(), 1):
-            cell_a_data = ws_data.cell(row=idx, column=1)
-            cell_text = str(cell_a_data.value).lower() if cell_a_data.value else ''
-            
-            # Check if this row contains bound data (has numeric values in columns B-M)
-            has_numeric_data = False
-            for col_idx in range(1, 13):
-                if col_idx < len(row):
-                    cell_value = ws_data.cell(row=idx, column=col_idx + 1).value
-                    if isinstance(cell_value, (int, float)) and cell_value > 0:
-                        has_numeric_data = True
-                        break
-            
-            # Only process rows that have both text in column A and numeric data in B-M
-            if cell_text and has_numeric_data and len(cell_text.strip()) > 0:
-                # Modify columns B-M (indices 1-12)
-                for col_idx in range(1, 13):
-                    if col_idx < len(row):
-                        cell = row[col_idx]
-                        if isinstance(cell.value, (int, float)) and not str(cell.value).startswith('='):
-                            original = cell.value
-                            if original == 0:
-                                continue  # Skip zeros
-                            
-                            modified = original * multiplier
-                            jitter = 1 + (random.random() * 0.04 - 0.02)
-                            new_value = round(modified * jitter)
-                            
-                            # Ensure small values change by at least 1
-                            if 1 <= original <= 10:
-                                if operation == 'increase' and new_value <= original:
-                                    new_value = original + 1
-                                elif operation == 'decrease' and new_value >= original:
-                                    new_value = max(1, original - 1)
-                            
-                            cell.value = new_value
-                            sheet_modified += 1
-                            total_modified += 1
-        
-        print(f"Modified {sheet_modified} cells in {sheet_name}")
-    
-    wb.save(output_file)
-    wb_data.close()
+
+    # Only rows labelled in column A can be bound rows; the cached template
+    # layout says which those are, so the other rows are never read
+    rows = sheet_layout = None
+    if use_layout:
+        with metrics.phase('layout'):
+            sheet_layout = cached(session, 'layout', lambda: layout.get_layout(input_file))
+            rows = bound_rows(sheet_layout)
+
+    snapshot = patched = grid = None
+    if workers > 1:
+        with metrics.phase('sheets'):
+            snapshot, changes, patched = plan_sheets_parallel(input_file, multiplier, operation, rows, seed, workers)
+    elif engine == 'grid':
+        changes, grid = plan_changes_grid(input_file, multiplier, operation, rows, seed, metrics, recorder, session)
+    else:
+        with metrics.phase('read'):
+            snapshot = cached(session, 'snapshot', lambda: read_snapshot(input_file, rows=rows))
+        with metrics.phase('plan'):
+            changes = plan_changes(snapshot, multiplier, operation, seed)
+    if snapshot is not None:
+        for sheet_rows in snapshot.values():
+            metrics.count('rows_scanned', len(sheet_rows))
+            metrics.count('cells_scanned', sum(1 for _, cells in sheet_rows for col in cells if 2 <= col <= 13))
+        if recorder is not None:
+            record_snapshot_changes(recorder, snapshot, changes)
+    total_modified = sum(len(cells) for cells in changes.values())
+    metrics.count('cells_modified', total_modified)
+
+    if mode == 'patch':
+        patch_changes = changes
+        # Recalculated cells without a cached result to update, by sheet
+        unwritten = {}
+        if recalculate:
+            with metrics.phase('recalc'):
+                graph = cached(session, 'graph', lambda: recalc.formula_graph(input_file, sheet_layout))
+                original = grid.original if grid is not None else snapshot_original(snapshot)
+                recalculated, stale = recalc.formula_changes(graph, changes, original)
+                patch_changes = recalc.merge(changes, recalculated)
+                # Sheets patched by the workers still need their formula cells
+                for sheet_name in patched or {}:
+                    if sheet_name in recalculated:
+                        patched[sheet_name] = xlsx_patch.patch_sheet_xml(patched[sheet_name],
+                                                                         recalculated[sheet_name],
+                                                                         unwritten.setdefault(sheet_name, []))
+        # Only the hourly worksheet parts are rewritten; the rest is copied as-is
+        with metrics.phase('patch'):
+            xlsx_patch.patch_workbook(input_file, output_file, patch_changes, patched=patched, unwritten=unwritten)
+        if recalculate:
+            metrics.count('formulas_recalculated', recalc.report(recalculated, stale, unwritten))
+    else:
+        # Imported here: patch mode (as in the Python function) doesn't need it
+        import openpyxl
+
+        # Load without data_only to preserve formulas
+        with metrics.phase('load_workbook'):
+            wb = cached(session, 'workbook', lambda: openpyxl.load_workbook(input_file))
+        originals = []
+        try:
+            with metrics.phase('mutate'):
+                for sheet_name, cells in changes.items():
+                    ws = wb[sheet_name]
+                    for (row, col), value in cells.items():
+                        cell = ws.cell(row=row, column=col)
+                        originals.append((cell, cell.value))
+                        cell.value = value
+            with metrics.phase('save'):
+                wb.save(output_file)
+        finally:
+            # A workbook kept in the session has to stay as it was uploaded
+            if session is not None:
+                for cell, value in originals:
+                    cell.value = value
+    metrics.count('bytes_out', instrument.file_size(output_file))
+
     print(f"\nTotal: {total_modified} cells modified")
-    print(f"Saved to: {output_file}")
+    if isinstance(output_file, str):
+        print(f"Saved to: {output_file}")
+    return {sheet_name: len(cells) for sheet_name, cells in changes.items()}
 
 if __name__ == "__main__":
-    input_file = sys.argv[1] if len(sys.argv) > 1 else "Musoli Area Day 2 Tuesday Counts, Sabatia - Bukura (B136) Road Counts.xlsx"
-    output_file = sys.argv[2] if len(sys.argv) > 2 else "Modified_Traffic_Counts.xlsx"
-    percentage = float(sys.argv[3]) if len(sys.argv) > 3 else 13
-    operation = sys.argv[4] if len(sys.argv) > 4 else 'increase'
-    modify_excel(input_file, output_file, percentage, operation)
+    parser = argparse.ArgumentParser(description="Increase or decrease hourly traffic counts")
+    parser.add_argument("input_file", nargs="?",
+                        default="Musoli Area Day 2 Tuesday Counts, Sabatia - Bukura (B136) Road Counts.xlsx")
+    parser.add_argument("output_file", nargs="?", default="Modified_Traffic_Counts.xlsx")
+    parser.add_argument("percentage", nargs="?", type=float, default=13)
+    parser.add_argument("operation", nargs="?", default="increase", choices=["increase", "decrease"])
+    parser.add_argument("--mode", default="openpyxl", choices=["openpyxl", "patch"],
+                        help="patch rewrites only the hourly sheet XML instead of re-saving the workbook")
+    parser.add_argument("--engine", default="python", choices=["python", "grid"],
+                        help="grid computes the new counts as NumPy array operations")
+    parser.add_argument("--no-layout-cache", dest="use_layout", action="store_false",
+                        help="rediscover the bound rows instead of using the cached template layout")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed the jitter so the same inputs always give the same output "
+                             "(one is picked and kept in the journal when not given)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="process the hourly sheets in this many processes (with --mode patch)")
+    parser.add_argument("--no-recalc", dest="recalculate", action="store_false",
+                        help="leave the cached formula results in patch mode to Excel")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write phase timings and counters as JSON to FILE ('-' for stdout)")
+    parser.add_argument("--export", metavar="FILE",
+                        help="also write the changed cells as a table: Parquet for .parquet with pyarrow, else CSV")
+    parser.add_argument("--no-journal", dest="journal", action="store_false",
+                        help="don't write the change journal next to the output (see journal.py)")
+    parser.add_argument("--profile", nargs="?", const=instrument.default_profile_dir(), metavar="DIR",
+                        help="write cProfile stats and a tracemalloc report for this run to DIR (default profiles/)")
+    args = parser.parse_args()
+    if args.journal and args.seed is None:
+        args.seed = random.SystemRandom().randrange(1 << 32)
+    metrics = instrument.Metrics()
+    recorder = change_log.ChangeRecorder() if args.export or args.journal else None
+    profiling = (instrument.profiled(args.input_file, 'modify_excel', args.profile) if args.profile
+                 else contextlib.nullcontext())
+    with profiling:
+        modify_excel(args.input_file, args.output_file, args.percentage, args.operation, args.mode, args.engine,
+                     args.use_layout, args.seed, metrics, recorder, workers=args.workers,
+                     recalculate=args.recalculate)
+    if args.export:
+        print(f"Exported {len(recorder)} changes to {change_log.write_table(recorder, args.export)}")
+    if args.journal:
+        params = {name: getattr(args, name) for name in
+                  ('percentage', 'operation', 'mode', 'engine', 'use_layout', 'workers', 'recalculate')}
+        run = change_log.run_record('modify_excel', args.input_file, args.output_file, params, args.seed)
+        print(f"Journal written to {change_log.write_journal(recorder, change_log.journal_path(args.output_file), run)}")
+    if args.metrics:
+        metrics.write(args.metrics)
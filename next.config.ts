@@ -1,7 +1,16 @@
 import type { NextConfig } from "next";
 
+// The job API keeps its jobs in the memory of one server process
+// (lib/jobs.ts). On Vercel (which sets VERCEL) every request can reach a
+// different instance, so there the job API is off and the page uses the
+// synchronous /api/modify-excel. JOB_API=1 or JOB_API=0 decides it either
+// way; the setting is fixed at build time so the page can read it too.
+const jobApi = process.env.JOB_API ?? (process.env.VERCEL ? "0" : "1");
+
 const nextConfig: NextConfig = {
-  /* config options here */
+  env: {
+    NEXT_PUBLIC_JOB_API: jobApi,
+  },
 };
 
 export default nextConfig;
@@ -0,0 +1,390 @@
+import re
+import zipfile
+from bisect import bisect_left, bisect_right, insort
+from heapq import heappop, heappush
+
+import layout
+import xlsx_patch
+
+# Cached formula results that follow changed counts, without Excel.
+#
+# The templates only use SUM over ranges, + and - on (cross-sheet)
+# references, and numbers, so every formula is a linear combination of
+# cell ranges: SUM(B5:B8) is B5 + B6 + B7 + B8. A change to an input then
+# moves each formula that covers it by a fixed multiple of the change, so
+# recalculating only means pushing the deltas of the changed cells through
+# the formulas that cover them, in dependency order, and adding them to the
+# cached values already in the file. The formulas reading each cell are
+# looked up in an index of their ranges, so only those reachable from the
+# changes are visited, and nothing else in the workbook is read.
+#
+# Formulas outside that subset, formulas whose text couldn't be read (a
+# shared formula whose first cell is missing) or that name no cells (B:B,
+# defined names), formulas that depend on them and cells whose old value
+# isn't known are reported as stale and left for Excel, which still
+# recalculates everything on open (fullCalcOnLoad). So are recalculated
+# cells with no cached result in the file to update.
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<ref>(?:(?:'(?P<quoted>(?:[^']|'')+)'|(?P<sheet>[A-Za-z_][\w.]*))!)?
+            \$?(?P<col>[A-Z]{1,3})\$?(?P<row>\d+)
+            (?::\$?(?P<col2>[A-Z]{1,3})\$?(?P<row2>\d+))?)
+      | (?P<func>[A-Z][A-Z0-9.]*)\(
+      | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+      | (?P<op>[-+,()])
+    )""", re.X)
+
+# Most template formulas are a plain SUM over one range on the same sheet
+_SUM_RE = re.compile(r'SUM\(\$?([A-Z]{1,3})\$?(\d+):\$?([A-Z]{1,3})\$?(\d+)\)')
+
+# Graphs by template fingerprint, so a worker that sees the same template
+# again doesn't compile its formulas again
+_graphs = {}
+_MAX_GRAPHS = 8
+
+# Ranges are indexed by column and by blocks of this many rows; ranges that
+# would take more index entries than _WIDE_RANGE are checked on every lookup
+_ROW_BLOCK = 64
+_WIDE_RANGE = 256
+
+
+class UnsupportedFormula(ValueError):
+    """A formula outside the SUM / + / - subset"""
+
+
+def _tokens(text):
+    position = 0
+    tokens = []
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if match is None or match.end() == position:
+            raise UnsupportedFormula(text)
+        tokens.append(match)
+        position = match.end()
+    return tokens
+
+
+def _range(match, sheet):
+    """A reference token as (sheet, first row, first col, last row, last col)"""
+    if match.group('quoted') is not None:
+        sheet = match.group('quoted').replace("''", "'")
+    elif match.group('sheet') is not None:
+        sheet = match.group('sheet')
+    col, row = xlsx_patch.column_index(match.group('col')), int(match.group('row'))
+    if match.group('col2') is None:
+        return sheet, row, col, row, col
+    col2, row2 = xlsx_patch.column_index(match.group('col2')), int(match.group('row2'))
+    return sheet, min(row, row2), min(col, col2), max(row, row2), max(col, col2)
+
+
+def references(text, sheet):
+    """Every range a formula refers to, whatever it does with them"""
+    return [_range(match, sheet) for match in _TOKEN_RE.finditer(text) if match.group('ref')]
+
+
+class _Parser:
+    """Recursive descent over the token list, collecting (range, coefficient) terms"""
+
+    def __init__(self, text, sheet):
+        self.tokens = _tokens(text)
+        self.position = 0
+        self.sheet = sheet
+        self.constant = 0
+        self.terms = []
+
+    def peek(self, kind):
+        if self.position < len(self.tokens) and self.tokens[self.position].group(kind) is not None:
+            return self.tokens[self.position]
+        return None
+
+    def take(self, kind, value=None):
+        token = self.peek(kind)
+        if token is None or (value is not None and token.group(kind) != value):
+            raise UnsupportedFormula()
+        self.position += 1
+        return token
+
+    def expression(self, sign):
+        self.term(sign)
+        while self.peek('op') and self.peek('op').group('op') in '+-':
+            operator = self.take('op').group('op')
+            self.term(sign if operator == '+' else -sign)
+
+    def term(self, sign, in_sum=False):
+        if self.peek('op') and self.peek('op').group('op') in '+-':
+            operator = self.take('op').group('op')
+            self.term(sign if operator == '+' else -sign)
+        elif self.peek('number'):
+            self.constant += sign * float(self.take('number').group('number'))
+        elif self.peek('ref'):
+            match = self.take('ref')
+            if match.group('col2') is not None and not in_sum:
+                raise UnsupportedFormula()
+            self.terms.append(_range(match, self.sheet) + (sign,))
+        elif self.peek('func'):
+            if self.take('func').group('func') != 'SUM':
+                raise UnsupportedFormula()
+            self.argument(sign)
+            while self.peek('op') and self.peek('op').group('op') == ',':
+                self.take('op')
+                self.argument(sign)
+            self.take('op', ')')
+        else:
+            self.take('op', '(')
+            self.expression(sign)
+            self.take('op', ')')
+
+    def argument(self, sign):
+        # A range on its own is only allowed as a SUM argument
+        if self.peek('ref') and self.peek('ref').group('col2') is not None:
+            self.term(sign, in_sum=True)
+        else:
+            self.expression(sign)
+
+
+def compile_formula(text, sheet):
+    """
+    A formula (without '=') on sheet as (constant, terms), each term a
+    (sheet, first row, first col, last row, last col, coefficient) range
+    """
+    match = _SUM_RE.fullmatch(text)
+    if match:
+        col, col2 = xlsx_patch.column_index(match.group(1)), xlsx_patch.column_index(match.group(3))
+        row, row2 = int(match.group(2)), int(match.group(4))
+        return 0, [(sheet, min(row, row2), min(col, col2), max(row, row2), max(col, col2), 1)]
+    parser = _Parser(text, sheet)
+    parser.expression(1)
+    if parser.position != len(parser.tokens):
+        raise UnsupportedFormula(text)
+    return parser.constant, parser.terms
+
+
+class _CellIndex:
+    """Cells by sheet and row, for finding the ones inside a range"""
+
+    def __init__(self):
+        self.rows = {}
+        self.cols = {}
+
+    def add(self, sheet, row, col, value):
+        sheet_cols = self.cols.setdefault(sheet, {})
+        if row not in sheet_cols:
+            insort(self.rows.setdefault(sheet, []), row)
+            sheet_cols[row] = {}
+        sheet_cols[row][col] = value
+
+    def within(self, sheet, first_row, first_col, last_row, last_col):
+        """(row, col, value) of the cells inside a range"""
+        rows = self.rows.get(sheet)
+        if not rows:
+            return
+        start = bisect_left(rows, first_row)
+        if start == len(rows) or rows[start] > last_row:
+            return
+        sheet_cols = self.cols[sheet]
+        for row in rows[start:bisect_right(rows, last_row)]:
+            for col, value in sheet_cols[row].items():
+                if first_col <= col <= last_col:
+                    yield row, col, value
+
+
+class FormulaGraph:
+    """The formula cells of a workbook as ranges, in dependency order"""
+
+    def __init__(self, formulas):
+        # formula cell -> [(sheet, first row, first col, last row, last col, coefficient)],
+        # with a coefficient of None for the ranges of an unsupported formula
+        self.terms = {}
+        # Formulas with no text or no cell references to go by: what they
+        # depend on is unknown
+        self.unresolved = set()
+        cells = _CellIndex()
+        for sheet, row, col, text in formulas:
+            if not text.strip():
+                self.unresolved.add((sheet, row, col))
+            try:
+                _, terms = compile_formula(text, sheet)
+            except UnsupportedFormula:
+                terms = [reference + (None,) for reference in references(text, sheet)]
+                if not terms:
+                    # Whole columns (B:B), defined names and the like
+                    self.unresolved.add((sheet, row, col))
+            self.terms[(sheet, row, col)] = terms
+            cells.add(sheet, row, col, (sheet, row, col))
+
+        # Topological order (Kahn): formulas whose ranges hold other formulas
+        # come after them; formulas in a cycle go last and are always stale
+        dependents = {}
+        waiting = {}
+        for cell, terms in self.terms.items():
+            precedents = {precedent for sheet, *bounds, _ in terms
+                          for _, _, precedent in cells.within(sheet, *bounds) if precedent != cell}
+            waiting[cell] = len(precedents)
+            for precedent in precedents:
+                dependents.setdefault(precedent, []).append(cell)
+        ready = [cell for cell, count in waiting.items() if count == 0]
+        self.order = []
+        while ready:
+            cell = ready.pop()
+            self.order.append(cell)
+            for dependent in dependents.get(cell, ()):
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        self.cyclic = {cell for cell, count in waiting.items() if count > 0}
+        self.order.extend(self.cyclic)
+        self.rank = {cell: rank for rank, cell in enumerate(self.order)}
+
+        # Which formulas read a cell: (sheet, col, row block) -> ranges
+        self.readers = {}
+        self.wide = {}
+        for cell, terms in self.terms.items():
+            for sheet, first_row, first_col, last_row, last_col, _ in terms:
+                entry = (first_row, first_col, last_row, last_col, cell)
+                blocks = range(first_row // _ROW_BLOCK, last_row // _ROW_BLOCK + 1)
+                if len(blocks) * (last_col - first_col + 1) > _WIDE_RANGE:
+                    self.wide.setdefault(sheet, []).append(entry)
+                    continue
+                for col in range(first_col, last_col + 1):
+                    for block in blocks:
+                        self.readers.setdefault((sheet, col, block), []).append(entry)
+
+    def __contains__(self, cell):
+        return cell in self.terms
+
+    def reading(self, sheet, row, col):
+        """The formula cells with a range that holds (sheet, row, col)"""
+        entries = self.readers.get((sheet, col, row // _ROW_BLOCK), [])
+        for first_row, first_col, last_row, last_col, cell in entries + self.wide.get(sheet, []):
+            if first_row <= row <= last_row and first_col <= col <= last_col:
+                yield cell
+
+    def propagate(self, deltas):
+        """
+        How much each formula result moves when input cells move by deltas
+        ({cell: delta}, None for an unknown change). Formulas whose ranges
+        hold none of the changed or moved cells are never visited, and
+        unresolved formulas go stale on any change. Returns ({formula cell:
+        delta}, set of stale formula cells).
+        """
+        changed = _CellIndex()
+        for (sheet, row, col), delta in deltas.items():
+            changed.add(sheet, row, col, delta)
+
+        # Formulas reading a changed cell, taken in dependency order, so
+        # each one is visited once after everything it reads has moved
+        queue = []
+        queued = set()
+
+        def reach(cell):
+            for reader in self.reading(*cell):
+                if reader not in queued:
+                    queued.add(reader)
+                    heappush(queue, (self.rank[reader], reader))
+
+        for cell in deltas:
+            reach(cell)
+        if deltas:
+            for cell in self.unresolved:
+                queued.add(cell)
+                heappush(queue, (self.rank[cell], cell))
+
+        moved = {}
+        stale = set()
+        while queue:
+            _, cell = heappop(queue)
+            if cell in deltas:
+                # Overwritten with a value, so no longer a formula
+                continue
+            unknown = cell in self.unresolved
+            delta = 0
+            for sheet, first_row, first_col, last_row, last_col, coefficient in self.terms[cell]:
+                for _, _, change in changed.within(sheet, first_row, first_col, last_row, last_col):
+                    if change is None or coefficient is None:
+                        unknown = True
+                    else:
+                        delta += coefficient * change
+            if unknown or cell in self.cyclic:
+                stale.add(cell)
+                changed.add(*cell, None)
+            else:
+                moved[cell] = delta
+                changed.add(*cell, delta)
+            reach(cell)
+        return moved, stale
+
+
+def formula_graph(input_file, sheet_layout=None):
+    """The FormulaGraph of a workbook, from its cached layout when given"""
+    if sheet_layout is None:
+        with zipfile.ZipFile(input_file) as zf:
+            sheet_layout = layout.build_layout(zf, None)
+    key = sheet_layout['fingerprint']
+    graph = _graphs.get(key)
+    if graph is None:
+        graph = FormulaGraph((sheet, row, col, text)
+                             for sheet, cells in sheet_layout['formula_text'].items()
+                             for row, col, text in cells)
+        if key is not None:
+            if len(_graphs) >= _MAX_GRAPHS:
+                _graphs.pop(next(iter(_graphs)))
+            _graphs[key] = graph
+    return graph
+
+
+def _number(value):
+    # SUM counts empty and text cells as 0
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def formula_changes(graph, changes, original):
+    """
+    The cached values to rewrite after changes ({sheet: {(row, col): value}}):
+    returns ({sheet: {(row, col): xlsx_patch.Recalculated(delta)}}, stale
+    formula cells). original(sheet, row, col) is a changed cell's value
+    before the change. A formula cell that is itself overwritten is no
+    longer a formula, a cell given a formula ('=...') has no result yet,
+    and whatever depends on either goes stale.
+    """
+    deltas = {}
+    for sheet, cells in changes.items():
+        for (row, col), value in cells.items():
+            cell = (sheet, row, col)
+            if cell in graph or (isinstance(value, str) and value.startswith('=')):
+                deltas[cell] = None
+            else:
+                deltas[cell] = _number(value) - _number(original(sheet, row, col))
+    moved, stale = graph.propagate(deltas)
+    recalculated = {}
+    for (sheet, row, col), delta in moved.items():
+        if delta:
+            recalculated.setdefault(sheet, {})[(row, col)] = xlsx_patch.Recalculated(delta)
+    return recalculated, stale
+
+
+def merge(changes, recalculated):
+    """changes with the recalculated formula cells added, leaving written cells alone"""
+    merged = {sheet: dict(cells) for sheet, cells in changes.items()}
+    for sheet, cells in recalculated.items():
+        sheet_changes = merged.setdefault(sheet, {})
+        for position, value in cells.items():
+            sheet_changes.setdefault(position, value)
+    return merged
+
+
+def report(recalculated, stale, unwritten=None):
+    """
+    Print and return how many formula results were rewritten. unwritten is
+    what xlsx_patch.patch_workbook filled in: recalculated cells that had no
+    cached value to update.
+    """
+    missing = sum(len(cells) for cells in (unwritten or {}).values())
+    count = sum(len(cells) for cells in recalculated.values()) - missing
+    print(f"Recalculated {count} formula cells")
+    if missing:
+        print(f"{missing} formula cells have no cached result to update and are left for Excel")
+    if stale:
+        print(f"{len(stale)} formula cells could not be recalculated here and are left for Excel")
+    return count
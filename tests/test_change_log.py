@@ -0,0 +1,111 @@
+import csv
+
+import openpyxl
+import pytest
+
+import change_log
+import journal
+from benchmarks.synthetic import generate_workbook
+from modify_excel import modify_excel
+from workbooks import SHEET, make_workbook, read_cells
+
+ROWS = (
+    '<row r="4"><c r="A4" t="inlineStr"><is><t>Bisil Bound 00-15</t></is></c>'
+    '<c r="B4"><v>5</v></c><c r="C4"><v>2.5</v></c><c r="D4"><f>SUM(B4:C4)</f><v>7.5</v></c></row>'
+    '<row r="5"><c r="B5"><v>3</v></c><c r="D5"><f>D4+B5</f><v>10.5</v></c></row>'
+)
+
+
+def sheet_values(path):
+    wb = openpyxl.load_workbook(path)
+    return {name: [[cell.value for cell in row] for row in wb[name].iter_rows()] for name in wb.sheetnames}
+
+
+def recorder_arrays(recorder):
+    return ([getattr(recorder, name).tobytes() for name in change_log.JOURNAL_ARRAYS],
+            recorder.sheets, recorder.bounds, recorder.old_text, recorder.new_text)
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    """A seeded patch-mode run over a synthetic workbook, with its recorder and journal"""
+    monkeypatch.setenv('LAYOUT_CACHE_DIR', str(tmp_path / 'layouts'))
+    source = str(tmp_path / 'counts.xlsx')
+    output = str(tmp_path / 'modified.xlsx')
+    generate_workbook(source, hours=12, rows_per_bound=3, seed=1)
+    recorder = change_log.ChangeRecorder()
+    modify_excel(source, output, 13, 'increase', mode='patch', seed=42, recorder=recorder)
+    record = change_log.run_record('modify_excel', source, output, {'percentage': 13}, 42)
+    path = change_log.write_journal(recorder, change_log.journal_path(output), record)
+    return source, output, recorder, path
+
+
+def test_journal_round_trip(tmp_path, run):
+    source, output, recorder, path = run
+    record, read_back = change_log.read_journal(path)
+    assert record['seed'] == 42 and record['params'] == {'percentage': 13}
+    assert len(read_back) == len(recorder) > 0
+    assert recorder_arrays(read_back) == recorder_arrays(recorder)
+
+    redone = str(tmp_path / 'redone.xlsx')
+    journal.apply_journal(path, source, redone)
+    assert sheet_values(redone) == sheet_values(output)
+
+    restored = str(tmp_path / 'restored.xlsx')
+    journal.apply_journal(path, output, restored, revert=True)
+    assert sheet_values(restored) == sheet_values(source)
+
+    with pytest.raises(ValueError):
+        journal.apply_journal(path, source, str(tmp_path / 'wrong.xlsx'), revert=True)
+
+
+def test_revert_restores_cached_results(tmp_path):
+    source = tmp_path / 'counts.xlsx'
+    source.write_bytes(make_workbook(ROWS).getvalue())
+    output = tmp_path / 'modified.xlsx'
+    recorder = change_log.ChangeRecorder()
+    recorder.add(SHEET, 4, 2, 5, 6, 'Bisil Bound 00-15')
+    recorder.add(SHEET, 4, 3, 2.5, 4)
+    recorder.add(SHEET, 5, 2, 3, None)
+    path = str(tmp_path / 'modified.journal')
+    change_log.write_journal(recorder, path, {'script': 'test'})
+
+    journal.apply_journal(path, str(source), str(output), force=True, use_layout=False)
+    with open(output, 'rb') as f:
+        cells = read_cells(f)
+    assert (cells[(4, 2)].value, cells[(4, 3)].value, cells[(4, 4)].value, cells[(5, 4)].value) == (6, 4, 10, 10)
+    assert cells[(5, 2)].value is None
+
+    restored = tmp_path / 'restored.xlsx'
+    journal.apply_journal(path, str(output), str(restored), revert=True, force=True, use_layout=False)
+    with open(source, 'rb') as before, open(restored, 'rb') as after:
+        # Values and cached formula results as they were, types included (2.5 stays a float, 5 an int)
+        assert [(cell, repr(cell.value)) for cell in read_cells(after).values()] == \
+            [(cell, repr(cell.value)) for cell in read_cells(before).values()]
+
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_write_table_csv_fallback(tmp_path, monkeypatch, run):
+    recorder = run[2]
+    monkeypatch.setattr(change_log, 'have_parquet', lambda: False)
+    path = change_log.write_table(recorder, str(tmp_path / 'changes.parquet'))
+    assert path == str(tmp_path / 'changes.csv')
+    rows = read_csv(path)
+    assert rows[0] == change_log.COLUMNS
+    assert rows[1:] == [['' if value is None else str(value) for value in record] for record in recorder.records()]
+
+
+def test_write_table_parquet(tmp_path, run):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+
+    recorder = run[2]
+    path = change_log.write_table(recorder, str(tmp_path / 'changes.parquet'))
+    assert path == str(tmp_path / 'changes.parquet')
+    table = pq.read_table(path).to_pydict()
+    assert list(table) == change_log.COLUMNS
+    assert list(zip(*table.values())) == list(recorder.records())
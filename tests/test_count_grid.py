@@ -0,0 +1,71 @@
+import contextlib
+import io
+
+import numpy as np
+import openpyxl
+import pytest
+
+import change_log
+import count_grid
+import force_exact_totals
+from benchmarks.synthetic import generate_workbook
+from modify_excel import TIME_SHEETS, plan_changes, read_snapshot
+
+
+@pytest.fixture
+def counts(tmp_path, monkeypatch):
+    """A 12-hour workbook with some fractional counts and counts in a row that isn't a bound row"""
+    monkeypatch.setenv('LAYOUT_CACHE_DIR', str(tmp_path / 'layouts'))
+    path = str(tmp_path / 'counts.xlsx')
+    generate_workbook(path, hours=12, rows_per_bound=3, seed=2)
+    wb = openpyxl.load_workbook(path)
+    for name in ('7-8AM', '1-2PM'):
+        ws = wb[name]
+        ws['B3'], ws['C4'], ws['D5'] = 12.5, 3.7, 0.4
+        # Row 7 sits between the two bounds and has no label
+        ws['B7'], ws['C7'] = 40, 2.5
+    wb.save(path)
+    return path
+
+
+def quietly(fn, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+@pytest.mark.parametrize('operation', ['increase', 'decrease'])
+def test_scale_counts_matches_plan_changes(counts, operation):
+    multiplier = 1.13 if operation == 'increase' else 0.87
+    snapshot = read_snapshot(counts)
+    python_changes = quietly(plan_changes, snapshot, multiplier, operation, 1)
+    grid = count_grid.load_grid(counts, TIME_SHEETS)
+    new_values, mask = count_grid.scale_counts(grid, multiplier, operation, np.random.default_rng(1))
+    grid_changes = grid.changes(new_values, mask)
+
+    for name in grid.sheets:
+        assert set(grid_changes[name]) == set(python_changes[name])
+        assert (7, 2) not in grid_changes[name]
+        # The jitter comes from different generators, so the totals agree to within it
+        python_total = sum(python_changes[name].values())
+        grid_total = sum(grid_changes[name].values())
+        assert abs(python_total - grid_total) <= 0.04 * python_total + len(grid_changes[name])
+    assert (3, 2) in grid_changes['7-8AM'] and (5, 4) in grid_changes['7-8AM']
+
+
+def test_distribute_totals_matches_force_exact_totals(counts, tmp_path):
+    written = {}
+    totals = {}
+    for engine in ('openpyxl', 'grid'):
+        output = str(tmp_path / f'{engine}.xlsx')
+        recorder = change_log.ChangeRecorder()
+        quietly(force_exact_totals.force_exact_totals, counts, output, engine, recorder=recorder, seed=3)
+        written[engine] = {(name, row, col) for name, cells in recorder.changes().items() for row, col in cells}
+
+        grid = count_grid.load_grid(output, TIME_SHEETS)
+        rows = count_grid.find_direction_rows(grid, force_exact_totals.TOTALS)
+        totals[engine] = {direction: count_grid.class_totals(grid, direction_rows).tolist()
+                          for direction, direction_rows in rows.items()}
+
+    assert written['grid'] and written['grid'] == written['openpyxl']
+    assert not any(row == 7 for _, row, _ in written['grid'])
+    assert totals['grid'] == totals['openpyxl'] == force_exact_totals.TOTALS
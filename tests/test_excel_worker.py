@@ -0,0 +1,24 @@
+from excel_worker import Sessions
+
+
+def test_sessions_bounded_by_estimated_size():
+    sessions = Sessions(size=4, ttl=60, max_bytes=1000, factor=10)
+    first = sessions.get('a', 40)
+    first['workbook'] = 'parsed'
+    assert sessions.get('a', 40) is first
+    sessions.get('b', 40)
+    # 400 + 400 + 400 passes max_bytes, so the least recently used one goes
+    sessions.get('c', 40)
+    assert list(sessions.entries) == ['b', 'c'] and sessions.total == 800
+    assert sessions.get('a', 40) == {}
+
+    # A workbook over the whole budget isn't kept, and doesn't push others out
+    assert sessions.get('d', 101) is None
+    assert list(sessions.entries) == ['c', 'a']
+
+
+def test_sessions_bounded_by_count():
+    sessions = Sessions(size=2, ttl=60, max_bytes=1000, factor=1)
+    for key in 'abc':
+        sessions.get(key, 10)
+    assert list(sessions.entries) == ['b', 'c'] and sessions.total == 20
@@ -0,0 +1,67 @@
+import zipfile
+
+import pytest
+
+import layout
+from benchmarks.synthetic import generate_workbook
+
+
+def fingerprint(path):
+    with zipfile.ZipFile(path) as zf:
+        return layout.fingerprint(zf)
+
+
+def rewrite_sheet(source, target, edit, part='xl/worksheets/sheet1.xml'):
+    """Copy a workbook with one worksheet part passed through edit"""
+    with zipfile.ZipFile(source) as zin, zipfile.ZipFile(target, 'w') as zout:
+        for info in zin.infolist():
+            data = zin.read(info)
+            zout.writestr(info, edit(data) if info.filename == part else data)
+    return target
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = str(tmp_path / 'day1.xlsx')
+    generate_workbook(path, hours=12, rows_per_bound=3, seed=1)
+    return path
+
+
+def test_same_template_shares_a_fingerprint(template, tmp_path):
+    other = str(tmp_path / 'day2.xlsx')
+    generate_workbook(other, hours=12, rows_per_bound=3, seed=2)
+    with zipfile.ZipFile(template) as a, zipfile.ZipFile(other) as b:
+        assert a.read('xl/worksheets/sheet1.xml') != b.read('xl/worksheets/sheet1.xml')
+    assert fingerprint(other) == fingerprint(template)
+
+
+@pytest.mark.parametrize('edit', [
+    # A label
+    lambda data: data.replace(b'<t>Bisil Bound 15-30</t>', b'<t>Bisil Bound 15-30 (lane 2)</t>', 1),
+    # A formula
+    lambda data: data.replace(b'<f>SUM(B3:M3)</f>', b'<f>SUM(B3:L3)</f>', 1),
+    # The row set
+    lambda data: data.replace(b'</sheetData>', b'<row r="90"><c r="B90"><v>1</v></c></row></sheetData>', 1),
+], ids=['label', 'formula', 'rows'])
+def test_structure_changes_the_fingerprint(template, tmp_path, edit):
+    changed = rewrite_sheet(template, str(tmp_path / 'changed.xlsx'), edit)
+    with zipfile.ZipFile(template) as a, zipfile.ZipFile(changed) as b:
+        assert a.read('xl/worksheets/sheet1.xml') != b.read('xl/worksheets/sheet1.xml')
+    assert fingerprint(changed) != fingerprint(template)
+
+
+def test_layout_cache_hits_and_misses(template, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'layouts')
+    first = layout.get_layout(template, cache_dir)
+
+    other = str(tmp_path / 'day2.xlsx')
+    generate_workbook(other, hours=12, rows_per_bound=3, seed=2)
+    built = []
+    monkeypatch.setattr(layout, 'build_layout', lambda zf, key: built.append(key) or {})
+    assert layout.get_layout(other, cache_dir) == first
+    assert built == []
+
+    changed = rewrite_sheet(template, str(tmp_path / 'changed.xlsx'),
+                            lambda data: data.replace(b'<f>SUM(B3:M3)</f>', b'<f>SUM(B3:L3)</f>', 1))
+    layout.get_layout(changed, cache_dir)
+    assert built == [fingerprint(changed)]
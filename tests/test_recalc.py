@@ -0,0 +1,87 @@
+import io
+import zipfile
+
+import layout
+import recalc
+import xlsx_patch
+from workbooks import SHEET, make_workbook, read_cells
+
+# D3:D5 hold one shared formula, written out on D3 only, as Excel saves a
+# filled-down column; D6 totals them. Every formula has its cached value.
+SHARED_ROWS = (
+    '<row r="3"><c r="B3"><v>10</v></c><c r="C3"><v>20</v></c>'
+    '<c r="D3"><f t="shared" ref="D3:D5" si="0">SUM(B3:C3)</f><v>30</v></c></row>'
+    '<row r="4"><c r="B4"><v>30</v></c><c r="C4"><v>40</v></c>'
+    '<c r="D4"><f t="shared" si="0"/><v>70</v></c></row>'
+    '<row r="5"><c r="B5"><v>50</v></c><c r="C5"><v>60</v></c>'
+    '<c r="D5"><f t="shared" si="0"/><v>110</v></c></row>'
+    '<row r="6"><c r="D6"><f>SUM(D3:D5)</f><v>210</v></c></row>'
+)
+
+
+def recalculate(workbook, changes):
+    cells = read_cells(workbook)
+    graph = recalc.formula_graph(workbook)
+    recalculated, stale = recalc.formula_changes(
+        graph, changes, lambda sheet, row, col: cells[(row, col)].value)
+    output = io.BytesIO()
+    workbook.seek(0)
+    xlsx_patch.patch_workbook(workbook, output, recalc.merge(changes, recalculated))
+    return read_cells(output), stale
+
+
+def test_shift_formula():
+    text = "SUM(B3:C3)+$A$1-Other!B$2+'My sheet'!$C4+LOG10(A1)&\"B3\""
+    assert xlsx_patch.shift_formula(text, 2, 1) == (
+        "SUM(C5:D5)+$A$1-Other!C$2+'My sheet'!$C6+LOG10(B3)&\"B3\"")
+
+
+def test_shared_formulas_are_expanded():
+    cells = read_cells(make_workbook(SHARED_ROWS))
+    assert [cells[(row, 4)].formula for row in (3, 4, 5)] == ['SUM(B3:C3)', 'SUM(B4:C4)', 'SUM(B5:C5)']
+
+    with zipfile.ZipFile(make_workbook(SHARED_ROWS)) as zf:
+        text = layout.build_layout(zf, None)['formula_text'][SHEET]
+    assert [4, 4, 'SUM(B4:C4)'] in text
+
+
+def test_shared_formulas_are_recalculated():
+    cells, stale = recalculate(make_workbook(SHARED_ROWS), {SHEET: {(4, 2): 66, (5, 3): 116}})
+    assert not stale
+    assert [cells[(row, 4)].value for row in (3, 4, 5, 6)] == [30, 106, 166, 302]
+    # The formulas themselves are kept
+    assert cells[(4, 4)].formula == 'SUM(B4:C4)'
+    assert cells[(6, 4)].formula == 'SUM(D3:D5)'
+
+
+def test_unresolved_formulas_go_stale():
+    # The shared formula's first cell is missing, so D4 and D5 can't be read
+    rows = SHARED_ROWS.replace('<f t="shared" ref="D3:D5" si="0">SUM(B3:C3)</f>', '')
+    cells, stale = recalculate(make_workbook(rows), {SHEET: {(4, 2): 66}})
+    assert stale == {(SHEET, 4, 4), (SHEET, 5, 4), (SHEET, 6, 4)}
+    assert cells[(4, 4)].value == 70
+
+
+def test_formulas_without_cell_references_go_stale():
+    # A whole column and a defined name: neither names the cells it reads
+    rows = SHARED_ROWS + ('<row r="7"><c r="D7"><f>SUM(B:B)</f><v>90</v></c>'
+                          '<c r="E7"><f>SUM(Counts)</f><v>90</v></c></row>')
+    cells, stale = recalculate(make_workbook(rows), {SHEET: {(4, 2): 66}})
+    assert {(SHEET, 7, 4), (SHEET, 7, 5)} <= stale
+    assert cells[(7, 4)].value == 90
+
+
+def test_cells_without_cached_results_are_not_counted(capsys):
+    rows = SHARED_ROWS.replace('<v>110</v>', '')
+    workbook = make_workbook(rows)
+    cells = read_cells(workbook)
+    graph = recalc.formula_graph(workbook)
+    changes = {SHEET: {(5, 2): 56}}
+    recalculated, stale = recalc.formula_changes(graph, changes, lambda sheet, row, col: cells[(row, col)].value)
+    unwritten = {}
+    workbook.seek(0)
+    xlsx_patch.patch_workbook(workbook, io.BytesIO(), recalc.merge(changes, recalculated), unwritten=unwritten)
+
+    assert unwritten == {SHEET: [(5, 4)]}
+    assert recalc.report(recalculated, stale, unwritten) == 1
+    assert '1 formula cells have no cached result' in capsys.readouterr().out
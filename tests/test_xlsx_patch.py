@@ -0,0 +1,93 @@
+import io
+import zipfile
+
+import openpyxl
+import pytest
+
+import xlsx_patch
+from benchmarks.synthetic import generate_workbook
+from modify_excel import modify_excel
+from workbooks import SHEET, make_workbook, read_cells
+
+ROWS = (
+    '<row r="2" spans="1:3"><c r="A2" t="inlineStr"><is><t>Bisil Bound 00-15</t></is></c>'
+    '<c r="C2"><v>7</v></c></row>'
+    '<row r="4" spans="1:3"><c r="A4" t="inlineStr"><is><t>old</t></is></c>'
+    '<c r="B4" t="n"><v>5</v></c><c r="C4"><f>B4*2</f><v>10</v></c></row>'
+)
+
+
+def patched_cells(rows, changes):
+    output = io.BytesIO()
+    xlsx_patch.patch_workbook(make_workbook(rows), output, {SHEET: changes})
+    return read_cells(output)
+
+
+def sheet_values(path):
+    wb = openpyxl.load_workbook(path)
+    return {name: [[cell.value for cell in row] for row in wb[name].iter_rows()] for name in wb.sheetnames}
+
+
+@pytest.mark.parametrize('operation', ['increase', 'decrease'])
+def test_patch_matches_openpyxl(tmp_path, monkeypatch, operation):
+    monkeypatch.setenv('LAYOUT_CACHE_DIR', str(tmp_path / 'layouts'))
+    source = str(tmp_path / 'counts.xlsx')
+    generate_workbook(source, hours=12, rows_per_bound=3, seed=1)
+    outputs = {}
+    for mode in ('openpyxl', 'patch'):
+        outputs[mode] = str(tmp_path / f'{mode}.xlsx')
+        modify_excel(source, outputs[mode], 13, operation, mode=mode, seed=42)
+
+    # Formulas read back as '=...', so this compares them as well as the counts
+    assert sheet_values(outputs['patch']) == sheet_values(outputs['openpyxl'])
+    assert sheet_values(outputs['patch']) != sheet_values(source)
+
+
+def test_insert_cells_in_existing_and_new_rows():
+    cells = patched_cells(ROWS, {(2, 2): 11, (2, 5): 13, (3, 3): 17})
+    # Into row 2 around the existing C2, and a new row 3 between rows 2 and 4
+    assert {position: cell.value for position, cell in cells.items() if position[0] in (2, 3)} == {
+        (2, 1): 'Bisil Bound 00-15', (2, 2): 11, (2, 3): 7, (2, 5): 13, (3, 3): 17}
+
+    output = io.BytesIO()
+    xlsx_patch.patch_workbook(make_workbook(ROWS), output, {SHEET: {(2, 2): 11, (3, 3): 17}})
+    with zipfile.ZipFile(output) as zf:
+        data = zf.read('xl/worksheets/sheet1.xml')
+    # spans no longer holds for a row that gained cells, so it is dropped
+    assert b'<row r="2"><c r="A2" t="inlineStr">' in data
+    assert data.index(b'r="B2"') < data.index(b'r="C2"') < data.index(b'<row r="3">') < data.index(b'<row r="4"')
+    # Rows without new cells are left as they were
+    assert b'<row r="4" spans="1:3">' in data
+
+
+def test_inline_string_and_number_cells():
+    cells = patched_cells(ROWS, {(4, 1): 9, (4, 2): 'text & more', (2, 1): 'Athi River Bound 00-15'})
+    assert cells[(4, 1)] == xlsx_patch.Cell(9, None)
+    assert cells[(4, 2)] == xlsx_patch.Cell('text & more', None)
+    assert cells[(2, 1)].value == 'Athi River Bound 00-15'
+
+
+def test_recalculated_cells():
+    cells = patched_cells(ROWS, {(4, 2): 6, (4, 3): xlsx_patch.Recalculated(2), (2, 3): xlsx_patch.Recalculated(1)})
+    assert cells[(4, 3)] == xlsx_patch.Cell(12, 'B4*2')
+    # Only formula cells are meant to get a delta, but a plain t="n" value follows it the same way
+    assert cells[(2, 3)].value == 8
+
+    unwritten = []
+    data = xlsx_patch.patch_sheet_xml(b'<sheetData><row r="1"><c r="A1" t="s"><v>0</v></c></row></sheetData>',
+                                      {(1, 1): xlsx_patch.Recalculated(1), (9, 1): xlsx_patch.Recalculated(1)},
+                                      unwritten)
+    assert data == b'<sheetData><row r="1"><c r="A1" t="s"><v>0</v></c></row></sheetData>'
+    assert sorted(unwritten) == [(1, 1), (9, 1)]
+
+
+def test_self_closing_sheet_data():
+    data = (b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            b'<dimension ref="A1"/><sheetData/><pageMargins left="0.7"/></worksheet>')
+    patched = xlsx_patch.patch_sheet_xml(data, {(3, 2): 4, (1, 1): 'Bound'})
+    assert patched == (b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                       b'<dimension ref="A1"/><sheetData><row r="1"><c r="A1" t="inlineStr"><is><t>Bound</t></is>'
+                       b'</c></row><row r="3"><c r="B3"><v>4</v></c></row></sheetData>'
+                       b'<pageMargins left="0.7"/></worksheet>')
+    rows = list(xlsx_patch.iter_stream_rows(io.BytesIO(patched), []))
+    assert rows == [(1, {1: xlsx_patch.Cell('Bound', None)}), (3, {2: xlsx_patch.Cell(4, None)})]
@@ -0,0 +1,389 @@
+import re
+import posixpath
+import zipfile
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse
+
+# An .xlsx file is a zip of XML parts. Changing count values only needs the
+# worksheet parts holding those cells, so everything here works on the parts
+# directly instead of building a whole openpyxl workbook.
+
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+WORKBOOK_PART = 'xl/workbook.xml'
+WORKBOOK_RELS_PART = 'xl/_rels/workbook.xml.rels'
+SHARED_STRINGS_PART = 'xl/sharedStrings.xml'
+
+# value is what openpyxl returns with data_only=True (the cached value for
+# formula cells); formula is the formula text without '=' or None.
+Cell = namedtuple('Cell', ['value', 'formula'])
+
+# A change to a formula cell's cached result by delta (see recalc.py): the
+# formula is kept and only its <v> is rewritten. Cells without a numeric
+# cached value are left as they are.
+Recalculated = namedtuple('Recalculated', ['delta'])
+
+_ROW_RE = re.compile(rb'<row\b([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+_CELL_RE = re.compile(rb'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_R_ATTR_RE = re.compile(rb'\br="([A-Z]*)(\d*)"')
+_T_ATTR_RE = re.compile(rb'\s+t="[^"]*"')
+_SPANS_ATTR_RE = re.compile(rb'\s+spans="[^"]*"')
+_SHEET_DATA_RE = re.compile(rb'<sheetData\s*/>|<sheetData\b[^>]*>(.*?)</sheetData>', re.S)
+_CALC_PR_RE = re.compile(rb'<calcPr\b[^>]*?/?>')
+_FULL_CALC_RE = re.compile(rb'\s+fullCalcOnLoad="[^"]*"')
+_V_RE = re.compile(rb'<v>([^<]*)</v>')
+# A string literal, or a cell reference with its optional sheet and $ anchors
+_FORMULA_REF_RE = re.compile(r"""("[^"]*")|(?<![\w.])((?:'(?:[^']|'')+'|[A-Za-z_][\w.]*)!)?"""
+                             r"""(\$?)([A-Z]{1,3})(\$?)(\d+)(?![\w(])""")
+
+_column_indexes = {}
+
+
+def column_index(letters):
+    """Convert column letters ('A', 'M', 'AB') to a 1-based index"""
+    index = _column_indexes.get(letters)
+    if index is None:
+        index = 0
+        for char in letters:
+            index = index * 26 + ord(char) - 64
+        _column_indexes[letters] = index
+    return index
+
+
+def column_letters(index):
+    """Convert a 1-based column index to letters"""
+    letters = ''
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def sheet_parts(zf):
+    """Map sheet names to their worksheet part names, in workbook order"""
+    targets = {}
+    with zf.open(WORKBOOK_RELS_PART) as rels:
+        for _, elem in iterparse(rels):
+            if elem.tag == PKG_REL_NS + 'Relationship':
+                target = elem.get('Target')
+                if target.startswith('/'):
+                    target = target[1:]
+                else:
+                    target = posixpath.normpath(posixpath.join('xl', target))
+                targets[elem.get('Id')] = target
+
+    parts = {}
+    with zf.open(WORKBOOK_PART) as workbook:
+        for _, elem in iterparse(workbook):
+            if elem.tag == NS + 'sheet':
+                parts[elem.get('name')] = targets[elem.get(REL_NS + 'id')]
+    return parts
+
+
+def shared_strings(zf):
+    """Load the shared string table (empty if the workbook has none)"""
+    if SHARED_STRINGS_PART not in zf.namelist():
+        return []
+    strings = []
+    with zf.open(SHARED_STRINGS_PART) as part:
+        for _, elem in iterparse(part):
+            if elem.tag == NS + 'si':
+                strings.append(_element_text(elem))
+                elem.clear()
+    return strings
+
+
+def _element_text(elem):
+    # Rich text runs each carry their own <t>; phonetic hints (rPh) are not
+    # part of the displayed value.
+    texts = []
+    for child in elem:
+        if child.tag == NS + 't':
+            texts.append(child.text or '')
+        elif child.tag == NS + 'r':
+            for t in child.iter(NS + 't'):
+                texts.append(t.text or '')
+    return ''.join(texts)
+
+
+def _cast_number(text):
+    if '.' in text or 'E' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+
+def shift_formula(text, rows, cols):
+    """
+    A formula moved by rows and cols, as Excel fills it: references move
+    with it except for the parts anchored with $
+    """
+    def shift(match):
+        if match.group(1):
+            return match.group(1)
+        sheet, col_anchor, col, row_anchor, row = match.group(2, 3, 4, 5, 6)
+        if not col_anchor:
+            col = column_letters(column_index(col) + cols)
+        if not row_anchor:
+            row = str(int(row) + rows)
+        return (sheet or '') + col_anchor + col + row_anchor + row
+    return _FORMULA_REF_RE.sub(shift, text)
+
+
+def _parse_cell(elem, strings, shared=None, row=None, col=None):
+    cell_type = elem.get('t', 'n')
+    formula = None
+    value = None
+    text = None
+    for child in elem:
+        if child.tag == NS + 'v':
+            text = child.text
+        elif child.tag == NS + 'f':
+            formula = child.text or ''
+            if shared is not None and child.get('t') == 'shared':
+                # A shared formula is written out once, on the first cell of
+                # its range; the others only name it by si and get the same
+                # formula moved to where they are
+                if formula:
+                    shared[child.get('si')] = (row, col, formula)
+                elif child.get('si') in shared:
+                    first_row, first_col, first_formula = shared[child.get('si')]
+                    formula = shift_formula(first_formula, row - first_row, col - first_col)
+        elif child.tag == NS + 'is':
+            value = _element_text(child)
+    if text is not None:
+        if cell_type == 'n':
+            value = _cast_number(text)
+        elif cell_type == 's':
+            value = strings[int(text)]
+        elif cell_type == 'b':
+            value = bool(int(text))
+        else:
+            value = text
+    return Cell(value, formula)
+
+
+def iter_rows(zf, part, strings, max_col=None, rows=None):
+    """
+    Lazily yield (row_number, {column: Cell}) for every row of a worksheet part,
+    or only for the row numbers in rows. Parsed rows are discarded as soon as
+    they are yielded, so memory stays flat however long the sheet is.
+    """
+    with zf.open(part) as stream:
+        yield from iter_stream_rows(stream, strings, max_col, rows)
+
+
+def iter_stream_rows(stream, strings, max_col=None, rows=None):
+    """
+    iter_rows on an already opened worksheet part (any binary file object).
+    Shared formulas come out expanded for each of their cells, unless rows
+    leaves out the row where the formula is written, which gives them ''.
+    """
+    sheet_data = None
+    shared = {}
+    row_number = 0
+    for event, elem in iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == NS + 'sheetData':
+                sheet_data = elem
+            continue
+        if elem.tag != NS + 'row':
+            continue
+
+        row_number = int(elem.get('r', row_number + 1))
+        if rows is None or row_number in rows:
+            cells = {}
+            col = 0
+            for c in elem:
+                ref = c.get('r')
+                col = column_index(ref.rstrip('0123456789')) if ref else col + 1
+                if max_col is not None and col > max_col:
+                    break
+                cells[col] = _parse_cell(c, strings, shared, row_number, col)
+            yield row_number, cells
+
+        elem.clear()
+        if sheet_data is not None:
+            sheet_data.clear()
+
+
+def _escape(text):
+    # What xml.sax.saxutils.escape does, without the import: saxutils pulls
+    # in urllib.request, http.client and email, which is most of this
+    # module's import time
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _format_cell(attrs, value, body=b''):
+    attrs = _T_ATTR_RE.sub(b'', attrs)
+    if value is None:
+        return b'<c' + attrs + b'/>'
+    if isinstance(value, bool):
+        return b'<c' + attrs + b' t="b">' + body + b'<v>' + (b'1' if value else b'0') + b'</v></c>'
+    if isinstance(value, (int, float)):
+        return b'<c' + attrs + b'>' + body + b'<v>' + repr(value).encode() + b'</v></c>'
+    if isinstance(value, str) and value.startswith('='):
+        # A formula, as openpyxl takes it, without a cached result
+        return b'<c' + attrs + b'><f>' + _escape(value[1:]).encode('utf-8') + b'</f></c>'
+    text = _escape(str(value)).encode('utf-8')
+    return b'<c' + attrs + b' t="inlineStr"><is><t>' + text + b'</t></is></c>'
+
+
+def _recalculated_cell(match, delta):
+    attrs, content = match.group(1), match.group(2) or b''
+    cached = _V_RE.search(content)
+    cell_type = _T_ATTR_RE.search(attrs)
+    if cached is None or (cell_type and cell_type.group(0).strip() != b't="n"'):
+        return None
+    value = _cast_number(cached.group(1).decode()) + delta
+    return (b'<c' + attrs + b'>' + content[:cached.start()] + b'<v>' + repr(value).encode() + b'</v>'
+            + content[cached.end():] + b'</c>')
+
+
+def _patch_row(row_number, content, cells, unwritten):
+    pending = dict(cells)
+
+    def replace(match):
+        ref = _R_ATTR_RE.search(match.group(1))
+        col = column_index(ref.group(1).decode())
+        if col not in pending:
+            return match.group(0)
+        value = pending.pop(col)
+        if isinstance(value, Recalculated):
+            cell = _recalculated_cell(match, value.delta)
+            if cell is None:
+                unwritten.append((row_number, col))
+                return match.group(0)
+            return cell
+        return _format_cell(match.group(1), value)
+
+    content = _CELL_RE.sub(replace, content)
+    # A formula cell that isn't there has no cached value to update
+    unwritten.extend((row_number, col) for col, value in pending.items() if isinstance(value, Recalculated))
+    pending = {col: value for col, value in pending.items() if not isinstance(value, Recalculated)}
+    if not pending:
+        return content, False
+
+    # Cells that don't exist yet are inserted in column order
+    pieces = []
+    existing = [(column_index(_R_ATTR_RE.search(m.group(1)).group(1).decode()), m)
+                for m in _CELL_RE.finditer(content)]
+    position = 0
+    for col in sorted(pending):
+        for existing_col, match in existing:
+            if existing_col > col and match.start() >= position:
+                insert_at = match.start()
+                break
+        else:
+            insert_at = len(content)
+        pieces.append(content[position:insert_at])
+        ref = (column_letters(col) + str(row_number)).encode()
+        pieces.append(_format_cell(b' r="' + ref + b'"', pending[col]))
+        position = insert_at
+    pieces.append(content[position:])
+    return b''.join(pieces), True
+
+
+def patch_sheet_xml(data, cells, unwritten=None):
+    """
+    Rewrite the values of the given cells in one worksheet part.
+    cells maps (row, column) to the new value, or to a Recalculated delta
+    for a formula cell; every other byte of the part is left untouched.
+    Cells and rows that don't exist yet are created. The (row, column) of
+    Recalculated cells with no numeric cached value to update are appended
+    to unwritten when given.
+    """
+    unwritten = unwritten if unwritten is not None else []
+    by_row = {}
+    for (row, col), value in cells.items():
+        by_row.setdefault(row, {})[col] = value
+
+    sheet_data = _SHEET_DATA_RE.search(data)
+    content = sheet_data.group(1) or b''
+    pending_rows = dict(by_row)
+
+    def replace(match):
+        attrs = match.group(1)
+        row_number = int(_R_ATTR_RE.search(attrs).group(2))
+        if row_number not in pending_rows:
+            return match.group(0)
+        row_content, inserted = _patch_row(row_number, match.group(2) or b'',
+                                           pending_rows.pop(row_number), unwritten)
+        if inserted:
+            attrs = _SPANS_ATTR_RE.sub(b'', attrs)
+        return b'<row' + attrs + b'>' + row_content + b'</row>'
+
+    content = _ROW_RE.sub(replace, content)
+    # Rows that aren't there are only created for values
+    for row, row_cells in list(pending_rows.items()):
+        if all(isinstance(value, Recalculated) for value in row_cells.values()):
+            unwritten.extend((row, col) for col in row_cells)
+            del pending_rows[row]
+
+    if pending_rows:
+        existing = [(int(_R_ATTR_RE.search(m.group(1)).group(2)), m.start())
+                    for m in _ROW_RE.finditer(content)]
+        pieces = []
+        position = 0
+        for row_number in sorted(pending_rows):
+            insert_at = next((start for existing_row, start in existing
+                              if existing_row > row_number and start >= position),
+                             len(content))
+            pieces.append(content[position:insert_at])
+            row_content, _ = _patch_row(row_number, b'', pending_rows[row_number], unwritten)
+            pieces.append(b'<row r="' + str(row_number).encode() + b'">' + row_content + b'</row>')
+            position = insert_at
+        pieces.append(content[position:])
+        content = b''.join(pieces)
+
+    return (data[:sheet_data.start()] + b'<sheetData>' + content + b'</sheetData>'
+            + data[sheet_data.end():])
+
+
+def _force_full_calc(data):
+    # Same flag openpyxl writes on save: cached formula results may be stale,
+    # so Excel recalculates when the file is opened.
+    match = _CALC_PR_RE.search(data)
+    if match:
+        calc_pr = _FULL_CALC_RE.sub(b'', match.group(0))
+        calc_pr = calc_pr.replace(b'<calcPr', b'<calcPr fullCalcOnLoad="1"', 1)
+        return data[:match.start()] + calc_pr + data[match.end():]
+    for anchor in (b'</definedNames>', b'</externalReferences>', b'</sheets>'):
+        index = data.find(anchor)
+        if index != -1:
+            index += len(anchor)
+            return data[:index] + b'<calcPr fullCalcOnLoad="1"/>' + data[index:]
+    return data
+
+
+def patch_workbook(input_file, output_file, changes, full_calc_on_load=True, patched=None, unwritten=None):
+    """
+    Write a copy of input_file with changed cell values.
+    changes maps sheet names to {(row, column): value}; a string starting
+    with '=' is written as a formula. Only the worksheet parts named in
+    changes are rewritten; all other zip members are copied unchanged.
+    input_file and output_file may be paths or file objects.
+    patched optionally maps sheet names to worksheet XML that has already
+    been through patch_sheet_xml (see modify_excel's --workers), which is
+    written as it is. unwritten, when given, is filled with {sheet name:
+    [(row, column)]} of the Recalculated cells that had no cached value.
+    """
+    with zipfile.ZipFile(input_file) as zin:
+        parts = sheet_parts(zin)
+        targets = {parts[name]: cells for name, cells in changes.items() if cells}
+        names = {part: name for name, part in parts.items()}
+        done = {parts[name]: data for name, data in (patched or {}).items()}
+
+        with zipfile.ZipFile(output_file, 'w') as zout:
+            for info in zin.infolist():
+                if info.filename in done:
+                    data = done[info.filename]
+                else:
+                    data = zin.read(info)
+                    if info.filename in targets:
+                        sheet_unwritten = [] if unwritten is None else unwritten.setdefault(names[info.filename], [])
+                        data = patch_sheet_xml(data, targets[info.filename], sheet_unwritten)
+                    elif info.filename == WORKBOOK_PART and full_calc_on_load and targets:
+                        data = _force_full_calc(data)
+                zout.writestr(info, data, compress_type=info.compress_type)